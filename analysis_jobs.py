@@ -0,0 +1,206 @@
+"""
+Analysis Job Queue Module
+Bounded worker pool for asynchronous /lab/analyze jobs. Job state lives in
+the AnalysisJob table, so queued or interrupted jobs are picked up again
+after a process restart.
+
+Several web processes share the table: a process claims a job with a
+conditional UPDATE before running it and holds a lease on it, renewed at
+every stage. Only jobs still queued, or running with an expired lease, can
+be claimed, so a job is never run by two live processes at once.
+"""
+import os
+import uuid
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+JOB_STAGES = ('upload', 'quality', 'inference', 'saved')
+TERMINAL_STATUSES = ('done', 'failed')
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when too many analysis jobs are already pending"""
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def job_to_dict(job):
+    """Status payload shared by the polling and SSE endpoints"""
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'stage': job.stage,
+        'stage_index': JOB_STAGES.index(job.stage) if job.stage in JOB_STAGES else 0,
+        'stages': list(JOB_STAGES),
+        'prediction_id': job.prediction_id,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+class AnalysisJobQueue:
+    """
+    Runs `handler(job, set_stage)` for each submitted job on a fixed number
+    of worker threads, inside an application context
+
+    The handler does the actual analysis and must add its Prediction to the
+    session without committing; the queue commits it together with the
+    'done' status so a job is never marked done without its result (and a
+    crash before that commit re-runs the job on the next start).
+    `on_complete(job, prediction)` runs after that commit (audit logging).
+    """
+
+    def __init__(self, app, handler, on_complete=None, max_workers=2, max_pending=64, max_attempts=3,
+                 lease_seconds=600):
+        self.app = app
+        self.handler = handler
+        self.on_complete = on_complete
+        self.max_pending = max(1, int(max_pending))
+        self.max_attempts = max(1, int(max_attempts))
+        self.lease = timedelta(seconds=lease_seconds)
+        self.owner = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix='analysis-job')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'resumed': 0,
+                       'claimed_elsewhere': 0, 'lease_lost': 0}
+
+    def submit(self, job_id):
+        """Queue a committed AnalysisJob row by id"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise JobQueueFull("Too many analyses in progress, try again shortly")
+            self._pending += 1
+            self._stats['submitted'] += 1
+        self._executor.submit(self._run, job_id)
+
+    def _claimable(self, now):
+        """Jobs no live process holds: queued, or running with an expired (or no) lease"""
+        expired = db.or_(AnalysisJob.lease_expires_at.is_(None), AnalysisJob.lease_expires_at < now)
+        return db.or_(AnalysisJob.status == 'queued', db.and_(AnalysisJob.status == 'running', expired))
+
+    def _claim(self, job_id):
+        """Atomically take a claimable job; False if another process has it"""
+        now = datetime.utcnow()
+        claimed = AnalysisJob.query.filter(AnalysisJob.id == job_id, self._claimable(now)).update({
+            'status': 'running',
+            'stage': 'upload',
+            'attempts': db.func.coalesce(AnalysisJob.attempts, 0) + 1,
+            'lease_owner': self.owner,
+            'lease_expires_at': now + self.lease,
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def resume(self):
+        """Queue jobs left queued, or running under an expired lease (a process that died)"""
+        now = datetime.utcnow()
+        unfinished = AnalysisJob.query.filter(self._claimable(now)).order_by(AnalysisJob.created_at).all()
+        resumed = []
+        for job in unfinished:
+            if job.status == 'running' and (job.attempts or 0) >= self.max_attempts:
+                AnalysisJob.query.filter(AnalysisJob.id == job.id, self._claimable(now)).update({
+                    'status': 'failed',
+                    'error': job.error or 'Interrupted too many times',
+                }, synchronize_session=False)
+                continue
+            resumed.append(job.id)
+        db.session.commit()
+
+        for job_id in resumed:
+            with self._lock:
+                self._pending += 1
+                self._stats['resumed'] += 1
+            self._executor.submit(self._run, job_id)
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} unfinished analysis jobs")
+        return len(resumed)
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                self._process(job_id)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _process(self, job_id):
+        if not self._claim(job_id):
+            with self._lock:
+                self._stats['claimed_elsewhere'] += 1
+            db.session.remove()
+            return
+        job = db.session.get(AnalysisJob, job_id, populate_existing=True)
+
+        def set_stage(stage):
+            # Progress also renews the lease (a no-op once another process took the job over)
+            AnalysisJob.query.filter_by(id=job_id, lease_owner=self.owner).update({
+                'stage': stage,
+                'lease_expires_at': datetime.utcnow() + self.lease,
+            }, synchronize_session=False)
+            db.session.commit()
+
+        try:
+            prediction = self.handler(job, set_stage)
+            db.session.flush()
+            # Committed together with the result only while this process still holds the job
+            finished = AnalysisJob.query.filter_by(id=job_id, lease_owner=self.owner).update({
+                'prediction_id': prediction.id,
+                'stage': 'saved',
+                'status': 'done',
+                'lease_expires_at': None,
+            }, synchronize_session=False)
+            if finished != 1:
+                db.session.rollback()
+                logger.warning(f"Analysis job {job_id}: lease lost to another process, result discarded")
+                with self._lock:
+                    self._stats['lease_lost'] += 1
+                db.session.remove()
+                return
+            db.session.commit()
+            job = db.session.get(AnalysisJob, job_id, populate_existing=True)
+            with self._lock:
+                self._stats['completed'] += 1
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {e}")
+            db.session.rollback()
+            AnalysisJob.query.filter_by(id=job_id, lease_owner=self.owner).update({
+                'status': 'failed',
+                'error': str(e),
+                'lease_expires_at': None,
+            }, synchronize_session=False)
+            db.session.commit()
+            with self._lock:
+                self._stats['failed'] += 1
+            db.session.remove()
+            return
+
+        try:
+            if self.on_complete:
+                self.on_complete(job, prediction)
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} completion hook failed: {e}")
+        finally:
+            db.session.remove()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['pending'] = self._pending
+        s['max_pending'] = self.max_pending
+        return s
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -8,25 +8,32 @@ from PIL import Image
 import numpy as np
 
 import pandas as pd
-from io import BytesIO
 import base64
 import logging
 logging.basicConfig(filename='flask_debug.log', level=logging.DEBUG, 
                     format='%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s')
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from flask_cors import CORS, cross_origin # Import CORS
 from config import Config
-from models import db, User, Prediction, Appointment, Document, LabBooking, AuditLog
-from model.architectures import get_model, predict_with_uncertainty # Re-enable imports
+from models import db, User, Prediction, Appointment, Document, LabBooking, AuditLog, AnalysisJob, ShadowPrediction, RescoredPrediction
+from model.architectures import get_model, predict_with_uncertainty, gradcam_from_activations, load_ensemble_models, ensemble_version # Re-enable imports
+from preprocessing import CLASS_NAMES, INPUT_SIZE, transform, transform_vis, decode_image, pixels_to_tensor
+from heatmap_render import OVERLAY_ALPHA, FORMATS as HEATMAP_FORMATS
+from inference_service import (InferenceEngine, InferenceRuntime, SchedulerOverloaded, ModelWarmup, ModelsNotReady,
+                               use_serving_runtime)
+from inference_workers import InferencePoolClient, pool_address
+from model.registry import ModelRegistry, RegistryError
+from shadow_service import ShadowEvaluator, shadow_report
+from backfill_service import RescoreBackfill, BackfillBusy
+from image_quality import QualityGate, ImageQualityRejected
+from heatmap_service import LazyHeatmaps, RenderCache, member_cams_relpath
+from result_cache import ResultCache, content_hash
+from analysis_jobs import AnalysisJobQueue, JobQueueFull, TERMINAL_STATUSES, new_job_id, job_to_dict
 from ocr_service import get_ocr_service  # OCR for document text extraction
 from chat_service import ChatService # Import ChatService
-from scipy.ndimage import zoom
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
 try:
     import requests
     REQUESTS_AVAILABLE = True
@@ -36,6 +43,9 @@ except ImportError:
 import socket
 import threading
 import time
+import zipfile
+import io
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 # Enable CORS for all domains, supporting credentials (cookies) for session auth
@@ -119,140 +129,323 @@ def log_event(action, target_type, target_id, details, user_id=None):
         print(f"Error logging event: {e}")
         db.session.rollback()
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+def init_database():
+    """Create tables, apply the column migrations and seed the admin user"""
+    with app.app_context():
+        db.create_all()
     
-    # Migration: Add heatmap_path column if it doesn't exist
-    try:
-        # Check if prediction table exists and if heatmap_path column exists
-        with db.engine.connect() as conn:
-            # Get table info
-            result = conn.execute(db.text("PRAGMA table_info(prediction)"))
-            columns = [row[1] for row in result]
+        # Migration: Add heatmap_path column if it doesn't exist
+        try:
+            # Check if prediction table exists and if heatmap_path column exists
+            with db.engine.connect() as conn:
+                # Get table info
+                result = conn.execute(db.text("PRAGMA table_info(prediction)"))
+                columns = [row[1] for row in result]
             
-            if 'heatmap_path' not in columns:
-                # Add the column
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN heatmap_path VARCHAR(200)'))
-                conn.commit()
-                print("Migration: Added heatmap_path column to prediction table")
-            else:
-                print("Migration: heatmap_path column already exists")
+                if 'heatmap_path' not in columns:
+                    # Add the column
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN heatmap_path VARCHAR(200)'))
+                    conn.commit()
+                    print("Migration: Added heatmap_path column to prediction table")
+                else:
+                    print("Migration: heatmap_path column already exists")
 
-            # Migration: Add uncertainty column
-            if 'uncertainty' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN uncertainty FLOAT'))
-                conn.commit()
-                print("Migration: Added uncertainty column to prediction table")
-            else:
-                 print("Migration: uncertainty column already exists")
-    except Exception as e:
-        # Table might not exist yet (will be created by create_all with new column)
-        if 'no such table' not in str(e).lower():
-            print(f"Migration note: {e}")
+                # Migration: Add uncertainty column
+                if 'uncertainty' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN uncertainty FLOAT'))
+                    conn.commit()
+                    print("Migration: Added uncertainty column to prediction table")
+                else:
+                     print("Migration: uncertainty column already exists")
+        except Exception as e:
+            # Table might not exist yet (will be created by create_all with new column)
+            if 'no such table' not in str(e).lower():
+                print(f"Migration note: {e}")
 
-    try:
-        with db.engine.connect() as conn:
-            # Check for Lab License in User table
-            result = conn.execute(db.text("PRAGMA table_info(user)"))
-            columns = [row[1] for row in result]
-            if 'lab_license' not in columns:
-                conn.execute(db.text('ALTER TABLE user ADD COLUMN lab_license VARCHAR(50)'))
-                conn.commit()
-                print("Migration: Added lab_license to user table")
+        try:
+            with db.engine.connect() as conn:
+                # Check for Lab License in User table
+                result = conn.execute(db.text("PRAGMA table_info(user)"))
+                columns = [row[1] for row in result]
+                if 'lab_license' not in columns:
+                    conn.execute(db.text('ALTER TABLE user ADD COLUMN lab_license VARCHAR(50)'))
+                    conn.commit()
+                    print("Migration: Added lab_license to user table")
             
-            # Check for Lab fields in Prediction table
-            result = conn.execute(db.text("PRAGMA table_info(prediction)"))
-            columns = [row[1] for row in result]
+                # Check for Lab fields in Prediction table
+                result = conn.execute(db.text("PRAGMA table_info(prediction)"))
+                columns = [row[1] for row in result]
             
-            if 'lab_id' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN lab_id INTEGER REFERENCES user(id)'))
-                conn.commit()
-                print("Migration: Added lab_id to prediction table")
+                if 'lab_id' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN lab_id INTEGER REFERENCES user(id)'))
+                    conn.commit()
+                    print("Migration: Added lab_id to prediction table")
             
-            if 'doctor_id' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN doctor_id INTEGER REFERENCES user(id)'))
-                conn.commit()
-                print("Migration: Added doctor_id to prediction table")
+                if 'doctor_id' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN doctor_id INTEGER REFERENCES user(id)'))
+                    conn.commit()
+                    print("Migration: Added doctor_id to prediction table")
                 
-            if 'is_visible_to_patient' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN is_visible_to_patient BOOLEAN DEFAULT 0'))
-                conn.commit()
-                print("Migration: Added is_visible_to_patient to prediction table")
+                if 'is_visible_to_patient' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN is_visible_to_patient BOOLEAN DEFAULT 0'))
+                    conn.commit()
+                    print("Migration: Added is_visible_to_patient to prediction table")
+            
+                if 'annotated_image_path' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN annotated_image_path VARCHAR(200)'))
+                    conn.commit()
+                    print("Migration: Added annotated_image_path to prediction table")
+            
+                if 'doctor_notes' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN doctor_notes TEXT'))
+                    conn.commit()
+                    print("Migration: Added doctor_notes to prediction table")
             
-            if 'annotated_image_path' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN annotated_image_path VARCHAR(200)'))
-                conn.commit()
-                print("Migration: Added annotated_image_path to prediction table")
+                if 'models_used' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN models_used VARCHAR(100)'))
+                    conn.commit()
+                    print("Migration: Added models_used to prediction table")
             
-            if 'doctor_notes' not in columns:
-                conn.execute(db.text('ALTER TABLE prediction ADD COLUMN doctor_notes TEXT'))
-                conn.commit()
-                print("Migration: Added doctor_notes to prediction table")
-        
-        # Check for AuditLog table
-        inspector = db.inspect(db.engine)
-        if 'audit_log' not in inspector.get_table_names():
-            db.create_all() # This should assign it if not exists, but let's be safe or rely on create_all
-            print("Migration: Verified/Created AuditLog table")
+                if 'model_version' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN model_version VARCHAR(64)'))
+                    conn.commit()
+                    print("Migration: Added model_version to prediction table")
+            
+                if 'eye' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN eye VARCHAR(5)'))
+                    conn.commit()
+                    print("Migration: Added eye to prediction table")
+            
+                if 'cam_path' not in columns:
+                    conn.execute(db.text('ALTER TABLE prediction ADD COLUMN cam_path VARCHAR(200)'))
+                    conn.commit()
+                    print("Migration: Added cam_path to prediction table")
+            
+                # Job leases (several processes share the analysis job table)
+                result = conn.execute(db.text("PRAGMA table_info(analysis_job)"))
+                columns = [row[1] for row in result]
+                if columns and 'lease_owner' not in columns:
+                    conn.execute(db.text('ALTER TABLE analysis_job ADD COLUMN lease_owner VARCHAR(64)'))
+                    conn.execute(db.text('ALTER TABLE analysis_job ADD COLUMN lease_expires_at DATETIME'))
+                    conn.commit()
+                    print("Migration: Added job lease columns to analysis_job table")
+        
+            # Check for AuditLog table
+            inspector = db.inspect(db.engine)
+            if 'audit_log' not in inspector.get_table_names():
+                db.create_all() # This should assign it if not exists, but let's be safe or rely on create_all
+                print("Migration: Verified/Created AuditLog table")
                 
-    except Exception as e:
-        print(f"Migration error (Lab fields): {e}")
-    
-    # Create admin user if not exists
-    admin = User.query.filter_by(email='admin@smarteyecare.com').first()
-    if not admin:
-        admin = User(
-            email='admin@smarteyecare.com',
-            name='Admin',
-            user_type='admin'
-        )
-        admin.set_password('admin123')
-        db.session.add(admin)
-        db.session.commit()
+        except Exception as e:
+            print(f"Migration error (Lab fields): {e}")
+    
+        # Create admin user if not exists
+        admin = User.query.filter_by(email='admin@smarteyecare.com').first()
+        if not admin:
+            admin = User(
+                email='admin@smarteyecare.com',
+                name='Admin',
+                user_type='admin'
+            )
+            admin.set_password('admin123')
+            db.session.add(admin)
+            db.session.commit()
+
+# Create database tables
+init_database()
 
 # Load Ensemble Models
 loaded_models = {}
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-def load_ensemble_models():
-    """Loads all available models for ensemble prediction"""
-    models_dict = {}
+# Ensemble settings (cascade mode sends only unsure or clinically sensitive images to ResNet50)
+ENSEMBLE_MODE = app.config['ENSEMBLE_MODE']
+CASCADE_THRESHOLD = app.config['CASCADE_CONFIDENCE_THRESHOLD']
+CASCADE_SENSITIVE_IDX = sorted(CLASS_NAMES.index(c) for c in app.config['CASCADE_SENSITIVE_CLASSES'] if c in CLASS_NAMES)
+
+# With a worker pool the pool runs the configured variant; this process keeps the
+# memory-mapped fp32 models (shared pages) only for GradCAM's head replay.
+use_inference_pool = app.config['INFERENCE_WORKERS'] > 0 and device.type == 'cpu'
+
+# Versioned weight sets (model/registry/); the active version is loaded at startup
+model_registry = ModelRegistry(app.config['MODEL_REGISTRY_DIR'])
+
+# Serving InferenceRuntime (models, engine, scheduler for one model version).
+# Replaced as a single reference on hot swap; None until the warmup thread has loaded it.
+inference_runtime = None
+
+def _scheduler_options():
+    return {
+        'max_batch_size': app.config['INFERENCE_MAX_BATCH_SIZE'],
+        'max_wait_ms': app.config['INFERENCE_BATCH_WINDOW_MS'],
+        'max_queue_size': app.config['INFERENCE_MAX_QUEUE_SIZE'],
+    }
+
+def _build_inference_runtime(version):
+    """Verify, load and warm up one registry version (does not start serving it)"""
+    checksums = model_registry.verify(version)
+    weight_files = model_registry.weight_files(version)
+    models_dict = load_ensemble_models(device,
+                                       quantize=app.config['INFERENCE_QUANTIZE'] and not use_inference_pool,
+                                       backend='eager' if use_inference_pool else app.config['INFERENCE_BACKEND'],
+                                       compiled_dir=app.config['COMPILED_MODEL_DIR'],
+                                       weight_files=weight_files)
+    if not models_dict:
+        raise RuntimeError(f"No ensemble models could be loaded for version {version}")
+    
+    # Single-pass engine: one forward per model gives probabilities, uncertainty, the GradCAM
+    # activations (AlexNet) and forward-only class activation maps (ResNet50)
+    engine = InferenceEngine(
+        models_dict,
+        capture=('alexnet',),
+        cam=('resnet50',),
+        mode=ENSEMBLE_MODE,
+        cascade_threshold=CASCADE_THRESHOLD,
+        sensitive_classes=CASCADE_SENSITIVE_IDX
+    )
     
-    # 1. Load Primary Model (AlexNet) - This MUST exist for legacy support
-    print("Loading Primary Model (AlexNet)...")
+    # Batches run in the shared worker pool (separate processes, pinned threads) or in-process
+    if use_inference_pool:
+        # Worker threads are pinned inside the pool processes; this process keeps its own
+        # threads for GradCAM, shadow evaluation and backfill
+        server_args = [
+            '--workers', str(app.config['INFERENCE_WORKERS']),
+            '--backend', app.config['INFERENCE_BACKEND'],
+            '--compiled-dir', app.config['COMPILED_MODEL_DIR'],
+            '--mode', ENSEMBLE_MODE,
+            '--cascade-threshold', str(CASCADE_THRESHOLD),
+            '--sensitive-classes', ','.join(str(c) for c in CASCADE_SENSITIVE_IDX),
+            '--weights', ','.join(f"{name}={os.path.abspath(path)}" for name, path in weight_files.items()),
+            '--idle-exit', str(app.config['INFERENCE_POOL_IDLE_EXIT']),
+        ] + (['--quantize'] if app.config['INFERENCE_QUANTIZE'] else [])
+        pool = InferencePoolClient(
+            # One pool server per configuration and set of weights
+            pool_address(app.config['INFERENCE_POOL_ADDRESS'], server_args, checksums),
+            app.config['SECRET_KEY'].encode('utf-8'),
+            timeout=app.config['INFERENCE_POOL_TIMEOUT'],
+            log_path=app.config['INFERENCE_POOL_LOG'],
+            server_args=server_args
+        )
+        runner = pool.run_batch
+    else:
+        pool = None
+        runner = engine.run_batch
+    
+    runtime = InferenceRuntime(
+        model_registry.version_label(version, checksums), models_dict, engine, runner,
+        scheduler_options=_scheduler_options(),
+        pool=pool,
+        checksums=checksums,
+        # Result cache key: weight checksums plus every setting that changes the outputs
+        cache_version=ensemble_version(
+            models_dict, checksums=checksums,
+            variant=f"int8={app.config['INFERENCE_QUANTIZE']};mode={ENSEMBLE_MODE};"
+                    f"threshold={CASCADE_THRESHOLD};sensitive={CASCADE_SENSITIVE_IDX}")
+    )
+    _warmup_inference_runtime(runtime)
+    return runtime
+
+def _warmup_inference_runtime(runtime):
+    """Dummy forward (and GradCAM head replay) so kernels and allocators are primed"""
+    dummy = torch.zeros(1, 3, 227, 227, device=device)
+    result = runtime.run_batch(dummy)[0]
+    activation = result['activations'].get('alexnet')
+    head = runtime.engine.explain_head('alexnet')
+    if activation is not None and head is not None:
+        gradcam_from_activations(head, activation.to(device), 0)
+
+def _activate_runtime(runtime):
+    """Atomically start serving `runtime`; the previous one drains in the background"""
+    global inference_runtime
+    previous, inference_runtime = inference_runtime, runtime
+    # Results cached under the previous weights are dropped when the version changes
+    result_cache.set_model_version(runtime.cache_version)
+    print(f"Serving model version {runtime.version}")
+    if previous is not None:
+        def drain():
+            drained = previous.drain(timeout=app.config['MODEL_DRAIN_TIMEOUT'])
+            print(f"Model version {previous.version} {'drained' if drained else 'drain timed out'}")
+        threading.Thread(target=drain, name='model-drain', daemon=True).start()
+
+def _load_inference_runtime():
+    _activate_runtime(_build_inference_runtime(model_registry.active_version()))
+
+# Hot swap state reported by /admin/models
+model_swap = {'state': 'idle', 'version': None, 'error': None}
+model_swap_lock = threading.Lock()
+
+def _swap_model_version(version, persist):
     try:
-        alexnet = models.alexnet(pretrained=False)
-        alexnet.classifier[6] = nn.Linear(alexnet.classifier[6].in_features, 6)
-        alexnet.load_state_dict(torch.load('model/retina_alexnet_state.pth', map_location=device))
-        alexnet.eval()
-        alexnet.to(device)
-        models_dict['alexnet'] = alexnet
+        runtime = _build_inference_runtime(version)
+        _activate_runtime(runtime)
+        if persist:
+            model_registry.set_active(version)
+        model_swap.update(state='idle', error=None)
     except Exception as e:
-        print(f"CRITICAL ERROR: Could not load AlexNet: {e}")
-        
-    # 2. Check for ResNet50 (The new research model)
-    if os.path.exists('model/resnet50_best.pth'):
-        print("Found ResNet50! Loading for Ensemble...")
-        try:
-            resnet = get_model('resnet50', num_classes=6, pretrained=False)
-            resnet.load_state_dict(torch.load('model/resnet50_best.pth', map_location=device))
-            resnet.eval()
-            resnet.to(device)
-            models_dict['resnet50'] = resnet
-        except Exception as e:
-            print(f"Warning: Failed to load ResNet50: {e}")
-            
-    print(f"Ensemble loaded with {len(models_dict)} models: {list(models_dict.keys())}")
-    return models_dict
+        print(f"Model swap to {version} failed: {e}")
+        model_swap.update(state='failed', error=str(e))
 
-# Initialize Ensemble
-ensemble_models = load_ensemble_models()
-# Keep 'model' variable pointing to AlexNet for GradCAM compatibility
-model = ensemble_models.get('alexnet')
+# Upload-hash cache: identical re-uploads reuse the stored result.
+# The key includes the weight checksums (set once a model version is serving).
+result_cache = ResultCache(max_entries=app.config['RESULT_CACHE_SIZE'])
+
+# Capture quality is graded on the decoded pixels before inference (see image_quality.py)
+quality_gate = QualityGate(
+    thresholds={'blur_poor': app.config['QUALITY_BLUR_POOR'], 'dark_poor': app.config['QUALITY_DARK_POOR']},
+    reject_poor=app.config['QUALITY_REJECT_POOR']
+)
+
+# GradCAM heatmaps are rendered on the first report view, not during analysis
+def _heatmap_runtime():
+    try:
+        model_warmup.wait(0)  # starts lazy loading, but never blocks a report view
+    except ModelsNotReady:
+        return None
+    return inference_runtime
+
+lazy_heatmaps = LazyHeatmaps(
+    _heatmap_runtime,
+    app.config['UPLOAD_FOLDER'], CLASS_NAMES,
+    image_format=app.config['HEATMAP_FORMAT'],
+    device=device,
+    save_figure=app.config['HEATMAP_SAVE_FIGURE'],
+    render_cache=RenderCache(max_entries=app.config['HEATMAP_RENDER_CACHE_SIZE'],
+                             max_bytes=app.config['HEATMAP_RENDER_CACHE_MB'] * 2 ** 20)
+)
+
+def ensure_heatmap(prediction):
+    """
+    Heatmap path for a report: on first view the GradCAM maps of all classes
+    are computed and heatmap_path / cam_path recorded
+    """
+    paths = lazy_heatmaps.ensure(prediction.id, prediction.image_path, prediction.predicted_class,
+                                 heatmap_path=prediction.heatmap_path, cam_path=prediction.cam_path,
+                                 model_version=prediction.model_version)
+    if paths and (paths['heatmap_path'], paths['cam_path']) != (prediction.heatmap_path, prediction.cam_path):
+        prediction.heatmap_path = paths['heatmap_path']
+        prediction.cam_path = paths['cam_path']
+        db.session.commit()
+    return prediction.heatmap_path
+
+# Optional candidate architecture evaluated on a sample of real traffic (off the request path)
+shadow_evaluator = None
+if app.config['SHADOW_MODEL']:
+    shadow_evaluator = ShadowEvaluator(
+        app, app.config['SHADOW_MODEL'], app.config['SHADOW_MODEL_WEIGHTS'], CLASS_NAMES,
+        sample_rate=app.config['SHADOW_SAMPLE_RATE'],
+        max_pending=app.config['SHADOW_MAX_PENDING'],
+        is_busy=lambda: inference_runtime is not None and inference_runtime.in_flight > 0,
+        device=device
+    )
+
+# Models load on a background thread so the server binds immediately;
+# /readyz reports when they are warmed up and analysis requests wait for it
+model_warmup = ModelWarmup(_load_inference_runtime)
+if app.config['MODEL_WARMUP'] == 'background':
+    model_warmup.start()
 
 # Class names
-class_names = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal', 'redness', 'wrinkles']
+class_names = CLASS_NAMES
 
 # Disease information
 disease_info = {
@@ -282,136 +475,6 @@ disease_info = {
     }
 }
 
-# Image transforms
-transform = transforms.Compose([
-    transforms.Resize((227, 227)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225]),
-])
-
-# Transform for visualization (without normalization)
-transform_vis = transforms.Compose([
-    transforms.Resize((227, 227)),
-    transforms.ToTensor(),
-])
-
-# GradCAM generation helper
-def generate_gradcam(model, image_path, target_class_idx, device):
-    
-    # Load and preprocess image
-    img = Image.open(image_path).convert('RGB')
-    original_img = np.array(img)
-    img_tensor = transform(img).unsqueeze(0).to(device)
-    img_tensor.requires_grad = True
-    
-    # Get the last convolutional layer (features[12] in AlexNet)
-    # AlexNet structure: features[0-11] are conv layers, features[12] is the last conv
-    target_layer = model.features[12]  # Last conv layer before pooling
-    
-    # Hook to capture activations and gradients
-    activations = []
-    gradients = []
-    
-    def forward_hook(module, input, output):
-        activations.append(output.detach())
-    
-    def backward_hook(module, grad_input, grad_output):
-        if grad_output[0] is not None:
-            gradients.append(grad_output[0])
-    
-    hook_forward = target_layer.register_forward_hook(forward_hook)
-    hook_backward = target_layer.register_full_backward_hook(backward_hook)
-    
-    try:
-        # Forward pass
-        output = model(img_tensor)
-        model.zero_grad()
-        
-        # Backward pass
-        target_class_score = output[0, target_class_idx]
-        target_class_score.backward()
-        
-        # Check if gradients were captured
-        if len(gradients) == 0 or len(activations) == 0:
-            raise ValueError("Failed to capture gradients or activations")
-        
-        # Get gradients and activations
-        grad = gradients[0]
-        act = activations[0]
-        
-        # Global Average Pooling of gradients
-        weights = torch.mean(grad, dim=(2, 3), keepdim=True)
-        
-        # Weighted combination of activation maps
-        gradcam = torch.sum(weights * act, dim=1, keepdim=True)
-        gradcam = torch.relu(gradcam)
-        
-        # Normalize
-        gradcam_np = gradcam.squeeze().cpu().detach().numpy()
-        if gradcam_np.max() - gradcam_np.min() > 1e-8:
-            gradcam_np = (gradcam_np - gradcam_np.min()) / (gradcam_np.max() - gradcam_np.min())
-        
-        # Resize to original image size
-        if len(gradcam_np.shape) == 2:
-            zoom_factors = (original_img.shape[0] / gradcam_np.shape[0], 
-                           original_img.shape[1] / gradcam_np.shape[1])
-            gradcam_resized = zoom(gradcam_np, zoom_factors)
-        else:
-            gradcam_resized = gradcam_np
-        
-        # Create heatmap overlay
-        heatmap = plt.cm.jet(gradcam_resized)[:, :, :3]  # RGB
-        heatmap = (heatmap * 255).astype(np.uint8)
-        
-        # Ensure original_img and heatmap have same dimensions
-        if original_img.shape[:2] != heatmap.shape[:2]:
-            # Resize heatmap to match original image
-            from PIL import Image as PILImage
-            heatmap_pil = PILImage.fromarray(heatmap)
-            heatmap_pil = heatmap_pil.resize((original_img.shape[1], original_img.shape[0]))
-            heatmap = np.array(heatmap_pil)
-        
-        # Overlay heatmap on original image
-        overlay = (0.4 * original_img + 0.6 * heatmap).astype(np.uint8)
-        
-        # Create side-by-side visualization
-        fig, axes = plt.subplots(1, 3, figsize=(15, 5))
-        
-        axes[0].imshow(original_img)
-        axes[0].set_title('Original Image', fontsize=12)
-        axes[0].axis('off')
-        
-        axes[1].imshow(gradcam_resized, cmap='jet')
-        axes[1].set_title('GradCAM Heatmap', fontsize=12)
-        axes[1].axis('off')
-        
-        axes[2].imshow(overlay)
-        axes[2].set_title('Overlay Visualization', fontsize=12)
-        axes[2].axis('off')
-        
-        plt.tight_layout()
-        
-        # Save to BytesIO
-        img_buffer = BytesIO()
-        plt.savefig(img_buffer, format='png', bbox_inches='tight', dpi=100)
-        img_buffer.seek(0)
-        plt.close()
-        
-        return img_buffer
-        
-    except Exception as e:
-        print(f"Error generating GradCAM: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-    finally:
-        hook_forward.remove()
-        hook_backward.remove()
-        # Restore model to eval mode
-        model.eval()
-
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
@@ -1057,6 +1120,7 @@ def patient_prediction_detail(prediction_id):
         patient_name = prediction.patient.name if prediction.patient else "Unknown Patient"
         doctor_name = prediction.doctor.name if prediction.doctor else "Not Assigned"
         lab_name = prediction.lab.clinic_name if (prediction.lab and hasattr(prediction.lab, 'clinic_name')) else (prediction.lab.name if prediction.lab else "System")
+        ensure_heatmap(prediction)
 
         report_data = {
             'id': prediction.id,
@@ -1065,6 +1129,8 @@ def patient_prediction_detail(prediction_id):
             'confidence': float(prediction.confidence) if prediction.confidence is not None else 0.0,
             'image_path': prediction.image_path,
             'heatmap_path': prediction.heatmap_path,
+            'gradcam_classes': gradcam_class_urls(prediction),
+            'overlay_url': overlay_url(prediction),
             'annotated_image_path': prediction.annotated_image_path,
             'explanation': prediction.explanation,
             'recommendation': prediction.recommendation,
@@ -1244,6 +1310,7 @@ def doctor_report_detail(prediction_id):
     if prediction.doctor_id != current_user.id:
         return jsonify({'error': 'Unauthorized access'}), 403
     
+    ensure_heatmap(prediction)
     return jsonify({
         'report': {
             'id': prediction.id,
@@ -1253,6 +1320,8 @@ def doctor_report_detail(prediction_id):
             'confidence': prediction.confidence,
             'image_path': prediction.image_path,
             'heatmap_path': prediction.heatmap_path,
+            'gradcam_classes': gradcam_class_urls(prediction),
+            'overlay_url': overlay_url(prediction),
             'explanation': prediction.explanation,
             'recommendation': prediction.recommendation,
             'image_quality': prediction.image_quality,
@@ -1775,10 +1844,13 @@ def admin_delete_report(prediction_id):
     report = Prediction.query.get_or_404(prediction_id)
     patient_name = report.patient.name if report.patient else "Unknown"
     
-    # File cleanup
-    files_to_delete = [report.image_path, report.heatmap_path, report.annotated_image_path]
+    # File cleanup (GradCAM files shared with a duplicate upload's report stay)
+    shared = {path for path in (report.heatmap_path, report.cam_path) if path and Prediction.query.filter(
+        Prediction.id != report.id, db.or_(Prediction.heatmap_path == path, Prediction.cam_path == path)).count()}
+    files_to_delete = [report.image_path, report.heatmap_path, report.cam_path, report.annotated_image_path,
+                       member_cams_relpath(report.image_path) if report.image_path else None]
     for file_path in files_to_delete:
-        if file_path and os.path.exists(file_path):
+        if file_path and file_path not in shared and os.path.exists(file_path):
             try:
                 os.remove(file_path)
             except Exception as e:
@@ -1802,7 +1874,8 @@ def admin_delete_all_reports():
     
     for report in reports:
         # File cleanup
-        files_to_delete = [report.image_path, report.heatmap_path, report.annotated_image_path]
+        files_to_delete = [report.image_path, report.heatmap_path, report.cam_path, report.annotated_image_path,
+                           member_cams_relpath(report.image_path) if report.image_path else None]
         for file_path in files_to_delete:
             if file_path and os.path.exists(file_path):
                 try:
@@ -2131,6 +2204,97 @@ def admin_prediction_detail(prediction_id):
     
     return jsonify({'prediction': {'id': prediction.id, 'class': prediction.predicted_class}}), 200
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: models are loaded and warmed up"""
+    status = model_warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/admin/inference_stats', methods=['GET'])
+@login_required
+def admin_inference_stats():
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    return jsonify({
+        'models': model_warmup.status(),
+        'runtime': inference_runtime.status() if inference_runtime else None,
+        'scheduler': inference_runtime.scheduler.stats() if inference_runtime else None,
+        'result_cache': result_cache.stats(),
+        'analysis_jobs': analysis_jobs.stats(),
+        'shadow': shadow_evaluator.stats() if shadow_evaluator else None,
+        'quality_gate': quality_gate.stats(),
+        'heatmaps': lazy_heatmaps.stats()
+    }), 200
+
+@app.route('/admin/shadow_report', methods=['GET'])
+@login_required
+def admin_shadow_report():
+    """Candidate vs production: agreement, confidence deltas and latency distributions"""
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    candidate = request.args.get('candidate') or app.config['SHADOW_MODEL']
+    query = ShadowPrediction.query.filter_by(candidate=candidate)
+    since_hours = request.args.get('since_hours', type=float)
+    if since_hours:
+        query = query.filter(ShadowPrediction.created_at >= datetime.utcnow() - timedelta(hours=since_hours))
+    
+    report = shadow_report(query.all())
+    report['candidate'] = candidate
+    report['evaluator'] = shadow_evaluator.stats() if shadow_evaluator else None
+    return jsonify(report), 200
+
+@app.route('/admin/models', methods=['GET'])
+@login_required
+def admin_models():
+    """Registered model versions, the persisted active one and the one serving requests"""
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    return jsonify({
+        'versions': model_registry.list_versions(),
+        'active_version': model_registry.active_version(),
+        'serving': inference_runtime.status() if inference_runtime else None,
+        'swap': dict(model_swap)
+    }), 200
+
+@app.route('/admin/models/activate', methods=['POST'])
+@login_required
+def admin_activate_model():
+    """
+    Hot swap to another registered version: it is verified, loaded and warmed up
+    in the background while the current version keeps serving, then replaces it
+    atomically; requests already running on the old version finish on it.
+    """
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    data = request.get_json(silent=True) or request.form
+    version = data.get('version')
+    persist = str(data.get('persist', '1')).lower() not in ('0', 'false', 'no')
+    try:
+        model_registry.manifest(version)
+    except RegistryError as e:
+        return jsonify({'error': str(e)}), 404
+    if not model_warmup.is_ready:
+        return jsonify({'error': 'Models are still loading'}), 409
+    
+    with model_swap_lock:
+        if model_swap['state'] == 'loading':
+            return jsonify({'error': f"Already switching to {model_swap['version']}"}), 409
+        model_swap.update(state='loading', version=version, error=None)
+    threading.Thread(target=_swap_model_version, args=(version, persist), name='model-swap', daemon=True).start()
+    
+    log_event('MODEL_SWAP', 'Model', None, f"Switching model version to {version}")
+    return jsonify({'message': 'Model swap started', 'swap': dict(model_swap),
+                    'status_url': url_for('admin_models')}), 202
+
 def get_local_ip():
     """Get local IP address"""
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -2363,7 +2527,8 @@ def lab_verify_report(prediction_id):
             }), 200
 
         prediction.lab_verified = True
-        prediction.image_quality = data.get('image_quality', 'Good')
+        # Pre-filled by the quality gate; the lab can still correct it
+        prediction.image_quality = data.get('image_quality') or prediction.image_quality or 'Good'
         
         # New: Support assignment during verification
         doctor_id = data.get('doctor_id')
@@ -2394,6 +2559,38 @@ def lab_verify_report(prediction_id):
         
     return jsonify({'error': 'Invalid action'}), 400
 
+def summarize_ensemble_result(result):
+    """Predicted index, class name, confidence and uncertainty from an inference engine result"""
+    avg_probs = result['mean']
+    confidence = torch.max(avg_probs).item()
+    _, predicted = torch.max(avg_probs, 1)
+    predicted_idx = predicted.item()
+    return predicted_idx, class_names[predicted_idx], confidence, result['uncertainty']
+
+def build_prediction(patient_id, lab_id, filepath, heatmap_path, predicted_class, confidence, uncertainty_value,
+                     models_used=None, model_version=None, eye=None, image_quality=None):
+    """Unsaved Prediction row for a lab analysis (awaiting manual verification)"""
+    prediction = Prediction(
+        patient_id=patient_id,
+        lab_id=lab_id,
+        doctor_id=None, # No specific doctor assigned initially
+        image_path=filepath,
+        heatmap_path=heatmap_path,
+        predicted_class=predicted_class,
+        explanation=disease_info[predicted_class]['explanation'],
+        recommendation=disease_info[predicted_class]['recommendation'],
+        uncertainty=uncertainty_value,
+        models_used=','.join(models_used) if models_used else None,
+        model_version=model_version,
+        eye=eye,
+        confidence=confidence, # Save confidence score
+        lab_verified=False, # Wait for manual verification
+        is_visible_to_patient=False  # Patient cannot see it yet
+    )
+    if image_quality:
+        prediction.image_quality = image_quality
+    return prediction
+
 @app.route('/lab/analyze', methods=['GET', 'POST'])
 @login_required
 def lab_analyze():
@@ -2426,93 +2623,42 @@ def lab_analyze():
             # Save the full path in the database
             filepath = os.path.join('predictions', filename)
             full_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
-            file.save(full_filepath)
+            data = file.read()
+            with open(full_filepath, 'wb') as f:
+                f.write(data)
             
-            # Make prediction (Ensemble)
-            try:
-                image = Image.open(full_filepath).convert('RGB')
-                input_tensor = transform(image).unsqueeze(0).to(device)
-                
-                # --- ENSEMBLE LOGIC ---
-                ensemble_probs = []
-                weights = []
-                
-                with torch.no_grad():
-                    for model_name, m in ensemble_models.items():
-                        outputs = m(input_tensor)
-                        probs = torch.nn.functional.softmax(outputs, dim=1)
-                        if model_name == 'alexnet':
-                            weight = 0.7
-                        else:
-                            weight = 0.3
-                        ensemble_probs.append(probs * weight)
-                        weights.append(weight)
-                
-                if len(ensemble_probs) > 0:
-                    stacked_probs = torch.stack(ensemble_probs)
-                    sum_probs = torch.sum(stacked_probs, dim=0)
-                    total_weight = sum(weights)
-                    avg_probs = sum_probs / total_weight
-                else:
-                    raise RuntimeError("No models available")
-    
-                confidence = torch.max(avg_probs).item()
-                _, predicted = torch.max(avg_probs, 1)
-                predicted_idx = predicted.item()
-                predicted_class = class_names[predicted_idx]
-                
-                # Uncertainty
-                uncertainty_value = None
-                if len(ensemble_models) > 1:
-                    raw_probs_list = []
-                    with torch.no_grad():
-                         for m in ensemble_models.values():
-                             p = torch.nn.functional.softmax(m(input_tensor), dim=1)
-                             raw_probs_list.append(p)
-                    stacked_raw_probs = torch.stack(raw_probs_list)
-                    variance = torch.var(stacked_raw_probs, dim=0)
-                    uncertainty_value = torch.mean(variance).item()
-                
-                # GradCAM
-                heatmap_path = None
+            upload_hash = content_hash(data)
+            booking_id = request.form.get('booking_id') or None
+            
+            if request.form.get('async', '1' if app.config['ANALYSIS_ASYNC'] else '0') != '0':
+                # Queue the analysis and answer right away; progress via /lab/analysis_jobs/<id>
                 try:
-                    heatmaps_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'heatmaps')
-                    os.makedirs(heatmaps_dir, exist_ok=True)
-                    heatmap_buffer = generate_gradcam(model, full_filepath, predicted_idx, device)
-                    if heatmap_buffer:
-                        heatmap_filename = f"heatmap_{timestamp}_{filename.rsplit('.', 1)[0]}.png"
-                        heatmap_filepath = os.path.join('heatmaps', heatmap_filename)
-                        heatmap_fullpath = os.path.join(app.config['UPLOAD_FOLDER'], heatmap_filepath)
-                        with open(heatmap_fullpath, 'wb') as f:
-                            f.write(heatmap_buffer.getvalue())
-                        heatmap_path = heatmap_filepath
-                except Exception as e:
-                    print(f"Error generating heatmap: {e}")
+                    job = AnalysisJob(id=new_job_id(), lab_id=current_user.id, patient_id=int(patient_id),
+                                      booking_id=int(booking_id) if booking_id else None,
+                                      image_path=filepath, upload_sha256=upload_hash)
+                except ValueError:
+                    return jsonify({'error': 'Invalid patient or booking id'}), 400
+                db.session.add(job)
+                db.session.commit()
+                try:
+                    analysis_jobs.submit(job.id)
+                except JobQueueFull as e:
+                    job.status = 'failed'
+                    job.error = str(e)
+                    db.session.commit()
+                    return jsonify({'error': str(e)}), 503
                 
-                # Save prediction
-                prediction = Prediction(
-                    patient_id=patient_id,
-                    lab_id=current_user.id,
-                    doctor_id=None, # No specific doctor assigned initially
-                    image_path=filepath,
-                    heatmap_path=heatmap_path,
-                    predicted_class=predicted_class,
-                    explanation=disease_info[predicted_class]['explanation'],
-                    recommendation=disease_info[predicted_class]['recommendation'],
-                    uncertainty=uncertainty_value,
-                    confidence=confidence, # Save confidence score
-                    lab_verified=False, # Wait for manual verification
-                    is_visible_to_patient=False  # Patient cannot see it yet
-                )
-                db.session.add(prediction)
+                return jsonify({
+                    'message': 'Analysis Queued',
+                    'job': job_to_dict(job),
+                    'status_url': url_for('lab_analysis_job_status', job_id=job.id),
+                    'events_url': url_for('lab_analysis_job_events', job_id=job.id)
+                }), 202
             
-                # Update booking status if booking_id is present
-                booking_id = request.form.get('booking_id')
-                if booking_id:
-                    booking = LabBooking.query.get(booking_id)
-                    if booking:
-                        booking.status = 'completed'
-                        
+            # Make prediction (Ensemble)
+            try:
+                model_warmup.wait(app.config['MODEL_READY_TIMEOUT'])
+                prediction, result = analyze_saved_upload(patient_id, current_user.id, booking_id, filepath, upload_hash)
                 db.session.commit()
                 
                 log_event('ANALYSIS', 'Prediction', prediction.id, f"Lab analysis completed for patient {prediction.patient.name}")
@@ -2521,12 +2667,22 @@ def lab_analyze():
                     'message': 'Analysis Completed',
                     'prediction': {
                         'id': prediction.id,
-                        'class': predicted_class,
-                        'confidence': confidence,
-                        'heatmap': heatmap_path
+                        'class': prediction.predicted_class,
+                        'confidence': prediction.confidence,
+                        'heatmap': prediction.heatmap_path,
+                        'models_used': result['models_used'],
+                        'model_version': prediction.model_version,
+                        'image_quality': prediction.image_quality,
+                        'quality': result['quality']
                     }
                 }), 200
                 
+            except ImageQualityRejected as e:
+                return jsonify({'error': str(e), 'quality': e.report}), 422
+            except ModelsNotReady as e:
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            except SchedulerOverloaded as e:
+                return jsonify({'error': str(e)}), 503
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
         else:
@@ -2550,6 +2706,616 @@ def lab_analyze():
         'booking_id': booking_id
     }), 200
 
+def analyze_saved_upload(patient_id, lab_id, booking_id, filepath, upload_hash, on_stage=None):
+    """
+    Run inference for an upload already saved under UPLOAD_FOLDER (the GradCAM
+    heatmap is rendered on the first report view, see ensure_heatmap).
+
+    Adds the Prediction (and the booking status update) to the session without
+    committing. `on_stage` is called with 'quality' and 'inference' as the
+    analysis progresses. The quality report is stored in
+    result['quality'].
+
+    Raises:
+        ImageQualityRejected: the image was graded 'Poor' and QUALITY_REJECT_POOR
+        is set (no inference was run and nothing was added to the session)
+
+    Returns:
+        (Prediction, result): the unsaved row and the inference engine result
+    """
+    full_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
+    
+    cached = result_cache.get(upload_hash) if upload_hash else None
+    pixels = inference_ms = None
+    explanation_paths = None
+    if cached:
+        # Same bytes, same model version: reuse probabilities and uncertainty
+        result = dict(cached['result'], quality=cached.get('quality'))
+        if result['quality'] and quality_gate.should_reject(result['quality']):
+            raise ImageQualityRejected(result['quality'])
+        model_version = cached['model_version']
+        predicted_idx, predicted_class, confidence, uncertainty_value = summarize_ensemble_result(result)
+        # ...and the GradCAM maps / figure of that upload, rendered (once) on the first view of either report
+        explanation_paths = lazy_heatmaps.shared_paths(cached['image_path'], model_version)
+    else:
+        if on_stage:
+            on_stage('quality')
+        pixels = decode_image(full_filepath)
+        # Graded before inference so unusable captures do not cost an ensemble pass
+        quality = quality_gate.assess(pixels)
+        if quality_gate.should_reject(quality):
+            raise ImageQualityRejected(quality)
+        if on_stage:
+            on_stage('inference')
+        input_tensor = pixels_to_tensor(pixels).unsqueeze(0).to(device)
+        
+        # Pin the serving runtime so a hot swap drains it only after this request
+        with use_serving_runtime(lambda: inference_runtime) as runtime:
+            # --- ENSEMBLE LOGIC ---
+            # One forward pass per model (batched with any other uploads arriving in the same window)
+            inference_start = time.perf_counter()
+            result = runtime.scheduler.predict(input_tensor)
+            inference_ms = (time.perf_counter() - inference_start) * 1000.0
+        result['quality'] = quality
+        predicted_idx, predicted_class, confidence, uncertainty_value = summarize_ensemble_result(result)
+        model_version = runtime.version
+        if upload_hash:
+            result_cache.put(upload_hash, {
+                'result': {k: v for k, v in result.items() if k not in ('activations', 'quality')},
+                'model_version': model_version,
+                'quality': quality,
+                'image_path': filepath
+            }, model_version=runtime.cache_version)
+    
+    # Save prediction
+    prediction = build_prediction(patient_id, lab_id, filepath,
+                                  explanation_paths['heatmap_path'] if explanation_paths else None,
+                                  predicted_class, confidence, uncertainty_value,
+                                  models_used=result['models_used'], model_version=model_version,
+                                  image_quality=result['quality']['grade'] if result['quality'] else None)
+    if explanation_paths:
+        prediction.cam_path = explanation_paths['cam_path']
+    db.session.add(prediction)
+    # ResNet CAMs came out of the analysis pass; the first report view only adds AlexNet's GradCAM
+    lazy_heatmaps.save_member_cams(filepath, result.get('cams'))
+    if shadow_evaluator is not None and pixels is not None:
+        # Queued for the candidate model once this analysis commits
+        shadow_evaluator.mirror(db.session, prediction, pixels, inference_ms)
+    
+    # Update booking status if booking_id is present
+    if booking_id:
+        booking = LabBooking.query.get(booking_id)
+        if booking:
+            booking.status = 'completed'
+    return prediction, result
+
+def _run_analysis_job(job, set_stage):
+    """AnalysisJobQueue handler: analyze the job's saved upload"""
+    model_warmup.wait()  # queued jobs simply wait for the models
+    prediction, _ = analyze_saved_upload(job.patient_id, job.lab_id, job.booking_id, job.image_path,
+                                         job.upload_sha256, on_stage=set_stage)
+    return prediction
+
+def _log_analysis_job(job, prediction):
+    log_event('ANALYSIS', 'Prediction', prediction.id,
+              f"Lab analysis completed for patient {prediction.patient.name} (job {job.id})", user_id=job.lab_id)
+
+# Bounded worker pool for asynchronous /lab/analyze; unfinished jobs resume after a restart
+analysis_jobs = AnalysisJobQueue(
+    app, _run_analysis_job,
+    on_complete=_log_analysis_job,
+    max_workers=app.config['ANALYSIS_JOB_WORKERS'],
+    max_pending=app.config['ANALYSIS_JOB_MAX_PENDING'],
+    max_attempts=app.config['ANALYSIS_JOB_MAX_ATTEMPTS'],
+    lease_seconds=app.config['ANALYSIS_JOB_LEASE_SECONDS']
+)
+with app.app_context():
+    analysis_jobs.resume()
+
+# Re-scores historical predictions with the serving model version (paused runs resume on start)
+rescore_backfill = RescoreBackfill(
+    app, lambda: inference_runtime, app.config['UPLOAD_FOLDER'], CLASS_NAMES,
+    batch_size=app.config['BACKFILL_BATCH_SIZE'],
+    decode_workers=app.config['BACKFILL_DECODE_WORKERS'],
+    max_images_per_sec=app.config['BACKFILL_MAX_IMAGES_PER_SEC'],
+    is_busy=lambda: inference_runtime is not None and inference_runtime.in_flight > 0,
+    device=device
+)
+with app.app_context():
+    rescore_backfill.recover()
+
+@app.route('/admin/backfill', methods=['GET'])
+@login_required
+def admin_backfill_status():
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    status = rescore_backfill.status()
+    status['rescored_by_version'] = dict(
+        db.session.query(RescoredPrediction.model_version, db.func.count(RescoredPrediction.id))
+        .group_by(RescoredPrediction.model_version).all())
+    return jsonify(status), 200
+
+@app.route('/admin/backfill/start', methods=['POST'])
+@login_required
+def admin_backfill_start():
+    """Re-score all existing predictions with the serving model version (resumes a paused run)"""
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    if not model_warmup.is_ready:
+        return jsonify({'error': 'Models are still loading'}), 409
+    
+    try:
+        run = rescore_backfill.start()
+    except BackfillBusy as e:
+        return jsonify({'error': str(e)}), 409
+    
+    log_event('BACKFILL', 'BackfillRun', run.id, f"Re-scoring backfill started for model version {run.model_version}")
+    return jsonify(rescore_backfill.status()), 202
+
+@app.route('/admin/backfill/pause', methods=['POST'])
+@login_required
+def admin_backfill_pause():
+    if current_user.user_type != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    rescore_backfill.pause()
+    return jsonify({'message': 'Backfill will pause after the current batch'}), 200
+
+def _get_lab_job(job_id):
+    """AnalysisJob visible to the current user (its lab or an admin), or None"""
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None or (current_user.user_type != 'admin' and job.lab_id != current_user.id):
+        return None
+    return job
+
+@app.route('/lab/analysis_jobs/<job_id>', methods=['GET'])
+@login_required
+def lab_analysis_job_status(job_id):
+    if current_user.user_type not in ('lab', 'admin'):
+        return jsonify({'error': 'Access denied'}), 403
+    job = _get_lab_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    payload = job_to_dict(job)
+    if job.prediction is not None:
+        payload['prediction'] = {
+            'id': job.prediction.id,
+            'class': job.prediction.predicted_class,
+            'confidence': job.prediction.confidence,
+            'heatmap': job.prediction.heatmap_path,
+            'models_used': job.prediction.models_used.split(',') if job.prediction.models_used else [],
+            'model_version': job.prediction.model_version,
+            'image_quality': job.prediction.image_quality
+        }
+    return jsonify(payload), 200
+
+@app.route('/lab/analysis_jobs/<job_id>/events', methods=['GET'])
+@login_required
+def lab_analysis_job_events(job_id):
+    """Server-sent events: one 'stage' event per stage change until the job finishes"""
+    if current_user.user_type not in ('lab', 'admin'):
+        return jsonify({'error': 'Access denied'}), 403
+    if _get_lab_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        last = None
+        deadline = time.time() + 600
+        while time.time() < deadline:
+            job = db.session.get(AnalysisJob, job_id)
+            payload = job_to_dict(job)
+            # End the read transaction so workers can commit while we wait
+            db.session.rollback()
+            state = (payload['status'], payload['stage'])
+            if state != last:
+                last = state
+                yield f"event: stage\ndata: {json.dumps(payload)}\n\n"
+            if payload['status'] in TERMINAL_STATUSES:
+                return
+            time.sleep(0.5)
+        yield "event: timeout\ndata: {}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def allowed_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ANALYSIS_IMAGE_EXTENSIONS']
+
+def _load_input_tensor(full_filepath):
+    """Decode one saved upload to (pixels, tensor) (runs in the batch decode pool)"""
+    pixels = decode_image(full_filepath)
+    return pixels, pixels_to_tensor(pixels)
+
+def _collect_batch_uploads():
+    """
+    Gather the images of a batch request as dicts with name, data, patient_id, booking_id.
+
+    Accepts repeated `images` file fields with parallel `patient_ids` / `booking_ids`
+    form fields, or a zip `archive` whose images are mapped to patients by a
+    `manifest` (form field or manifest.json in the zip):
+    {"<filename>": {"patient_id": 3, "booking_id": 7}} or {"<filename>": 3}.
+    A single `patient_id` / `booking_id` form field applies to every image without a mapping.
+    """
+    default_patient = request.form.get('patient_id')
+    default_booking = request.form.get('booking_id')
+    max_images = app.config['BATCH_MAX_IMAGES']
+    max_image_bytes = app.config['MAX_CONTENT_LENGTH']
+    uploads = []
+    
+    files = request.files.getlist('images')
+    patient_ids = request.form.getlist('patient_ids')
+    booking_ids = request.form.getlist('booking_ids')
+    for i, f in enumerate(files):
+        if not f or f.filename == '':
+            continue
+        uploads.append({
+            'name': f.filename,
+            'data': f.read(),
+            'patient_id': patient_ids[i] if i < len(patient_ids) and patient_ids[i] else default_patient,
+            'booking_id': booking_ids[i] if i < len(booking_ids) and booking_ids[i] else default_booking
+        })
+    
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        with zipfile.ZipFile(archive.stream) as zf:
+            manifest = {}
+            if request.form.get('manifest'):
+                manifest = json.loads(request.form['manifest'])
+            elif 'manifest.json' in zf.namelist():
+                manifest = json.loads(zf.read('manifest.json'))
+            
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or not allowed_image(name):
+                    continue
+                if info.file_size > max_image_bytes:
+                    raise ValueError(f"{name} exceeds the per-image size limit")
+                entry = manifest.get(info.filename, manifest.get(name, {}))
+                if not isinstance(entry, dict):
+                    entry = {'patient_id': entry}
+                uploads.append({
+                    'name': name,
+                    'data': zf.read(info),
+                    'patient_id': entry.get('patient_id') or default_patient,
+                    'booking_id': entry.get('booking_id') or default_booking
+                })
+                if len(uploads) > max_images:
+                    break
+    
+    if len(uploads) > max_images:
+        raise ValueError(f"Too many images in one batch (max {max_images})")
+    return uploads
+
+def remove_uploads(filepaths):
+    """Delete saved uploads (relative to UPLOAD_FOLDER) of a request that did not create predictions"""
+    for filepath in filepaths:
+        try:
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filepath))
+        except OSError:
+            pass
+
+@app.route('/lab/analyze_batch', methods=['POST'])
+@login_required
+def lab_analyze_batch():
+    """
+    Analyze many images for many patients in one request.
+    Streams one NDJSON line per image as soon as its batch is committed,
+    followed by a final summary line.
+    """
+    if current_user.user_type != 'lab':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    # Batch uploads are allowed to exceed the single-image request limit
+    request.max_content_length = app.config['BATCH_MAX_CONTENT_LENGTH']
+    
+    try:
+        uploads = _collect_batch_uploads()
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not uploads:
+        return jsonify({'error': 'No images provided'}), 400
+    
+    try:
+        model_warmup.wait(app.config['MODEL_READY_TIMEOUT'])
+    except ModelsNotReady as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    # Validate patients up front with a single query
+    requested_ids = set()
+    for u in uploads:
+        try:
+            u['patient_id'] = int(u['patient_id'])
+            requested_ids.add(u['patient_id'])
+        except (TypeError, ValueError):
+            u['patient_id'] = None
+    valid_patients = {p.id for p in User.query.filter(User.id.in_(requested_ids), User.user_type == 'patient').all()} if requested_ids else set()
+    
+    # Same for bookings, so a malformed or unknown booking id only rejects its own image
+    requested_bookings = set()
+    for u in uploads:
+        if not u['booking_id']:
+            u['booking_id'] = None
+            continue
+        try:
+            u['booking_id'] = int(u['booking_id'])
+            requested_bookings.add(u['booking_id'])
+        except (TypeError, ValueError):
+            pass  # left as given: not in valid_bookings below
+    valid_bookings = {b.id for b in LabBooking.query.filter(LabBooking.id.in_(requested_bookings)).all()} if requested_bookings else set()
+    
+    lab_id = current_user.id
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    predictions_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'predictions')
+    os.makedirs(predictions_dir, exist_ok=True)
+    
+    items = []
+    rejected = []
+    for i, u in enumerate(uploads):
+        if not allowed_image(u['name']):
+            rejected.append({'filename': u['name'], 'status': 'error', 'error': 'Invalid file type'})
+            continue
+        if u['patient_id'] not in valid_patients:
+            rejected.append({'filename': u['name'], 'status': 'error', 'error': 'Unknown patient'})
+            continue
+        if u['booking_id'] is not None and u['booking_id'] not in valid_bookings:
+            rejected.append({'filename': u['name'], 'status': 'error', 'error': f"Unknown booking: {u['booking_id']}"})
+            continue
+        filename = f"{timestamp}_{i:03d}_{secure_filename(u['name'])}"
+        filepath = os.path.join('predictions', filename)
+        full_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
+        with open(full_filepath, 'wb') as f:
+            f.write(u['data'])
+        items.append({
+            'original_name': u['name'],
+            'filename': filename,
+            'filepath': filepath,
+            'full_filepath': full_filepath,
+            'patient_id': u['patient_id'],
+            'booking_id': u['booking_id']
+        })
+    del uploads
+    
+    batch_size = app.config['INFERENCE_MAX_BATCH_SIZE']
+    
+    def generate():
+        succeeded = 0
+        failed = len(rejected)
+        created_ids = []
+        for line in rejected:
+            yield json.dumps(line) + '\n'
+        
+        # Decode in parallel while earlier chunks are running through the ensemble
+        executor = ThreadPoolExecutor(max_workers=app.config['BATCH_DECODE_WORKERS'])
+        try:
+            for item in items:
+                item['future'] = executor.submit(_load_input_tensor, item['full_filepath'])
+            
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                tensors, ready = [], []
+                for item in chunk:
+                    try:
+                        pixels, tensor = item['future'].result()
+                    except Exception as e:
+                        failed += 1
+                        remove_uploads([item['filepath']])
+                        yield json.dumps({'filename': item['original_name'], 'status': 'error', 'error': f'Could not decode image: {e}'}) + '\n'
+                        continue
+                    item['quality'] = quality_gate.assess(pixels)
+                    if quality_gate.should_reject(item['quality']):
+                        failed += 1
+                        remove_uploads([item['filepath']])
+                        yield json.dumps({'filename': item['original_name'], 'status': 'error',
+                                          'error': str(ImageQualityRejected(item['quality'])),
+                                          'quality': item['quality']}) + '\n'
+                        continue
+                    tensors.append(tensor)
+                    ready.append(item)
+                if not ready:
+                    continue
+                
+                # Each chunk is pinned to the runtime serving when it starts (hot swaps drain it)
+                with use_serving_runtime(lambda: inference_runtime) as runtime:
+                    try:
+                        results = runtime.run_batch(torch.stack(tensors).to(device))
+                    except Exception as e:
+                        failed += len(ready)
+                        remove_uploads([item['filepath'] for item in ready])
+                        for item in ready:
+                            yield json.dumps({'filename': item['original_name'], 'status': 'error', 'error': str(e)}) + '\n'
+                        continue
+                    
+                rows = []
+                for item, result in zip(ready, results):
+                    predicted_idx, predicted_class, confidence, uncertainty_value = summarize_ensemble_result(result)
+                    prediction = build_prediction(item['patient_id'], lab_id, item['filepath'], None,
+                                                  predicted_class, confidence, uncertainty_value,
+                                                  models_used=result['models_used'], model_version=runtime.version,
+                                                  image_quality=item['quality']['grade'])
+                    rows.append((item, prediction))
+                
+                # One transaction per chunk: all Prediction rows plus their booking updates
+                try:
+                    db.session.add_all([prediction for _, prediction in rows])
+                    booking_ids = {item['booking_id'] for item, _ in rows if item['booking_id'] is not None}
+                    if booking_ids:
+                        LabBooking.query.filter(LabBooking.id.in_(booking_ids)).update(
+                            {'status': 'completed'}, synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    failed += len(rows)
+                    remove_uploads([item['filepath'] for item, _ in rows])
+                    for item, _ in rows:
+                        yield json.dumps({'filename': item['original_name'], 'status': 'error', 'error': str(e)}) + '\n'
+                    continue
+                
+                for (item, prediction), result in zip(rows, results):
+                    item['committed'] = True
+                    lazy_heatmaps.save_member_cams(item['filepath'], result['cams'])
+                    succeeded += 1
+                    created_ids.append(prediction.id)
+                    yield json.dumps({
+                        'filename': item['original_name'],
+                        'status': 'ok',
+                        'prediction': {
+                            'id': prediction.id,
+                            'patient_id': prediction.patient_id,
+                            'class': prediction.predicted_class,
+                            'confidence': prediction.confidence,
+                            'uncertainty': prediction.uncertainty,
+                            'heatmap': prediction.heatmap_path,
+                            'models_used': prediction.models_used.split(',') if prediction.models_used else [],
+                            'model_version': prediction.model_version,
+                            'image_quality': prediction.image_quality
+                        },
+                        'quality': item['quality']
+                    }) + '\n'
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Uploads without a committed Prediction (also when the client disconnects mid-stream)
+            remove_uploads([item['filepath'] for item in items if not item.get('committed')])
+        
+        if created_ids:
+            log_event('BATCH_ANALYSIS', 'Prediction', created_ids[0],
+                      f"Batch lab analysis completed: {len(created_ids)} predictions (IDs {created_ids[0]}-{created_ids[-1]})",
+                      user_id=lab_id)
+        yield json.dumps({'status': 'done', 'total': succeeded + failed, 'succeeded': succeeded, 'failed': failed}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Clinical priority used to pick the patient-level finding of a bilateral analysis
+CLASS_SEVERITY = {'diabetic_retinopathy': 3, 'glaucoma': 3, 'cataract': 2, 'redness': 1, 'wrinkles': 0, 'normal': 0}
+REFERRAL_SEVERITY = 2
+
+def summarize_bilateral(eyes):
+    """
+    Patient-level summary of a left/right pair
+
+    Args:
+        eyes (dict): 'left'/'right' -> {'class', 'confidence', 'uncertainty'}
+    """
+    # The more severe eye decides; ties go to the more confident one
+    worst_eye = max(eyes, key=lambda e: (CLASS_SEVERITY.get(eyes[e]['class'], 0), eyes[e]['confidence']))
+    classes = {e['class'] for e in eyes.values()}
+    uncertainties = [e['uncertainty'] for e in eyes.values() if e['uncertainty'] is not None]
+    return {
+        'overall_class': eyes[worst_eye]['class'],
+        'overall_confidence': eyes[worst_eye]['confidence'],
+        'worst_eye': worst_eye,
+        'concordant': len(classes) == 1,
+        'bilateral_finding': len(classes) == 1 and 'normal' not in classes,
+        'referral_recommended': CLASS_SEVERITY.get(eyes[worst_eye]['class'], 0) >= REFERRAL_SEVERITY,
+        'max_uncertainty': max(uncertainties) if uncertainties else None,
+    }
+
+@app.route('/lab/analyze_bilateral', methods=['POST'])
+@login_required
+def lab_analyze_bilateral():
+    """
+    Analyze both eyes of one visit: `left_image` and `right_image` run as a
+    single ensemble batch, both Prediction rows are committed in one
+    transaction, and a patient-level summary is returned.
+    """
+    if current_user.user_type != 'lab':
+        return jsonify({'error': 'Access denied'}), 403
+    
+    patient_id = request.form.get('patient_id')
+    booking_id = request.form.get('booking_id') or None
+    files = {eye: request.files.get(f'{eye}_image') for eye in ('left', 'right')}
+    if not all(f and f.filename for f in files.values()):
+        return jsonify({'error': 'Both left_image and right_image are required'}), 400
+    if not all(allowed_image(f.filename) for f in files.values()):
+        return jsonify({'error': 'Invalid file type'}), 400
+    patient = User.query.filter_by(id=patient_id, user_type='patient').first() if patient_id else None
+    if patient is None:
+        return jsonify({'error': 'Please select a Patient'}), 400
+    
+    try:
+        model_warmup.wait(app.config['MODEL_READY_TIMEOUT'])
+    except ModelsNotReady as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'predictions'), exist_ok=True)
+    uploads = {}
+    saved = []  # removed again if the request ends without predictions
+    for eye, file in files.items():
+        filename = f"{timestamp}_{eye}_{secure_filename(file.filename)}"
+        filepath = os.path.join('predictions', filename)
+        full_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filepath)
+        file.save(full_filepath)
+        saved.append(filepath)
+        try:
+            pixels, tensor = _load_input_tensor(full_filepath)
+        except Exception as e:
+            remove_uploads(saved)
+            return jsonify({'error': f'Could not decode {eye} image: {e}'}), 400
+        quality = quality_gate.assess(pixels)
+        if quality_gate.should_reject(quality):
+            remove_uploads(saved)
+            return jsonify({'error': f'{eye.capitalize()} eye: {ImageQualityRejected(quality)}',
+                            'eye': eye, 'quality': quality}), 422
+        uploads[eye] = {'filepath': filepath, 'tensor': tensor, 'quality': quality}
+    
+    try:
+        # One forward pass per model for both eyes
+        with use_serving_runtime(lambda: inference_runtime) as runtime:
+            results = runtime.run_batch(torch.stack([uploads[e]['tensor'] for e in ('left', 'right')]).to(device))
+        predictions, eyes = {}, {}
+        for eye, result in zip(('left', 'right'), results):
+            u = uploads[eye]
+            predicted_idx, predicted_class, confidence, uncertainty_value = summarize_ensemble_result(result)
+            predictions[eye] = build_prediction(patient.id, current_user.id, u['filepath'], None,
+                                                predicted_class, confidence, uncertainty_value,
+                                                models_used=result['models_used'],
+                                                model_version=runtime.version, eye=eye,
+                                                image_quality=u['quality']['grade'])
+            eyes[eye] = {'class': predicted_class, 'confidence': confidence, 'uncertainty': uncertainty_value}
+        
+        # Both eyes (and the booking update) or neither
+        db.session.add_all(predictions.values())
+        if booking_id:
+            booking = LabBooking.query.get(booking_id)
+            if booking:
+                booking.status = 'completed'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        remove_uploads(saved)
+        return jsonify({'error': str(e)}), 500
+    
+    for eye, result in zip(('left', 'right'), results):
+        lazy_heatmaps.save_member_cams(uploads[eye]['filepath'], result['cams'])
+    
+    log_event('ANALYSIS', 'Prediction', predictions['left'].id,
+              f"Bilateral lab analysis completed for patient {patient.name} "
+              f"(IDs {predictions['left'].id}, {predictions['right'].id})")
+    
+    summary = summarize_bilateral(eyes)
+    summary['patient_id'] = patient.id
+    return jsonify({
+        'message': 'Analysis Completed',
+        'summary': summary,
+        'predictions': {
+            eye: {
+                'id': p.id,
+                'eye': eye,
+                'class': p.predicted_class,
+                'confidence': p.confidence,
+                'uncertainty': p.uncertainty,
+                'heatmap': p.heatmap_path,
+                'models_used': p.models_used.split(',') if p.models_used else [],
+                'model_version': p.model_version,
+                'image_quality': p.image_quality,
+                'quality': uploads[eye]['quality']
+            } for eye, p in predictions.items()
+        }
+    }), 200
+
 @app.route('/lab/report/<int:prediction_id>', methods=['GET'])
 @login_required
 def lab_report_detail(prediction_id):
@@ -2793,7 +3559,8 @@ def lab_report_view(prediction_id):
     if prediction.doctor_id:
         doctor = User.query.get(prediction.doctor_id)
         doctor_name = doctor.name if doctor else None
-        
+    
+    ensure_heatmap(prediction)
     return jsonify({
         'report': {
             'id': prediction.id,
@@ -2803,10 +3570,15 @@ def lab_report_view(prediction_id):
             'confidence': prediction.confidence,
             'image_path': prediction.image_path,
             'heatmap_path': prediction.heatmap_path,
+            'gradcam_classes': gradcam_class_urls(prediction),
+            'overlay_url': overlay_url(prediction),
             'explanation': prediction.explanation,
             'recommendation': prediction.recommendation,
             'image_quality': prediction.image_quality,
             'lab_verified': prediction.lab_verified,
+            'models_used': prediction.models_used.split(',') if prediction.models_used else [],
+            'model_version': prediction.model_version,
+            'eye': prediction.eye,
             'doctor_id': prediction.doctor_id,
             'doctor_name': doctor_name,
             'doctor_notes': prediction.doctor_notes,
@@ -2816,6 +3588,100 @@ def lab_report_view(prediction_id):
         }
     }), 200
 
+def can_view_report(prediction):
+    """Same access rules as the doctor, lab and patient report views"""
+    if current_user.user_type == 'admin':
+        return True
+    if current_user.user_type == 'lab':
+        return prediction.lab_id == current_user.id
+    if current_user.user_type == 'doctor':
+        return prediction.doctor_id == current_user.id
+    if current_user.user_type == 'patient':
+        return prediction.patient_id == current_user.id and prediction.is_visible_to_patient
+    return False
+
+def gradcam_class_urls(prediction):
+    """Per-class GradCAM figure URLs once the report's maps are stored"""
+    if not prediction.cam_path:
+        return {}
+    return {c: url_for('report_gradcam_class', prediction_id=prediction.id, class_name=c) for c in CLASS_NAMES}
+
+def overlay_url(prediction):
+    """Overlay URL for the predicted class once the report's maps are stored (query args pick variants)"""
+    if not prediction.cam_path:
+        return None
+    return url_for('report_overlay', prediction_id=prediction.id)
+
+def report_maps(prediction_id, class_name):
+    """
+    Report whose stored GradCAM maps can be rendered for `class_name`
+
+    Returns:
+        (Prediction, None) or (None, error response)
+    """
+    prediction = Prediction.query.get_or_404(prediction_id)
+    if not can_view_report(prediction):
+        return None, (jsonify({'error': 'Unauthorized access'}), 403)
+    if class_name is not None and class_name not in CLASS_NAMES:
+        return None, (jsonify({'error': f'Unknown class: {class_name}'}), 404)
+    
+    ensure_heatmap(prediction)
+    if not prediction.cam_path:
+        return None, (jsonify({'error': 'GradCAM maps are not available yet'}), 503, {'Retry-After': '5'})
+    return prediction, None
+
+def send_rendered(data, image_format):
+    """Rendered heatmap bytes; variants are immutable for a stored map, so browsers may cache them"""
+    return send_file(io.BytesIO(data), mimetype=f"image/{image_format}", max_age=3600)
+
+@app.route('/report/<int:prediction_id>/gradcam/<class_name>', methods=['GET'])
+@login_required
+def report_gradcam_class(prediction_id, class_name):
+    """
+    GradCAM figure explaining any class for a report (e.g. why not glaucoma).
+    Rendered from the stored all-classes maps; the model only runs if the
+    report has never been viewed.
+    """
+    prediction, error = report_maps(prediction_id, class_name)
+    if error:
+        return error
+    try:
+        figure = lazy_heatmaps.class_figure(prediction.image_path, prediction.cam_path, class_name)
+    except OSError as e:
+        return jsonify({'error': f'Could not render GradCAM: {e}'}), 404
+    return send_rendered(figure, app.config['HEATMAP_FORMAT'])
+
+@app.route('/report/<int:prediction_id>/overlay', methods=['GET'])
+@login_required
+def report_overlay(prediction_id):
+    """
+    GradCAM overlay rendered on request from the stored maps.
+
+    Query args: class (default: the predicted class), size (edge length in
+    pixels, default 227), opacity (0-1, default 0.6), colormap (jet, hot,
+    viridis, gray) and format (png, webp). Each variant is cached (LRU).
+    """
+    class_name = request.args.get('class') or None
+    size = request.args.get('size', default=INPUT_SIZE, type=int)
+    opacity = request.args.get('opacity', default=OVERLAY_ALPHA, type=float)
+    colormap = request.args.get('colormap', 'jet').lower()
+    image_format = (request.args.get('format') or app.config['HEATMAP_FORMAT']).lower()
+    if image_format not in HEATMAP_FORMATS:
+        return jsonify({'error': f'Unsupported format: {image_format}'}), 400
+    
+    prediction, error = report_maps(prediction_id, class_name)
+    if error:
+        return error
+    try:
+        overlay = lazy_heatmaps.overlay(prediction.image_path, prediction.cam_path,
+                                        class_name or prediction.predicted_class,
+                                        size=size, opacity=opacity, colormap=colormap, image_format=image_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        return jsonify({'error': f'Could not render GradCAM: {e}'}), 404
+    return send_rendered(overlay, image_format)
+
 if __name__ == '__main__':
     # Get DuckDNS configuration
     duckdns_token = app.config.get('DUCKDNS_TOKEN')
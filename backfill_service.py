@@ -0,0 +1,244 @@
+"""
+Re-scoring Backfill Module
+Re-scores historical Prediction images with the serving model version in
+large batches and bulk-writes the results to RescoredPrediction, keyed by
+(prediction_id, model_version). Progress is checkpointed in BackfillRun
+together with each batch, so a run can be paused (or interrupted) and
+resumed without re-scoring or duplicating anything.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from models import db, Prediction, RescoredPrediction, BackfillRun
+from preprocessing import decode_image, pixels_to_tensor
+from inference_service import use_serving_runtime
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = ('running', 'paused')
+
+
+class BackfillBusy(RuntimeError):
+    """Raised when a backfill is already running in this process"""
+
+
+def backfill_run_to_dict(run):
+    return {
+        'id': run.id,
+        'model_version': run.model_version,
+        'status': run.status,
+        'last_prediction_id': run.last_prediction_id,
+        'total': run.total,
+        'processed': run.processed,
+        'failed': run.failed,
+        'progress': round((run.processed + run.failed) / run.total, 4) if run.total else 1.0,
+        'error': run.error,
+        'created_at': run.created_at.isoformat() if run.created_at else None,
+        'updated_at': run.updated_at.isoformat() if run.updated_at else None,
+    }
+
+
+def _stale_predictions(version):
+    """Predictions neither produced by nor already re-scored with `version`"""
+    rescored = db.session.query(RescoredPrediction.id).filter(
+        RescoredPrediction.prediction_id == Prediction.id,
+        RescoredPrediction.model_version == version).exists()
+    return db.session.query(Prediction).filter(
+        db.or_(Prediction.model_version.is_(None), Prediction.model_version != version), ~rescored)
+
+
+def _decode(full_filepath):
+    return pixels_to_tensor(decode_image(full_filepath))
+
+
+class RescoreBackfill:
+    """
+    One backfill thread per process
+
+    `get_runtime()` returns the serving InferenceRuntime; each batch is pinned
+    to it with `use_serving_runtime()` and run through `runtime.run_batch` directly
+    (one large batch, not the latency-oriented micro-batching scheduler).
+
+    The next page of images is decoded on `decode_workers` threads while the
+    current one is scored. To leave room for live analysis the thread waits
+    while `is_busy()` is true and is held to `max_images_per_sec` (0 = no limit).
+    """
+
+    def __init__(self, app, get_runtime, upload_folder, class_names, batch_size=64, decode_workers=4,
+                 max_images_per_sec=0, is_busy=None, device=None):
+        self.app = app
+        self.get_runtime = get_runtime
+        self.upload_folder = upload_folder
+        self.class_names = list(class_names)
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = max(1, int(decode_workers))
+        self.max_images_per_sec = max(0.0, float(max_images_per_sec))
+        self.is_busy = is_busy or (lambda: False)
+        self.device = device or torch.device('cpu')
+        self._pause = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._run_id = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def recover(self):
+        """Mark runs left 'running' by a previous process as paused (resume with start())"""
+        stale = BackfillRun.query.filter_by(status='running').all()
+        for run in stale:
+            run.status = 'paused'
+        db.session.commit()
+        return len(stale)
+
+    def start(self):
+        """
+        Start (or resume) the backfill for the serving model version
+
+        Returns:
+            BackfillRun: the resumed unfinished run for this version, or a new one
+        """
+        with self._lock:
+            if self.is_running:
+                raise BackfillBusy("A backfill is already running")
+            version = self.get_runtime().version
+            run = BackfillRun.query.filter(BackfillRun.model_version == version,
+                                           BackfillRun.status.in_(UNFINISHED_STATUSES)) \
+                .order_by(BackfillRun.id.desc()).first()
+            if run is None:
+                max_id = db.session.query(db.func.max(Prediction.id)).scalar() or 0
+                run = BackfillRun(model_version=version, last_prediction_id=0, max_prediction_id=max_id,
+                                  total=_stale_predictions(version).filter(Prediction.id <= max_id).count(),
+                                  processed=0, failed=0)
+                db.session.add(run)
+            run.status = 'running'
+            run.error = None
+            db.session.commit()
+
+            self._pause.clear()
+            self._run_id = run.id
+            self._thread = threading.Thread(target=self._run, args=(run.id,), name='rescore-backfill', daemon=True)
+            self._thread.start()
+            return run
+
+    def pause(self):
+        """Stop after the current batch; its checkpoint is kept"""
+        self._pause.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _pages(self, run, executor):
+        """Pages of (prediction_id, decode future), decoding one page ahead"""
+        last_id = run.last_prediction_id
+        pending = None
+        while True:
+            rows = _stale_predictions(run.model_version) \
+                .filter(Prediction.id > last_id, Prediction.id <= run.max_prediction_id) \
+                .with_entities(Prediction.id, Prediction.image_path) \
+                .order_by(Prediction.id).limit(self.batch_size).all()
+            page = [(pid, executor.submit(_decode, os.path.join(self.upload_folder, path))) for pid, path in rows]
+            if pending is not None:
+                yield pending
+            if not page:
+                return
+            last_id = page[-1][0]
+            pending = page
+
+    def _run(self, run_id):
+        with self.app.app_context():
+            run = db.session.get(BackfillRun, run_id)
+            executor = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='backfill-decode')
+            try:
+                for page in self._pages(run, executor):
+                    if self._pause.is_set():
+                        run.status = 'paused'
+                        db.session.commit()
+                        logger.info(f"Backfill {run_id} paused at prediction {run.last_prediction_id}")
+                        return
+                    while self.is_busy() and not self._pause.is_set():
+                        time.sleep(0.05)
+                    started = time.time()
+                    if not self._score_page(run, page):
+                        return
+                    self._throttle(len(page), time.time() - started)
+                run.status = 'done'
+                db.session.commit()
+                logger.info(f"Backfill {run_id} done: {run.processed} re-scored, {run.failed} failed")
+            except Exception as e:
+                logger.error(f"Backfill {run_id} failed: {e}")
+                db.session.rollback()
+                run = db.session.get(BackfillRun, run_id)
+                run.status = 'failed'
+                run.error = str(e)
+                db.session.commit()
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+                db.session.remove()
+
+    def _score_page(self, run, page):
+        """Score one page and commit its rows with the checkpoint; False if the version changed"""
+        ids, tensors, failed = [], [], 0
+        for prediction_id, future in page:
+            try:
+                tensors.append(future.result())
+                ids.append(prediction_id)
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Backfill: could not decode prediction {prediction_id}: {e}")
+
+        rows = []
+        if tensors:
+            with use_serving_runtime(self.get_runtime) as runtime:
+                if runtime.version != run.model_version:
+                    # Scores must all come from one version; a new start() backfills the new one
+                    run.status = 'paused'
+                    run.error = f"Serving model changed to {runtime.version}"
+                    db.session.commit()
+                    return False
+                results = runtime.run_batch(torch.stack(tensors).to(self.device))
+            for prediction_id, result in zip(ids, results):
+                confidence, idx = torch.max(result['mean'][0], 0)
+                rows.append({
+                    'prediction_id': prediction_id,
+                    'model_version': run.model_version,
+                    'predicted_class': self.class_names[idx.item()],
+                    'confidence': confidence.item(),
+                    'uncertainty': result['uncertainty'],
+                    'models_used': ','.join(result['models_used']),
+                })
+
+        # Rows and checkpoint in one transaction: a resumed run never re-inserts them
+        if rows:
+            db.session.execute(db.insert(RescoredPrediction), rows)
+        run.last_prediction_id = page[-1][0]
+        run.processed += len(rows)
+        run.failed += failed
+        db.session.commit()
+        return True
+
+    def _throttle(self, images, elapsed):
+        if self.max_images_per_sec:
+            delay = images / self.max_images_per_sec - elapsed
+            if delay > 0:
+                self._pause.wait(delay)
+
+    def status(self):
+        run = db.session.get(BackfillRun, self._run_id) if self._run_id else \
+            BackfillRun.query.order_by(BackfillRun.id.desc()).first()
+        return {
+            'running': self.is_running,
+            'run': backfill_run_to_dict(run) if run else None,
+            'config': {
+                'batch_size': self.batch_size,
+                'decode_workers': self.decode_workers,
+                'max_images_per_sec': self.max_images_per_sec,
+            }
+        }
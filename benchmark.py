@@ -0,0 +1,337 @@
+"""
+Inference Benchmark Suite
+Times every stage of the analysis pipeline over the class folders in DATA/
+(DATA/cataract, DATA/glaucoma, ...) and writes machine-readable JSON, so
+runs from different commits can be compared:
+
+    decode       decode_image, per image
+    quality      pre-inference quality gate (blur, exposure, fundus field), per image
+    transform    pixels_to_tensor + batch stacking, per batch
+    forward      every ensemble member's body + head, per batch
+    softmax      per-member softmax, per batch
+    uncertainty  weighted mean + across-model variance, per image
+    gradcam      AlexNet head replay from the captured feature map, per image
+    cam          ResNet50 forward-only CAM (fc weights on layer4), per image
+
+For each combination of backend, thread count and batch size the report has
+p50/p95/p99/mean latency and peak RSS per stage, plus end-to-end throughput.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --backends eager,torchscript,int8 --threads 1,4 --batch-sizes 1,8,32
+    python benchmark.py --compare bench_main.json --max-regression 10
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import threading
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from preprocessing import CLASS_NAMES, list_labeled_images, decode_image, pixels_to_tensor
+from model.architectures import load_ensemble_models, split_feature_head, gradcam_from_activations, cam_from_activations
+from inference_service import InferenceEngine
+from image_quality import assess_quality
+
+STAGES = ('decode', 'quality', 'transform', 'forward', 'softmax', 'uncertainty', 'gradcam', 'cam')
+STAGE_UNITS = {'decode': 'image', 'quality': 'image', 'transform': 'batch', 'forward': 'batch', 'softmax': 'batch',
+               'uncertainty': 'image', 'gradcam': 'image', 'cam': 'image'}
+BACKENDS = ('eager', 'torchscript', 'onnxruntime', 'int8')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """Resident set size of this process (Linux /proc), or the peak RSS elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RSSSampler:
+    """Background sampler that attributes the peak RSS to the stage currently running"""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.stage = None
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        stage = self.stage
+        if stage is not None:
+            rss = current_rss_bytes()
+            if rss > self.peaks.get(stage, 0):
+                self.peaks[stage] = rss
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class StageTimer:
+    """Collects per-stage latencies (ms) and tags the RSS sampler with the running stage"""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.timings = {stage: [] for stage in STAGES}
+
+    def run(self, stage, fn, *args):
+        self.sampler.stage = stage
+        start = time.perf_counter()
+        out = fn(*args)
+        self.timings[stage].append((time.perf_counter() - start) * 1000.0)
+        self.sampler.sample()  # short stages can finish between two background samples
+        self.sampler.stage = None
+        return out
+
+
+def summarize(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(values), [50, 95, 99])
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3),
+            'mean': round(float(np.mean(values)), 3), 'count': len(values)}
+
+
+def _forward(splits, models_dict, batch):
+    logits, activations = {}, {}
+    with torch.no_grad():
+        for name, m in models_dict.items():
+            split = splits.get(name)
+            if split is not None:
+                features = split[0](batch)
+                logits[name] = split[1](features)
+                activations[name] = features
+            else:
+                logits[name] = m(batch)
+    return logits, activations
+
+
+def _softmax(logits):
+    return {name: F.softmax(out, dim=1) for name, out in logits.items()}
+
+
+def _uncertainty(probs, i):
+    return InferenceEngine._combine({n: p[i:i + 1] for n, p in probs.items()}, {})
+
+
+def run_pipeline(engine, paths, batch_size, timer):
+    """One timed pass over `paths`; returns the wall time in seconds"""
+    models_dict = engine.models
+    splits = {name: split_feature_head(m) for name, m in models_dict.items()}
+    splits = {name: split for name, split in splits.items() if split is not None}
+    explain_head = engine.explain_head('alexnet')
+    cam_head = engine.explain_head('resnet50')
+
+    start = time.perf_counter()
+    for offset in range(0, len(paths), batch_size):
+        chunk = paths[offset:offset + batch_size]
+        pixels = [timer.run('decode', decode_image, p) for p in chunk]
+        for p in pixels:
+            timer.run('quality', assess_quality, p)
+        batch = timer.run('transform', lambda: torch.stack([pixels_to_tensor(p) for p in pixels]))
+        logits, activations = timer.run('forward', _forward, splits, models_dict, batch)
+        probs = timer.run('softmax', _softmax, logits)
+        for i in range(len(chunk)):
+            result = timer.run('uncertainty', _uncertainty, probs, i)
+            if explain_head is not None and 'alexnet' in activations:
+                predicted = int(torch.argmax(result['mean'], dim=1))
+                timer.run('gradcam', gradcam_from_activations, explain_head,
+                          activations['alexnet'][i:i + 1], predicted)
+            if cam_head is not None and 'resnet50' in activations:
+                timer.run('cam', cam_from_activations, cam_head, activations['resnet50'][i:i + 1])
+    return time.perf_counter() - start
+
+
+def load_backend(backend, compiled_dir):
+    device = torch.device('cpu')
+    if backend == 'int8':
+        return load_ensemble_models(device, quantize=True)
+    return load_ensemble_models(device, backend=backend, compiled_dir=compiled_dir)
+
+
+def benchmark(paths, backends, thread_counts, batch_sizes, repeats=1, compiled_dir='model/compiled'):
+    """
+    Run the sweep
+
+    Returns:
+        list: one dict per (backend, threads, batch_size) with per-stage
+        latency percentiles, per-stage peak RSS (MB), throughput and the
+        process peak RSS
+    """
+    runs = []
+    for backend in backends:
+        models_dict = load_backend(backend, compiled_dir)
+        if not models_dict:
+            print(f"Skipping {backend}: no models could be loaded")
+            continue
+        engine = InferenceEngine(models_dict, capture=('alexnet',), cam=('resnet50',))
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                with RSSSampler() as sampler:
+                    # Warmup pass (allocators, lazy kernels) is not recorded
+                    run_pipeline(engine, paths[:batch_size], batch_size, StageTimer(sampler))
+                    sampler.peaks.clear()
+                    timer = StageTimer(sampler)
+                    wall = sum(run_pipeline(engine, paths, batch_size, timer) for _ in range(repeats))
+                images = len(paths) * repeats
+                run = {
+                    'backend': backend,
+                    'threads': threads,
+                    'batch_size': batch_size,
+                    'images': images,
+                    'throughput_images_per_sec': round(images / wall, 3) if wall else None,
+                    'stages': {},
+                    'peak_rss_mb': round(max(sampler.peaks.values(), default=0) / 2 ** 20, 1),
+                }
+                for stage in STAGES:
+                    stats = summarize(timer.timings[stage])
+                    if stats is not None:
+                        stats['unit'] = STAGE_UNITS[stage]
+                        stats['peak_rss_mb'] = round(sampler.peaks.get(stage, 0) / 2 ** 20, 1)
+                    run['stages'][stage] = stats
+                print(f"{backend:<12} threads={threads:<3} batch={batch_size:<4} "
+                      f"{run['throughput_images_per_sec']} images/sec, forward p50 "
+                      f"{(run['stages']['forward'] or {}).get('p50')} ms/batch, peak RSS {run['peak_rss_mb']} MB")
+                runs.append(run)
+        del engine, models_dict
+    return runs
+
+
+def _run_key(run):
+    return (run['backend'], run['threads'], run['batch_size'])
+
+
+def compare(report, baseline, max_regression_pct):
+    """
+    Per-run p50 and throughput changes against a baseline report
+
+    Returns:
+        (list, list): all comparisons, and those worse than max_regression_pct
+    """
+    baseline_runs = {_run_key(r): r for r in baseline.get('runs', [])}
+    changes, regressions = [], []
+    for run in report['runs']:
+        base = baseline_runs.get(_run_key(run))
+        if base is None:
+            continue
+        for stage in STAGES:
+            new, old = run['stages'].get(stage), (base['stages'] or {}).get(stage)
+            if not new or not old or not old['p50']:
+                continue
+            pct = (new['p50'] - old['p50']) / old['p50'] * 100.0
+            change = {'run': _run_key(run), 'metric': f'{stage}.p50', 'baseline': old['p50'],
+                      'current': new['p50'], 'change_pct': round(pct, 2)}
+            changes.append(change)
+            if pct > max_regression_pct:
+                regressions.append(change)
+        old_tp, new_tp = base.get('throughput_images_per_sec'), run.get('throughput_images_per_sec')
+        if old_tp and new_tp:
+            pct = (old_tp - new_tp) / old_tp * 100.0
+            change = {'run': _run_key(run), 'metric': 'throughput', 'baseline': old_tp,
+                      'current': new_tp, 'change_pct': round(-pct, 2)}
+            changes.append(change)
+            if pct > max_regression_pct:
+                regressions.append(change)
+    return changes, regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the inference pipeline over the DATA/ class folders')
+    parser.add_argument('--data', default='DATA', help='Folder with one sub-folder per class')
+    parser.add_argument('--images-per-class', type=int, default=8)
+    parser.add_argument('--backends', default='eager', help=f"Comma-separated: {', '.join(BACKENDS)}")
+    parser.add_argument('--threads', default=str(torch.get_num_threads()), help='Comma-separated thread counts')
+    parser.add_argument('--batch-sizes', default='1,8', help='Comma-separated batch sizes')
+    parser.add_argument('--repeats', type=int, default=1, help='Timed passes over the images per configuration')
+    parser.add_argument('--compiled-dir', default='model/compiled')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Baseline JSON report from another commit')
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help='With --compare: exit 1 if a p50 or the throughput is this many percent worse')
+    args = parser.parse_args()
+
+    backends = [b for b in args.backends.split(',') if b]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        print(f"Unknown backends: {', '.join(sorted(unknown))}")
+        return 1
+    paths = [p for p, _ in list_labeled_images(args.data, CLASS_NAMES, per_class=args.images_per_class)]
+    if not paths:
+        print(f"No images found under {args.data}")
+        return 1
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'data': args.data,
+            'images': len(paths),
+        },
+        'runs': benchmark(paths, backends, _int_list(args.threads), _int_list(args.batch_sizes),
+                          repeats=args.repeats, compiled_dir=args.compiled_dir),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"Report written to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changes, regressions = compare(report, baseline, args.max_regression)
+        for c in changes:
+            print(f"{'/'.join(map(str, c['run'])):<24} {c['metric']:<18} {c['baseline']:>10} -> {c['current']:>10} "
+                  f"({c['change_pct']:+.1f}%)")
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.max_regression}% "
+                  f"against {baseline.get('meta', {}).get('commit')}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
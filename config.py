@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'smart_eye_care_secret_key'
@@ -21,6 +22,86 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'docx'}
+
+    # Inference Micro-Batching (requests arriving within the window share one forward pass)
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE') or 8)
+    INFERENCE_BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_BATCH_WINDOW_MS') or 10)
+    INFERENCE_MAX_QUEUE_SIZE = int(os.environ.get('INFERENCE_MAX_QUEUE_SIZE') or 256)
+
+    # Model loading: 'background' starts at import, 'lazy' on the first analysis request.
+    # Analysis requests wait up to MODEL_READY_TIMEOUT seconds for warmup (0 = fail fast with 503).
+    MODEL_WARMUP = (os.environ.get('MODEL_WARMUP') or 'background').lower()
+    MODEL_READY_TIMEOUT = float(os.environ.get('MODEL_READY_TIMEOUT') or 30)
+
+    # Dedicated inference worker processes shared by all web workers on the host (0 = run in-process).
+    # Requests reach the pool over a local socket; workers split the cores between them.
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS') or 0)
+    INFERENCE_POOL_ADDRESS = os.environ.get('INFERENCE_POOL_ADDRESS') or os.path.join(tempfile.gettempdir(), 'smart_eye_care_inference.sock')
+    INFERENCE_POOL_TIMEOUT = float(os.environ.get('INFERENCE_POOL_TIMEOUT') or 60)
+    INFERENCE_POOL_LOG = os.environ.get('INFERENCE_POOL_LOG') or os.path.join(tempfile.gettempdir(), 'smart_eye_care_inference.log')
+    # A pool server with no clients for this many seconds exits (old versions after a hot swap; 0 = never)
+    INFERENCE_POOL_IDLE_EXIT = float(os.environ.get('INFERENCE_POOL_IDLE_EXIT') or 600)
+
+    # Versioned model weights (python -m model.registry); swaps drain in-flight requests first
+    MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR') or os.path.join(basedir, 'model', 'registry')
+    MODEL_DRAIN_TIMEOUT = float(os.environ.get('MODEL_DRAIN_TIMEOUT') or 120)
+
+    # Shadow evaluation of a candidate get_model architecture (disabled unless SHADOW_MODEL is set).
+    # A sample of /lab/analyze inputs is re-run on a low-priority thread; see /admin/shadow_report.
+    SHADOW_MODEL = os.environ.get('SHADOW_MODEL') or ''
+    SHADOW_MODEL_WEIGHTS = os.environ.get('SHADOW_MODEL_WEIGHTS') or ''
+    SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE') or 0.1)
+    SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING') or 32)
+
+    # INT8 quantized CPU inference (opt-in; calibrated on the DATA/ class folders)
+    INFERENCE_QUANTIZE = os.environ.get('INFERENCE_QUANTIZE', '0').lower() in ('1', 'true', 'yes')
+    QUANTIZATION_DATA_DIR = os.environ.get('QUANTIZATION_DATA_DIR') or os.path.join(basedir, 'DATA')
+    QUANTIZATION_CALIBRATION_PER_CLASS = int(os.environ.get('QUANTIZATION_CALIBRATION_PER_CLASS') or 8)
+
+    # Inference runtime for fp32 models: eager, torchscript, onnxruntime or auto (fastest on this host)
+    INFERENCE_BACKEND = (os.environ.get('INFERENCE_BACKEND') or 'eager').lower()
+    COMPILED_MODEL_DIR = os.environ.get('COMPILED_MODEL_DIR') or os.path.join(basedir, 'model', 'compiled')
+
+    # Ensemble mode: 'full' runs every model, 'cascade' runs AlexNet first and only calls
+    # ResNet50 below the confidence threshold or for clinically sensitive classes
+    ENSEMBLE_MODE = (os.environ.get('ENSEMBLE_MODE') or 'full').lower()
+    CASCADE_CONFIDENCE_THRESHOLD = float(os.environ.get('CASCADE_CONFIDENCE_THRESHOLD') or 0.9)
+    CASCADE_SENSITIVE_CLASSES = [c.strip() for c in (os.environ.get('CASCADE_SENSITIVE_CLASSES') or 'glaucoma,diabetic_retinopathy').split(',') if c.strip()]
+
+    # Pre-inference image quality gate (blur, exposure, fundus field) fills Prediction.image_quality.
+    # With QUALITY_REJECT_POOR, images graded 'Poor' are refused before running the ensemble.
+    QUALITY_REJECT_POOR = os.environ.get('QUALITY_REJECT_POOR', '0').lower() in ('1', 'true', 'yes')
+    QUALITY_BLUR_POOR = float(os.environ.get('QUALITY_BLUR_POOR') or 15)
+    QUALITY_DARK_POOR = float(os.environ.get('QUALITY_DARK_POOR') or 20)
+
+    # GradCAM figure file format: png or webp (smaller, faster to encode)
+    HEATMAP_FORMAT = (os.environ.get('HEATMAP_FORMAT') or 'png').lower()
+    # Only the float16 class maps are stored; images are rendered on request. HEATMAP_SAVE_FIGURE
+    # also writes the fixed-size figure to disk (for clients that read heatmap_path directly).
+    HEATMAP_SAVE_FIGURE = os.environ.get('HEATMAP_SAVE_FIGURE', '0').lower() in ('1', 'true', 'yes')
+    HEATMAP_RENDER_CACHE_SIZE = int(os.environ.get('HEATMAP_RENDER_CACHE_SIZE') or 256)
+    HEATMAP_RENDER_CACHE_MB = int(os.environ.get('HEATMAP_RENDER_CACHE_MB') or 64)
+
+    # Re-uploads of identical bytes reuse the stored result and heatmap (0 disables)
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE') or 512)
+
+    # Asynchronous analysis jobs: /lab/analyze returns 202 + job id unless the form sends async=0
+    ANALYSIS_ASYNC = os.environ.get('ANALYSIS_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+    ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS') or 2)
+    ANALYSIS_JOB_MAX_PENDING = int(os.environ.get('ANALYSIS_JOB_MAX_PENDING') or 64)
+    ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS') or 3)
+    ANALYSIS_JOB_LEASE_SECONDS = float(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS') or 600)  # renewed at every stage
+
+    # Batch Analysis (/lab/analyze_batch)
+    ANALYSIS_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES') or 200)
+    BATCH_MAX_CONTENT_LENGTH = 256 * 1024 * 1024  # 256MB per batch request
+    BATCH_DECODE_WORKERS = int(os.environ.get('BATCH_DECODE_WORKERS') or min(8, os.cpu_count() or 1))
+
+    # Re-scoring backfill of historical predictions (/admin/backfill); yields to live analysis
+    BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE') or 64)
+    BACKFILL_DECODE_WORKERS = int(os.environ.get('BACKFILL_DECODE_WORKERS') or min(4, os.cpu_count() or 1))
+    BACKFILL_MAX_IMAGES_PER_SEC = float(os.environ.get('BACKFILL_MAX_IMAGES_PER_SEC') or 20)
     
     # DuckDNS Configuration
     DUCKDNS_TOKEN = os.environ.get('DUCKDNS_TOKEN') or '56b773ea-01c7-4989-9669-fee274cca3d4'  # Replace with your actual token
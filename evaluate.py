@@ -0,0 +1,225 @@
+"""
+Evaluation Harness with Accuracy Regression Gate
+Evaluates every ensemble member and the weighted ensemble (exactly as
+lab_analyze runs it: InferenceEngine.run_batch, including cascade mode)
+on the labeled class folders in DATA/.
+
+Per model and for the ensemble the report has top-1 accuracy, the
+confusion matrix (rows = true class, columns = predicted class), per-class
+recall, expected calibration error (ECE) and per-image latency percentiles.
+
+With --baseline the ensemble is compared with a stored report and the run
+fails (exit 1) when accuracy, or optionally any class's recall, dropped by
+more than the budget: the gate for speed optimizations such as INT8
+quantization, cascade mode or pruned weights.
+
+Usage:
+    python evaluate.py --output eval_baseline.json
+    python evaluate.py --quantize --baseline eval_baseline.json --accuracy-budget 1.0
+    python evaluate.py --mode cascade --baseline eval_baseline.json --recall-budget 5
+"""
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+import torch
+
+from config import Config
+from preprocessing import CLASS_NAMES, list_labeled_images, load_labeled_batches
+from benchmark import summarize, git_commit
+
+ECE_BINS = 15
+
+
+def expected_calibration_error(confidences, correct, bins=ECE_BINS):
+    """ECE over equal-width confidence bins: sum_b |acc_b - conf_b| * n_b / n"""
+    confidences = np.asarray(confidences, dtype=np.float64)
+    correct = np.asarray(correct, dtype=np.float64)
+    if confidences.size == 0:
+        return None
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    ece = 0.0
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        in_bin = (confidences > lo) & (confidences <= hi)
+        if in_bin.any():
+            ece += abs(correct[in_bin].mean() - confidences[in_bin].mean()) * in_bin.mean()
+    return float(ece)
+
+
+def classification_metrics(labels, probs, latencies_ms, class_names=CLASS_NAMES):
+    """
+    Metrics for one model from its (N, C) probabilities
+
+    Returns:
+        dict: accuracy, confusion_matrix, per_class_recall, ece, latency_ms
+    """
+    labels = np.asarray(labels)
+    probs = np.asarray(probs)
+    predicted = probs.argmax(axis=1)
+    num_classes = len(class_names)
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(confusion, (labels, predicted), 1)
+    support = confusion.sum(axis=1)
+    recall = {
+        name: round(float(confusion[i, i] / support[i]), 4) if support[i] else None
+        for i, name in enumerate(class_names)
+    }
+    correct = predicted == labels
+    return {
+        'images': int(labels.size),
+        'accuracy': round(float(correct.mean()), 4) if labels.size else None,
+        'confusion_matrix': confusion.tolist(),
+        'per_class_recall': recall,
+        'ece': round(expected_calibration_error(probs.max(axis=1), correct), 4) if labels.size else None,
+        'latency_ms': summarize(latencies_ms),
+    }
+
+
+def evaluate(engine, samples, batch_size=1):
+    """
+    Run each member on its own, then the ensemble through engine.run_batch
+
+    Per-image latency is batch time / batch size; batch_size=1 matches a
+    single /lab/analyze upload. Decoding is excluded.
+    """
+    names = list(engine.models.keys())
+    probs = {name: [] for name in names + ['ensemble']}
+    latencies = {name: [] for name in names + ['ensemble']}
+    labels = []
+    models_used = {}
+
+    for images, batch_labels in load_labeled_batches(samples, batch_size):
+        n = batch_labels.shape[0]
+        labels.extend(batch_labels.tolist())
+        for name in names:
+            start = time.perf_counter()
+            out = engine.forward(images, [name])['probs'][name]
+            latencies[name].extend([(time.perf_counter() - start) * 1000.0 / n] * n)
+            probs[name].extend(out.tolist())
+
+        start = time.perf_counter()
+        results = engine.run_batch(images)
+        latencies['ensemble'].extend([(time.perf_counter() - start) * 1000.0 / n] * n)
+        for result in results:
+            probs['ensemble'].append(result['mean'][0].tolist())
+            key = ','.join(result['models_used'])
+            models_used[key] = models_used.get(key, 0) + 1
+
+    report = {name: classification_metrics(labels, probs[name], latencies[name]) for name in probs}
+    report['ensemble']['models_used'] = models_used
+    return report
+
+
+def check_budget(report, baseline, accuracy_budget, recall_budget=None, model='ensemble'):
+    """
+    Accuracy (and optionally per-class recall) drops against a baseline, in percentage points
+
+    Returns:
+        list: human-readable violations (empty when within budget)
+    """
+    current, base = report['models'].get(model), baseline['models'].get(model)
+    if current is None or base is None:
+        return [f"{model} missing from {'report' if current is None else 'baseline'}"]
+    violations = []
+    drop = (base['accuracy'] - current['accuracy']) * 100.0
+    if drop > accuracy_budget:
+        violations.append(f"{model} accuracy {base['accuracy']:.4f} -> {current['accuracy']:.4f} "
+                          f"(-{drop:.2f} pts, budget {accuracy_budget} pts)")
+    if recall_budget is not None:
+        for cls, old in base['per_class_recall'].items():
+            new = current['per_class_recall'].get(cls)
+            if old is None or new is None:
+                continue
+            drop = (old - new) * 100.0
+            if drop > recall_budget:
+                violations.append(f"{model} recall[{cls}] {old:.4f} -> {new:.4f} "
+                                  f"(-{drop:.2f} pts, budget {recall_budget} pts)")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the ensemble on the labeled DATA/ folders')
+    parser.add_argument('--data', default='DATA', help='Folder with one sub-folder per class')
+    parser.add_argument('--per-class', type=int, default=None, help='Cap images per class')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--model-version', help='Registry version (default: the active one)')
+    parser.add_argument('--mode', default='full', choices=['full', 'cascade'])
+    parser.add_argument('--cascade-threshold', type=float, default=Config.CASCADE_CONFIDENCE_THRESHOLD)
+    parser.add_argument('--sensitive-classes', default=','.join(Config.CASCADE_SENSITIVE_CLASSES),
+                        help='Comma-separated class names escalated in cascade mode (default: as configured for the app)')
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--backend', default='eager')
+    parser.add_argument('--output', help='Write the JSON report to this file (e.g. to store a baseline)')
+    parser.add_argument('--baseline', help='Stored report to compare the ensemble against')
+    parser.add_argument('--accuracy-budget', type=float, default=1.0,
+                        help='Allowed ensemble accuracy drop vs the baseline, in percentage points')
+    parser.add_argument('--recall-budget', type=float, default=None,
+                        help='Allowed per-class recall drop vs the baseline, in percentage points')
+    args = parser.parse_args()
+
+    from model.architectures import load_ensemble_models
+    from model.registry import ModelRegistry
+    from inference_service import InferenceEngine
+
+    samples = list_labeled_images(args.data, CLASS_NAMES, per_class=args.per_class)
+    if not samples:
+        print(f"No labeled images found under {args.data}")
+        return 1
+
+    registry = ModelRegistry()
+    version = args.model_version or registry.active_version()
+    models_dict = load_ensemble_models(torch.device('cpu'), quantize=args.quantize, backend=args.backend,
+                                       weight_files=registry.weight_files(version))
+    if not models_dict:
+        print("No models could be loaded")
+        return 1
+    sensitive = [CLASS_NAMES.index(c) for c in args.sensitive_classes.split(',') if c in CLASS_NAMES]
+    engine = InferenceEngine(models_dict, capture=(), mode=args.mode,
+                             cascade_threshold=args.cascade_threshold, sensitive_classes=sensitive)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(),
+            'model_version': version,
+            'mode': args.mode,
+            'cascade_threshold': args.cascade_threshold,
+            'sensitive_classes': [CLASS_NAMES[i] for i in sensitive],
+            'quantize': args.quantize,
+            'backend': args.backend,
+            'batch_size': args.batch_size,
+            'data': args.data,
+            'class_names': CLASS_NAMES,
+        },
+        'models': evaluate(engine, samples, args.batch_size),
+    }
+
+    for name, m in report['models'].items():
+        latency = m['latency_ms'] or {}
+        print(f"{name:<10} accuracy {m['accuracy']:.4f}  ECE {m['ece']:.4f}  "
+              f"latency p50 {latency.get('p50')} / p95 {latency.get('p95')} / p99 {latency.get('p99')} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        violations = check_budget(report, baseline, args.accuracy_budget, args.recall_budget)
+        if violations:
+            print("Accuracy budget exceeded:")
+            for v in violations:
+                print(f"  {v}")
+            return 1
+        base_ms = (baseline['models']['ensemble']['latency_ms'] or {}).get('p50')
+        new_ms = (report['models']['ensemble']['latency_ms'] or {}).get('p50')
+        print(f"Within budget; ensemble p50 latency {base_ms} -> {new_ms} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+GradCAM Rendering Module
+Composites the 3-panel GradCAM figure (original, heatmap, overlay) directly
+with NumPy and PIL and writes it straight to disk, replacing the matplotlib
+figure (slow, and its global pyplot state is not thread-safe).
+
+The output matches the previous figure: a 'jet' colormap, the map upsampled
+to the image size (bilinear here instead of scipy's cubic-spline zoom), a
+0.4 / 0.6 image / heatmap overlay, and titled panels on a white background.
+As with imshow, each panel keeps the source image's aspect ratio, centered
+in its PANEL_SIZE square; pass pixels decoded from the original upload
+(preprocessing.decode_display_image), not the square model input.
+
+`render_overlay` produces just the overlay panel at any size, opacity and
+colormap, for rendering variants on request from the stored maps.
+"""
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Figure layout in pixels (the previous 15x5 in figure at 100 dpi, tightly cropped)
+PANEL_SIZE = 470
+PANEL_GAP = 25
+MARGIN = 10
+TITLE_HEIGHT = 30
+TITLE_FONT_SIZE = 17
+PANEL_TITLES = ('Original Image', 'GradCAM Heatmap', 'Overlay Visualization')
+OVERLAY_ALPHA = 0.6
+# Edge length limits (pixels) for overlays rendered on request
+OVERLAY_MIN_SIZE = 32
+OVERLAY_MAX_SIZE = 1024
+
+FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+
+# matplotlib's 'jet' segment data: (x, value) breakpoints per channel
+_JET_SEGMENTS = (
+    ((0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)),
+    ((0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)),
+    ((0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)),
+)
+
+
+def _build_lut(segments, n=256):
+    x = np.linspace(0.0, 1.0, n)
+    channels = [np.interp(x, [p[0] for p in seg], [p[1] for p in seg]) for seg in segments]
+    return np.round(np.stack(channels, axis=1) * 255).astype(np.uint8)
+
+
+JET_LUT = _build_lut(_JET_SEGMENTS)
+
+# Other overlay colormaps: matplotlib's 'hot' segments and 'viridis' sampled at 9 points
+_HOT_SEGMENTS = (
+    ((0.0, 0.0416), (0.365079, 1.0), (1.0, 1.0)),
+    ((0.0, 0.0), (0.365079, 0.0), (0.746032, 1.0), (1.0, 1.0)),
+    ((0.0, 0.0), (0.746032, 0.0), (1.0, 1.0)),
+)
+_VIRIDIS_POINTS = ((68, 1, 84), (71, 44, 122), (59, 81, 139), (44, 113, 142), (33, 144, 141),
+                   (39, 173, 129), (92, 200, 99), (170, 220, 50), (253, 231, 37))
+_VIRIDIS_SEGMENTS = tuple(
+    tuple((i / (len(_VIRIDIS_POINTS) - 1), rgb[c] / 255.0) for i, rgb in enumerate(_VIRIDIS_POINTS))
+    for c in range(3)
+)
+_GRAY_SEGMENTS = (((0.0, 0.0), (1.0, 1.0)),) * 3
+
+COLORMAPS = {
+    'jet': JET_LUT,
+    'hot': _build_lut(_HOT_SEGMENTS),
+    'viridis': _build_lut(_VIRIDIS_SEGMENTS),
+    'gray': _build_lut(_GRAY_SEGMENTS),
+}
+
+
+def apply_colormap(values, lut=JET_LUT):
+    """(H, W) floats in [0, 1] -> (H, W, 3) uint8 through a 256-entry LUT"""
+    idx = np.clip((np.asarray(values, dtype=np.float32) * len(lut)).astype(np.int32), 0, len(lut) - 1)
+    return lut[idx]
+
+
+def upsample_bilinear(grid, height, width):
+    """
+    Bilinear resize of a 2D map with the corners aligned (like scipy's zoom),
+    fully vectorized
+    """
+    grid = np.asarray(grid, dtype=np.float32)
+    if grid.ndim != 2:
+        raise ValueError(f"Expected a 2D map, got shape {grid.shape}")
+    h, w = grid.shape
+    ys = np.linspace(0.0, h - 1, height, dtype=np.float32)
+    xs = np.linspace(0.0, w - 1, width, dtype=np.float32)
+    y0 = np.floor(ys).astype(np.int32)
+    x0 = np.floor(xs).astype(np.int32)
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+    wy = (ys - y0)[:, None]
+    wx = (xs - x0)[None, :]
+    top = grid[y0][:, x0] * (1 - wx) + grid[y0][:, x1] * wx
+    bottom = grid[y1][:, x0] * (1 - wx) + grid[y1][:, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def normalize(values):
+    """Min-max scale to [0, 1] (constant maps become all zeros)"""
+    lo, hi = float(values.min()), float(values.max())
+    if hi - lo <= 1e-8:
+        return np.zeros_like(values, dtype=np.float32)
+    return (values - lo) / (hi - lo)
+
+
+def _title_font():
+    try:
+        return ImageFont.load_default(size=TITLE_FONT_SIZE)
+    except TypeError:  # Pillow < 10.1 has only the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def gradcam_panels(pixels, cam):
+    """
+    The three panel images for a decoded image and its GradCAM map
+
+    Args:
+        pixels: (H, W, 3) uint8 image the map was computed for
+        cam: 2D map in [0, 1] at feature-map (or any) resolution
+
+    Returns:
+        list: original, heatmap and overlay as (H, W, 3) uint8 arrays
+    """
+    height, width = pixels.shape[:2]
+    cam = upsample_bilinear(cam, height, width)
+    # Overlay uses the map as is; the heatmap panel is scaled to its own range (as imshow did)
+    return [pixels, apply_colormap(normalize(cam)), blend(pixels, cam)]
+
+
+def blend(pixels, cam, opacity=OVERLAY_ALPHA, lut=JET_LUT):
+    """(1 - opacity) * image + opacity * colored map, both (H, W[, 3]) at the same size"""
+    return ((1.0 - opacity) * pixels + opacity * apply_colormap(cam, lut)).astype(np.uint8)
+
+
+def render_overlay(pixels, cam, opacity=OVERLAY_ALPHA, colormap='jet'):
+    """
+    Overlay panel alone as a PIL image, at the size of `pixels`
+
+    Args:
+        pixels: (H, W, 3) uint8 image, already decoded at the wanted size
+        cam: 2D map in [0, 1] at feature-map resolution
+        opacity: weight of the colored map, 0 (image only) to 1 (map only)
+        colormap: one of COLORMAPS
+    """
+    if colormap not in COLORMAPS:
+        raise ValueError(f"Unknown colormap: {colormap}")
+    if not 0.0 <= opacity <= 1.0:
+        raise ValueError(f"Opacity must be between 0 and 1, got {opacity}")
+    height, width = pixels.shape[:2]
+    return Image.fromarray(blend(pixels, upsample_bilinear(cam, height, width), opacity, COLORMAPS[colormap]))
+
+
+def fit_panel(pixels, size=PANEL_SIZE):
+    """Resize (H, W, 3) pixels so the longer side is `size`, keeping the aspect ratio"""
+    height, width = pixels.shape[:2]
+    if max(height, width) == size:
+        return pixels
+    scale = size / max(height, width)
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.asarray(Image.fromarray(pixels).resize(target, Image.BILINEAR))
+
+
+def render_gradcam_figure(pixels, cam):
+    """Composite the titled 3-panel figure as a PIL image (panels letterboxed to the image's aspect ratio)"""
+    panels = gradcam_panels(fit_panel(pixels), cam)
+    width = 2 * MARGIN + 3 * PANEL_SIZE + 2 * PANEL_GAP
+    height = TITLE_HEIGHT + PANEL_SIZE + MARGIN
+    figure = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(figure)
+    font = _title_font()
+    for i, (panel, title) in enumerate(zip(panels, PANEL_TITLES)):
+        left = MARGIN + i * (PANEL_SIZE + PANEL_GAP)
+        panel_height, panel_width = panel.shape[:2]
+        figure.paste(Image.fromarray(panel), (left + (PANEL_SIZE - panel_width) // 2,
+                                              TITLE_HEIGHT + (PANEL_SIZE - panel_height) // 2))
+        draw.text((left + PANEL_SIZE // 2, TITLE_HEIGHT // 2), title, fill='black', font=font, anchor='mm')
+    return figure
+
+
+def write_figure(figure, fp, image_format):
+    """Encode a rendered figure to a path or file object as 'png' or 'webp'"""
+    if image_format not in FORMATS:
+        raise ValueError(f"Unsupported heatmap format: {image_format}")
+    # Fast encoder settings: zlib level 1 / WebP method 0 cost a fraction of the defaults
+    options = {'compress_level': 1} if image_format == 'png' else {'quality': 85, 'method': 0}
+    figure.save(fp, FORMATS[image_format], **options)
+
+
+def save_gradcam_figure(pixels, cam, path, image_format=None):
+    """
+    Render and write the figure to `path`
+
+    Args:
+        image_format: 'png' or 'webp' (default: from the file extension)
+    """
+    image_format = (image_format or os.path.splitext(path)[1].lstrip('.') or 'png').lower()
+    write_figure(render_gradcam_figure(pixels, cam), path, image_format)
+    return path
@@ -0,0 +1,402 @@
+"""
+On-demand GradCAM Heatmaps
+Heatmaps are no longer rendered during analysis: the first report view that
+needs one computes the maps of all classes, stores them as a small float16
+array under UPLOAD_FOLDER/cams (optionally also the fixed-size figure for
+the predicted class under UPLOAD_FOLDER/heatmaps), and the caller records
+the paths on the Prediction. Images are then rendered on request from the
+stored maps: the 3-panel figure for any class, or the overlay alone at a
+given size, opacity and colormap. Rendered variants are kept in an LRU
+cache bounded by entries and bytes.
+
+The maps are an ensemble explanation:
+
+    alexnet    GradCAM, computed here: one AlexNet forward and one batched
+               head replay for every class (its classifier has hidden
+               layers, so plain CAM does not apply)
+    resnet50   CAM: fc weights applied to the layer4 feature map, computed
+               by the engine during the analysis pass itself (no backward,
+               no second forward) and stored right away by the caller with
+               `save_member_cams`; members that did not run (cascade mode)
+               simply have no maps
+
+All available maps are resampled to the finest member grid and averaged
+with the ensemble weights (ensemble_weight), so the explanation leans on
+the members the same way the prediction does.
+
+Concurrent requests for the same prediction share one computation
+(single-flight); file names are derived from the image name and the model
+version of the prediction and written atomically, so other processes
+serving the same uploads reuse them too. The GradCAM part only runs when
+the serving runtime is the version that made the prediction: after a hot
+swap, older predictions are explained from their stored analysis-time
+maps alone (or not at all), never with the new weights.
+"""
+import os
+import io
+import re
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from preprocessing import INPUT_SIZE, decode_image, decode_display_image, pixels_to_tensor
+from model.architectures import gradcam_all_classes, normalize_maps
+from inference_service import ensemble_weight, use_serving_runtime
+from heatmap_render import (save_gradcam_figure, render_gradcam_figure, render_overlay, write_figure,
+                            upsample_bilinear, COLORMAPS, OVERLAY_ALPHA, OVERLAY_MIN_SIZE, OVERLAY_MAX_SIZE,
+                            PANEL_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Members explained with GradCAM on first view (the CAM members come from the analysis pass)
+GRADCAM_MODELS = ('alexnet',)
+
+
+def _stem(image_path, model_version=None):
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    if model_version:
+        stem = f"{stem}.{re.sub(r'[^A-Za-z0-9_-]', '_', model_version)}"
+    return stem
+
+
+def heatmap_relpath(image_path, image_format='png', model_version=None):
+    """Heatmap location (relative to UPLOAD_FOLDER) for an uploaded image and the model version that analyzed it"""
+    return os.path.join('heatmaps', f"heatmap_{_stem(image_path, model_version)}.{image_format}")
+
+
+def cam_relpath(image_path, model_version=None):
+    """Location of the all-classes GradCAM maps (relative to UPLOAD_FOLDER)"""
+    return os.path.join('cams', f"cam_{_stem(image_path, model_version)}.npy")
+
+
+def member_cams_relpath(image_path):
+    """Location of the per-member CAMs stored at analysis time (relative to UPLOAD_FOLDER)"""
+    # Written by the analysis pass itself, so always from the prediction's own model version
+    return os.path.join('cams', f"cam_{_stem(image_path)}.members.npz")
+
+
+def combine_maps(maps_by_model):
+    """
+    Ensemble-weighted average of per-model (K, h, w) class maps
+
+    Maps on coarser grids are upsampled (bilinear, corners aligned) to the
+    finest grid first; every combined map is renormalized to [0, 1].
+    """
+    height = max(m.shape[1] for m in maps_by_model.values())
+    width = max(m.shape[2] for m in maps_by_model.values())
+    total = np.zeros((next(iter(maps_by_model.values())).shape[0], height, width), dtype=np.float32)
+    weight_sum = 0.0
+    for name, maps in maps_by_model.items():
+        if maps.shape[1:] != (height, width):
+            maps = np.stack([upsample_bilinear(m, height, width) for m in maps])
+        total += ensemble_weight(name) * maps
+        weight_sum += ensemble_weight(name)
+    return normalize_maps(total / weight_sum)
+
+
+def _atomic_write(full_path, write):
+    """Write via a temporary file and rename, so readers never see a partial file"""
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, full_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of encoded images, bounded by entry count and total
+    bytes (whichever is hit first). `max_entries=0` disables it.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 2 ** 20):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return data
+
+    def put(self, key, data):
+        if not self.max_entries or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        lookups = s['hits'] + s['misses']
+        s['hit_rate'] = round(s['hits'] / lookups, 4) if lookups else 0.0
+        s['max_entries'] = self.max_entries
+        s['max_bytes'] = self.max_bytes
+        return s
+
+
+class LazyHeatmaps:
+    """
+    Single-flight GradCAM renderer
+
+    `get_runtime()` returns the serving InferenceRuntime (None while models
+    load); its GRADCAM_MODELS members are explained for every class and
+    combined with the member CAMs stored at analysis time.
+    With `save_figure` the predicted class's 3-panel figure is also written
+    to disk (about 300 KB per report as PNG, versus under 1 KB for the maps).
+    """
+
+    def __init__(self, get_runtime, upload_folder, class_names, image_format='png', wait_timeout=60, device=None,
+                 save_figure=False, render_cache=None):
+        self.get_runtime = get_runtime
+        self.upload_folder = upload_folder
+        self.class_names = list(class_names)
+        self.image_format = image_format
+        self.wait_timeout = wait_timeout
+        self.device = device or torch.device('cpu')
+        self.save_figure = save_figure
+        self.render_cache = render_cache if render_cache is not None else RenderCache()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {'rendered': 0, 'reused': 0, 'coalesced': 0, 'failed': 0, 'version_mismatch': 0,
+                       'render_ms_total': 0.0}
+
+    def _exists(self, relpath):
+        return bool(relpath) and os.path.exists(os.path.join(self.upload_folder, relpath))
+
+    def ensure(self, prediction_id, image_path, predicted_class, heatmap_path=None, cam_path=None,
+               model_version=None):
+        """
+        Heatmap figure and class maps of a prediction, computing them if needed
+
+        Args:
+            model_version: Prediction.model_version; the serving runtime's
+                models are only used when they are that version
+
+        Returns:
+            dict or None: 'heatmap_path' and 'cam_path' relative to the upload
+            folder ('heatmap_path' is None unless a figure was stored); None
+            if they could not be produced, e.g. models still loading or the
+            image is gone
+        """
+        # Recorded paths are kept even before they exist: a duplicate upload points at the
+        # files of the identical earlier one (see shared_paths) and renders into them
+        if heatmap_path:
+            figure_path = heatmap_path
+        else:
+            figure_path = heatmap_relpath(image_path, self.image_format, model_version) if self.save_figure else None
+        paths = {
+            'heatmap_path': figure_path,
+            'cam_path': cam_path or cam_relpath(image_path, model_version),
+        }
+        if all(self._exists(p) for p in paths.values() if p is not None):
+            if (heatmap_path, cam_path) != (paths['heatmap_path'], paths['cam_path']):
+                self._count('reused')
+            return paths
+        if self.get_runtime() is None:
+            return None
+
+        # Coalesced on the output file, so predictions sharing it render once
+        key = paths['cam_path']
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self._stats['coalesced'] += 1
+        if not owner:
+            try:
+                return future.result(timeout=self.wait_timeout)
+            except Exception:
+                return None
+
+        try:
+            self._render(image_path, predicted_class, paths, model_version)
+            future.set_result(paths)
+            return paths
+        except Exception as e:
+            logger.error(f"Heatmap for prediction {prediction_id} failed: {e}")
+            self._count('failed')
+            future.set_result(None)
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def shared_paths(self, source_image_path, model_version):
+        """
+        Explanation files of an identical earlier upload (a result cache hit),
+        to be recorded on the new prediction instead of rendering its own copy
+        """
+        return {
+            'heatmap_path': heatmap_relpath(source_image_path, self.image_format, model_version) if self.save_figure else None,
+            'cam_path': cam_relpath(source_image_path, model_version),
+        }
+
+    def _render(self, image_path, predicted_class, paths, model_version=None):
+        start = time.perf_counter()
+        pixels = decode_image(os.path.join(self.upload_folder, image_path))
+        tensor = pixels_to_tensor(pixels).unsqueeze(0).to(self.device)
+        classes = range(len(self.class_names))
+        member_maps = self.load_member_cams(image_path)
+        with use_serving_runtime(self.get_runtime) as runtime:
+            same_weights = model_version is None or model_version == runtime.version
+            if not same_weights:
+                self._count('version_mismatch')
+                logger.warning(f"{image_path} was analyzed by model version {model_version}, serving "
+                               f"{runtime.version}: explaining from the stored analysis maps only")
+            engine = runtime.engine
+            names = [n for n in GRADCAM_MODELS if n in engine.models and engine.head(n) is not None]
+            if names and same_weights:
+                activations = engine.forward(tensor, names)['activations']
+                member_maps.update({n: gradcam_all_classes(engine.explain_head(n), activations[n], classes)
+                                    for n in names})
+        if not member_maps:
+            raise RuntimeError("No explainable model loaded" if same_weights else
+                               f"No stored maps and model version {model_version} is no longer serving")
+        maps = combine_maps(member_maps)
+
+        def save_maps(tmp_path):
+            # (num_classes, h, w) float16: under a kilobyte at ResNet's 8x8 grid
+            # (compressing such a small array would not save anything)
+            with open(tmp_path, 'wb') as f:
+                np.save(f, maps.astype(np.float16))
+
+        _atomic_write(os.path.join(self.upload_folder, paths['cam_path']), save_maps)
+        if paths['heatmap_path'] and not self._exists(paths['heatmap_path']):
+            _atomic_write(os.path.join(self.upload_folder, paths['heatmap_path']),
+                          lambda tmp: save_gradcam_figure(self._display_pixels(image_path),
+                                                          maps[self.class_names.index(predicted_class)],
+                                                          tmp, self.image_format))
+        with self._lock:
+            self._stats['rendered'] += 1
+            self._stats['render_ms_total'] += (time.perf_counter() - start) * 1000.0
+
+    def _display_pixels(self, image_path):
+        """The upload at figure panel size, aspect ratio kept (not the square model input)"""
+        return decode_display_image(os.path.join(self.upload_folder, image_path), PANEL_SIZE)
+
+    def save_member_cams(self, image_path, cams):
+        """
+        Store the CAMs the engine computed during analysis ({model name:
+        (num_classes, h, w)}, float16 npz) for the first view to combine
+
+        Returns:
+            str or None: path relative to the upload folder (None if there were no maps)
+        """
+        if not cams:
+            return None
+        relpath = member_cams_relpath(image_path)
+
+        def save(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **{n: np.asarray(c, dtype=np.float16) for n, c in cams.items()})
+
+        _atomic_write(os.path.join(self.upload_folder, relpath), save)
+        return relpath
+
+    def load_member_cams(self, image_path):
+        """Member CAMs stored at analysis time as {model name: float32 maps} (empty if none)"""
+        full_path = os.path.join(self.upload_folder, member_cams_relpath(image_path))
+        if not os.path.exists(full_path):
+            return {}
+        with np.load(full_path) as stored:
+            return {n: stored[n].astype(np.float32) for n in stored.files}
+
+    def class_maps(self, cam_path):
+        """Stored GradCAM maps as {class name: (h, w) float32 array}"""
+        maps = np.load(os.path.join(self.upload_folder, cam_path)).astype(np.float32)
+        return dict(zip(self.class_names, maps))
+
+    def class_figure(self, image_path, cam_path, class_name, image_format=None):
+        """
+        Encoded 3-panel figure explaining `class_name`, rendered from the
+        stored maps (no model work)
+
+        Returns:
+            bytes
+        """
+        image_format = image_format or self.image_format
+
+        def render():
+            return render_gradcam_figure(self._display_pixels(image_path), self.class_maps(cam_path)[class_name])
+
+        return self._cached(('figure', cam_path, class_name, image_format), render, image_format)
+
+    def overlay(self, image_path, cam_path, class_name, size=INPUT_SIZE, opacity=OVERLAY_ALPHA,
+                colormap='jet', image_format=None):
+        """
+        Encoded overlay of the `class_name` map on the image, `size` pixels
+        square, decoded straight at that size from the upload
+
+        Raises:
+            ValueError: size, opacity or colormap out of range
+
+        Returns:
+            bytes
+        """
+        # Checked before any work so bad requests never render
+        if not OVERLAY_MIN_SIZE <= size <= OVERLAY_MAX_SIZE:
+            raise ValueError(f"Size must be between {OVERLAY_MIN_SIZE} and {OVERLAY_MAX_SIZE} pixels, got {size}")
+        if not 0.0 <= opacity <= 1.0:
+            raise ValueError(f"Opacity must be between 0 and 1, got {opacity}")
+        if colormap not in COLORMAPS:
+            raise ValueError(f"Unknown colormap: {colormap} (available: {', '.join(COLORMAPS)})")
+        image_format = image_format or self.image_format
+        opacity = round(float(opacity), 2)  # bounds the number of distinct cached variants
+
+        def render():
+            pixels = decode_image(os.path.join(self.upload_folder, image_path), size=size)
+            return render_overlay(pixels, self.class_maps(cam_path)[class_name], opacity, colormap)
+
+        key = ('overlay', cam_path, class_name, size, opacity, colormap, image_format)
+        return self._cached(key, render, image_format)
+
+    def _cached(self, key, render, image_format):
+        data = self.render_cache.get(key)
+        if data is None:
+            buffer = io.BytesIO()
+            write_figure(render(), buffer, image_format)
+            data = buffer.getvalue()
+            self.render_cache.put(key, data)
+        return data
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['in_flight'] = len(self._inflight)
+        total = s.pop('render_ms_total')
+        s['avg_render_ms'] = round(total / s['rendered'], 1) if s['rendered'] else 0.0
+        s['save_figure'] = self.save_figure
+        s['render_cache'] = self.render_cache.stats()
+        return s
@@ -0,0 +1,208 @@
+"""
+Image Quality Gate
+Fast capture-quality assessment that runs on the 227x227 pixels already
+decoded for inference, before any model runs:
+
+    sharpness   variance of the 4-neighbour Laplacian of the luminance
+    exposure    luminance histogram: mean level and clipped dark/bright share
+    fundus      circular field of view (bright disc on a dark surround);
+                when found, sharpness and exposure are measured inside it
+
+Everything is vectorized NumPy (no OpenCV) and costs well under a
+millisecond per image. The grade matches Prediction.image_quality:
+'Good', 'Adequate' or 'Poor'.
+"""
+import time
+import threading
+
+import numpy as np
+
+QUALITY_GRADES = ('Good', 'Adequate', 'Poor')
+
+# Defaults tuned on the DATA/ class folders (external eye photos and fundus images)
+DEFAULT_THRESHOLDS = {
+    'blur_poor': 15.0,          # Laplacian variance below this: unusable
+    'blur_adequate': 40.0,
+    'dark_poor': 20.0,          # mean luminance (0-255) of the field
+    'dark_adequate': 45.0,
+    'bright_poor': 235.0,
+    'bright_adequate': 215.0,
+    'clipped_poor': 0.85,       # share of field pixels at the histogram ends
+    'clipped_adequate': 0.6,    # external eye photos often have a dark surround
+}
+
+# Luminance at or below which a pixel counts as fundus-camera background
+FUNDUS_BACKGROUND_LEVEL = 12
+# Histogram ends for the clipped share
+CLIP_DARK, CLIP_BRIGHT = 8, 247
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def luminance(pixels):
+    """(H, W, 3) uint8 -> (H, W) float32 luminance"""
+    return pixels.astype(np.float32) @ _LUMA
+
+
+def laplacian_variance(gray, mask=None):
+    """Variance of the 4-neighbour Laplacian (higher = sharper), optionally inside a mask"""
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4.0 * gray[1:-1, 1:-1])
+    if mask is not None:
+        # Only interior pixels whose whole neighbourhood is inside the field,
+        # so the field edge itself does not count as detail
+        inner = mask[1:-1, 1:-1] & mask[:-2, 1:-1] & mask[2:, 1:-1] & mask[1:-1, :-2] & mask[1:-1, 2:]
+        lap = lap[inner]
+    return float(lap.var()) if lap.size else 0.0
+
+
+def exposure_stats(gray, mask=None):
+    """Mean luminance and the dark/bright clipped shares from a 256-bin histogram"""
+    values = gray[mask] if mask is not None else gray.ravel()
+    hist = np.bincount(np.clip(values, 0, 255).astype(np.uint8).ravel(), minlength=256)
+    total = hist.sum() or 1
+    levels = np.arange(256)
+    return {
+        'mean_luminance': float((hist * levels).sum() / total),
+        'dark_fraction': float(hist[:CLIP_DARK + 1].sum() / total),
+        'bright_fraction': float(hist[CLIP_BRIGHT:].sum() / total),
+    }
+
+
+def detect_fundus_circle(gray):
+    """
+    Find a circular field of view: the pixels above the background level must
+    form a roughly centred disc with dark corners
+
+    Returns:
+        dict: detected, coverage (field share of the frame), circularity
+        (field area / area of the circle spanning its extent), center, radius
+        and the boolean mask (None when no field was found)
+    """
+    mask = gray > FUNDUS_BACKGROUND_LEVEL
+    h, w = gray.shape
+    coverage = float(mask.mean())
+    rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+    if coverage == 0.0 or coverage == 1.0 or rows.size == 0:
+        return {'detected': False, 'coverage': coverage, 'circularity': 0.0, 'center': None, 'radius': None, 'mask': None}
+
+    radius = max(rows[-1] - rows[0] + 1, cols[-1] - cols[0] + 1) / 2.0
+    # The disc may be cropped top/bottom by the sensor; compare with the visible part of the circle
+    yy, xx = np.ogrid[:h, :w]
+    cy, cx = (rows[0] + rows[-1]) / 2.0, (cols[0] + cols[-1]) / 2.0
+    circle = (yy - cy) ** 2 + (xx - cx) ** 2 <= radius ** 2
+    circle_area = circle.sum()
+    overlap = (mask & circle).sum()
+    circularity = float(overlap / max(circle_area, 1) * overlap / max(mask.sum(), 1))
+    corners = np.concatenate([mask[:h // 8, :w // 8].ravel(), mask[:h // 8, -w // 8:].ravel(),
+                              mask[-h // 8:, :w // 8].ravel(), mask[-h // 8:, -w // 8:].ravel()])
+    detected = circularity > 0.8 and corners.mean() < 0.2 and coverage > 0.2
+    return {
+        'detected': bool(detected),
+        'coverage': round(coverage, 4),
+        'circularity': round(circularity, 4),
+        'center': (round(float(cy), 1), round(float(cx), 1)),
+        'radius': round(float(radius), 1),
+        'mask': mask if detected else None,
+    }
+
+
+def grade_quality(metrics, thresholds=DEFAULT_THRESHOLDS):
+    """(grade, reasons) from the measured metrics"""
+    t = thresholds
+    poor, adequate = [], []
+    sharpness = metrics['laplacian_variance']
+    if sharpness < t['blur_poor']:
+        poor.append('blurred')
+    elif sharpness < t['blur_adequate']:
+        adequate.append('slightly blurred')
+
+    level = metrics['mean_luminance']
+    if level < t['dark_poor']:
+        poor.append('underexposed')
+    elif level < t['dark_adequate']:
+        adequate.append('dark')
+    if level > t['bright_poor']:
+        poor.append('overexposed')
+    elif level > t['bright_adequate']:
+        adequate.append('bright')
+
+    clipped = metrics['dark_fraction'] + metrics['bright_fraction']
+    if clipped > t['clipped_poor']:
+        poor.append('clipped exposure')
+    elif clipped > t['clipped_adequate']:
+        adequate.append('partly clipped exposure')
+
+    if poor:
+        return 'Poor', poor + adequate
+    return ('Adequate', adequate) if adequate else ('Good', [])
+
+
+def assess_quality(pixels, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Quality report for one decoded image
+
+    Returns:
+        dict: grade, reasons, metrics (sharpness, exposure, fundus field) and ms
+    """
+    start = time.perf_counter()
+    gray = luminance(pixels)
+    fundus = detect_fundus_circle(gray)
+    mask = fundus.pop('mask')
+    metrics = {'laplacian_variance': round(laplacian_variance(gray, mask), 2)}
+    metrics.update({k: round(v, 4) for k, v in exposure_stats(gray, mask).items()})
+    metrics['fundus'] = fundus
+    grade, reasons = grade_quality(metrics, thresholds)
+    return {
+        'grade': grade,
+        'reasons': reasons,
+        'metrics': metrics,
+        'ms': round((time.perf_counter() - start) * 1000.0, 3),
+    }
+
+
+class QualityGate:
+    """
+    Thread-safe wrapper that assesses images and keeps per-grade counts and
+    the per-image cost. With `reject_poor`, callers skip inference for
+    'Poor' images (see `should_reject`).
+    """
+
+    def __init__(self, thresholds=None, reject_poor=False):
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.reject_poor = reject_poor
+        self._lock = threading.Lock()
+        self._stats = {'assessed': 0, 'rejected': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                       'grades': {g: 0 for g in QUALITY_GRADES}}
+
+    def assess(self, pixels):
+        report = assess_quality(pixels, self.thresholds)
+        with self._lock:
+            self._stats['assessed'] += 1
+            self._stats['total_ms'] += report['ms']
+            self._stats['max_ms'] = max(self._stats['max_ms'], report['ms'])
+            self._stats['grades'][report['grade']] += 1
+        return report
+
+    def should_reject(self, report):
+        if self.reject_poor and report['grade'] == 'Poor':
+            with self._lock:
+                self._stats['rejected'] += 1
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats, grades=dict(self._stats['grades']))
+        s['avg_ms'] = round(s.pop('total_ms') / s['assessed'], 3) if s['assessed'] else 0.0
+        s['max_ms'] = round(s['max_ms'], 3)
+        s['reject_poor'] = self.reject_poor
+        return s
+
+
+class ImageQualityRejected(ValueError):
+    """Raised instead of running inference on an image graded 'Poor'"""
+
+    def __init__(self, report):
+        self.report = report
+        super().__init__(f"Image quality too poor for analysis: {', '.join(report['reasons'])}")
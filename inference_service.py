@@ -0,0 +1,562 @@
+"""
+Inference Service Module for Ensemble Prediction
+Single-pass ensemble engine plus a micro-batching scheduler so the ensemble
+runs once per batch instead of once per upload
+"""
+import threading
+import queue
+import time
+import logging
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import torch
+
+from model.architectures import split_feature_head, cam_weights, cams_from_weights
+
+logger = logging.getLogger(__name__)
+
+# Ensemble weighting (AlexNet is the primary model, every other member shares the rest)
+ENSEMBLE_WEIGHTS = {'alexnet': 0.7}
+DEFAULT_ENSEMBLE_WEIGHT = 0.3
+
+# 'full' runs every member; 'cascade' runs the cheap model first and escalates when needed
+ENSEMBLE_MODES = ('full', 'cascade')
+CASCADE_CHEAP_MODELS = ('alexnet',)
+
+# Hard limits so a bad config value cannot stall or flood the scheduler
+MAX_BATCH_SIZE_LIMIT = 64
+MAX_WAIT_MS_LIMIT = 1000
+
+
+def ensemble_weight(model_name):
+    """Weight of a model in the ensemble average"""
+    return ENSEMBLE_WEIGHTS.get(model_name, DEFAULT_ENSEMBLE_WEIGHT)
+
+
+class InferenceEngine:
+    """
+    Single-pass ensemble engine
+
+    Each model runs at most once per batch. From that one pass the engine
+    returns the per-model probabilities, the weighted mean, the across-model
+    variance used as the uncertainty score, and (for the models listed in
+    `capture`) the feature map GradCAM needs, so no model is re-run afterwards.
+    For the models listed in `cam` (global pooling + one linear layer, e.g.
+    ResNet50) the forward-only class activation maps of every class are
+    computed from the feature map right away and only those small maps are
+    kept.
+
+    In 'cascade' mode the cheap model (AlexNet) runs first and the remaining
+    members only run for images whose confidence is below
+    `cascade_threshold` or whose predicted class is in `sensitive_classes`.
+    """
+
+    def __init__(self, models_dict, capture=('alexnet',), mode='full',
+                 cascade_threshold=0.9, sensitive_classes=(), cam=()):
+        if mode not in ENSEMBLE_MODES:
+            raise ValueError(f"Unknown ensemble mode: {mode}")
+        self.models = models_dict
+        self.capture = set(capture)
+        self.cam = set(cam)
+        self.mode = mode
+        self.cascade_threshold = float(cascade_threshold)
+        self.sensitive_classes = set(sensitive_classes)
+        # model name -> (body, head) for models whose feature map we keep
+        self._splits = {}
+        for model_name, m in models_dict.items():
+            if model_name in self.capture or model_name in self.cam:
+                split = split_feature_head(m)
+                if split is not None:
+                    self._splits[model_name] = split
+        # model name -> fp32 classifier weight for CAM (for quantized members a small dequantized copy)
+        self._cam_weights = {}
+        for model_name in self.cam:
+            if model_name in self._splits:
+                try:
+                    self._cam_weights[model_name] = cam_weights(self.explain_head(model_name))
+                except ValueError as e:
+                    # Still served, just not explained at analysis time
+                    logger.warning(f"No CAM for {model_name}: {e}")
+
+    def forward(self, batch, model_names=None):
+        """
+        Run the given models (default: all) once over a batch
+
+        Returns:
+            dict: {
+                'probs': model name -> (B, num_classes) softmax probabilities,
+                'activations': model name -> (B, C, h, w) captured feature maps,
+                'cams': model name -> (B, num_classes, h, w) numpy class activation maps
+            }
+        """
+        if not self.models:
+            raise RuntimeError("No models available")
+
+        probs = {}
+        activations = {}
+        cams = {}
+        with torch.no_grad():
+            for model_name in (model_names or list(self.models.keys())):
+                m = self.models[model_name]
+                split = self._splits.get(model_name)
+                if split is not None:
+                    body, head = split
+                    features = body(batch)
+                    outputs = head(features)
+                    if model_name in self.capture:
+                        activations[model_name] = features
+                    if model_name in self._cam_weights:
+                        cams[model_name] = cams_from_weights(self._cam_weights[model_name], features)
+                else:
+                    outputs = m(batch)
+                probs[model_name] = torch.nn.functional.softmax(outputs, dim=1)
+        return {'probs': probs, 'activations': activations, 'cams': cams}
+
+    def head(self, model_name):
+        """Head module that maps a captured feature map back to logits"""
+        split = self._splits.get(model_name)
+        return split[1] if split is not None else None
+
+    def explain_head(self, model_name):
+        """
+        Differentiable head for GradCAM. Quantized members are not
+        differentiable, so they provide a temporary fp32 copy instead.
+        """
+        m = self.models.get(model_name)
+        if m is not None and hasattr(m, 'explain_head'):
+            return m.explain_head()
+        return self.head(model_name)
+
+    def cascade_order(self):
+        """Model names with the cheap model first"""
+        names = list(self.models.keys())
+        cheap = [n for n in CASCADE_CHEAP_MODELS if n in self.models]
+        return cheap + [n for n in names if n not in cheap]
+
+    def run_batch(self, batch):
+        """
+        Scheduler runner: one result dict per image in the batch
+
+        Each result holds (1, num_classes) tensors under 'per_model' and 'mean',
+        the per-class 'variance' (None when a single model ran), the scalar
+        'uncertainty', the captured 'activations', the (num_classes, h, w)
+        'cams' and 'models_used'.
+        """
+        names = self.cascade_order()
+        if self.mode == 'cascade' and len(names) > 1:
+            return self._run_cascade(batch, names)
+
+        out = self.forward(batch, names)
+        return [
+            self._combine({n: out['probs'][n][i:i + 1] for n in names},
+                          {n: a[i:i + 1] for n, a in out['activations'].items()},
+                          {n: c[i] for n, c in out['cams'].items()})
+            for i in range(batch.shape[0])
+        ]
+
+    def _run_cascade(self, batch, names):
+        cheap, expensive = names[0], names[1:]
+        first = self.forward(batch, [cheap])
+        cheap_probs = first['probs'][cheap]
+
+        # Escalate low-confidence or clinically sensitive results to the expensive models
+        confidence, predicted = torch.max(cheap_probs, dim=1)
+        escalate = confidence < self.cascade_threshold
+        for class_idx in self.sensitive_classes:
+            escalate |= predicted == class_idx
+        escalate_idx = torch.nonzero(escalate).flatten().tolist()
+
+        second = self.forward(batch[escalate_idx], expensive) if escalate_idx else None
+        row_in_second = {batch_row: j for j, batch_row in enumerate(escalate_idx)}
+
+        results = []
+        for i in range(batch.shape[0]):
+            per_model = {cheap: cheap_probs[i:i + 1]}
+            activations = {n: a[i:i + 1] for n, a in first['activations'].items()}
+            cams = {n: c[i] for n, c in first['cams'].items()}
+            if i in row_in_second:
+                j = row_in_second[i]
+                per_model.update({n: second['probs'][n][j:j + 1] for n in expensive})
+                activations.update({n: a[j:j + 1] for n, a in second['activations'].items()})
+                cams.update({n: c[j] for n, c in second['cams'].items()})
+            results.append(self._combine(per_model, activations, cams))
+        return results
+
+    @staticmethod
+    def _combine(per_model, activations, cams=None):
+        """Weighted mean and across-model variance for one image"""
+        names = list(per_model.keys())
+        # (M, 1, C): everything below is arithmetic on the single forward pass
+        stacked = torch.stack([per_model[n] for n in names])
+        weights = torch.tensor([ensemble_weight(n) for n in names], dtype=stacked.dtype, device=stacked.device)
+        mean = torch.sum(stacked * weights.view(-1, 1, 1), dim=0) / weights.sum()
+        variance = torch.var(stacked, dim=0) if len(names) > 1 else None
+        return {
+            'per_model': per_model,
+            'mean': mean,
+            'variance': variance,
+            'uncertainty': torch.mean(variance).item() if variance is not None else None,
+            'activations': activations,
+            'cams': cams or {},
+            'models_used': names,
+        }
+
+
+def run_ensemble(models_dict, batch):
+    """Per-model softmax probabilities for a batch (no feature capture)"""
+    return InferenceEngine(models_dict, capture=()).forward(batch)['probs']
+
+
+class SchedulerOverloaded(RuntimeError):
+    """Raised when the inference queue is full"""
+
+
+class InferenceScheduler:
+    """
+    Micro-batching scheduler in front of the ensemble models
+
+    Requests that arrive within `max_wait_ms` of the first queued request are
+    stacked into a single tensor batch (at most `max_batch_size` images), the
+    runner is called once for the whole batch, and each caller receives its
+    own row of the result.
+    """
+
+    def __init__(self, runner, max_batch_size=8, max_wait_ms=10, max_queue_size=256):
+        self.runner = runner
+        self.max_batch_size = max(1, min(int(max_batch_size), MAX_BATCH_SIZE_LIMIT))
+        self.max_wait = max(0.0, min(float(max_wait_ms), MAX_WAIT_MS_LIMIT)) / 1000.0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stopped = False
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'errors': 0,
+            'rejected': 0,
+            'max_batch_size_seen': 0,
+            'max_queue_depth_seen': 0,
+            'batch_size_histogram': {},
+            'total_wait_ms': 0.0,
+            'total_batch_ms': 0.0,
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._stopped = False
+                    self._worker = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+                    self._worker.start()
+
+    def submit(self, input_tensor):
+        """
+        Queue one preprocessed image for batched inference
+
+        Args:
+            input_tensor (Tensor): (1, 3, H, W) or (3, H, W) image tensor
+
+        Returns:
+            Future: resolves to the runner's result for this image
+        """
+        if input_tensor.dim() == 4:
+            if input_tensor.shape[0] != 1:
+                raise ValueError("submit() expects a single image; use the runner directly for batches")
+            input_tensor = input_tensor[0]
+
+        self._ensure_worker()
+        future = Future()
+        try:
+            self._queue.put_nowait((input_tensor, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise SchedulerOverloaded("Inference queue is full, try again shortly")
+
+        with self._lock:
+            depth = self._queue.qsize()
+            if depth > self._stats['max_queue_depth_seen']:
+                self._stats['max_queue_depth_seen'] = depth
+        return future
+
+    def predict(self, input_tensor, timeout=None):
+        """Blocking helper: submit and wait for the result"""
+        return self.submit(input_tensor).result(timeout=timeout)
+
+    def _collect_batch(self):
+        """Block for the first request, then gather more until the window closes or the batch is full"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then stop
+                self._stopped = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            self._process(batch)
+
+    def _process(self, batch):
+        tensors = [item[0] for item in batch]
+        futures = [item[1] for item in batch]
+        started = time.perf_counter()
+        wait_ms = sum((started - item[2]) * 1000.0 for item in batch)
+
+        try:
+            results = self.runner(torch.stack(tensors))
+            error = None
+        except Exception as e:
+            logger.error(f"Batched inference failed: {e}")
+            results, error = None, e
+
+        batch_ms = (time.perf_counter() - started) * 1000.0
+        size = len(batch)
+        with self._lock:
+            s = self._stats
+            s['requests'] += size
+            s['batches'] += 1
+            s['total_wait_ms'] += wait_ms
+            s['total_batch_ms'] += batch_ms
+            s['max_batch_size_seen'] = max(s['max_batch_size_seen'], size)
+            s['batch_size_histogram'][size] = s['batch_size_histogram'].get(size, 0) + 1
+            if error is not None:
+                s['errors'] += 1
+
+        for i, future in enumerate(futures):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+
+    def stats(self):
+        """Snapshot of queue depth and batch-size statistics"""
+        with self._lock:
+            s = dict(self._stats)
+            s['batch_size_histogram'] = dict(sorted(s['batch_size_histogram'].items()))
+        batches = s['batches'] or 1
+        requests = s['requests'] or 1
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth_seen': s['max_queue_depth_seen'],
+            'requests': s['requests'],
+            'batches': s['batches'],
+            'errors': s['errors'],
+            'rejected': s['rejected'],
+            'avg_batch_size': round(s['requests'] / batches, 2) if s['batches'] else 0.0,
+            'max_batch_size_seen': s['max_batch_size_seen'],
+            'batch_size_histogram': s['batch_size_histogram'],
+            'avg_queue_wait_ms': round(s['total_wait_ms'] / requests, 3) if s['requests'] else 0.0,
+            'avg_batch_latency_ms': round(s['total_batch_ms'] / batches, 3) if s['batches'] else 0.0,
+            'config': {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'max_queue_size': self._queue.maxsize,
+            }
+        }
+
+    def shutdown(self, timeout=5):
+        """Stop the worker thread after it drains the requests already queued"""
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            self._queue.put(None)
+            worker.join(timeout=timeout)
+        self._worker = None
+
+
+class ModelsNotReady(RuntimeError):
+    """Raised when analysis is requested before the models are loaded and warmed up"""
+
+
+class ModelWarmup:
+    """
+    Background model loading
+
+    `loader()` loads the models (and whatever is built on them); `warmup()`
+    then runs a dummy forward pass so the first real request does not pay
+    for kernel selection and allocator growth. Callers block in `wait()`
+    until both are done, or get ModelsNotReady after their timeout.
+    """
+
+    def __init__(self, loader, warmup=None):
+        self.loader = loader
+        self.warmup = warmup
+        self._ready = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = 'pending'  # pending, loading, warming, ready, failed
+        self.error = None
+        self.timings = {}
+
+    def start(self):
+        """Start loading on a daemon thread (no-op if already started)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='model-warmup', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.state = 'loading'
+            started = time.perf_counter()
+            self.loader()
+            self.timings['load_seconds'] = round(time.perf_counter() - started, 3)
+            if self.warmup is not None:
+                self.state = 'warming'
+                started = time.perf_counter()
+                self.warmup()
+                self.timings['warmup_seconds'] = round(time.perf_counter() - started, 3)
+            self.state = 'ready'
+            self._ready.set()
+            logger.info(f"Models ready: {self.timings}")
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f"Model warmup failed: {e}")
+        finally:
+            self._done.set()
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the models are ready
+
+        Args:
+            timeout (float): Seconds to wait (0 fails fast, None waits indefinitely)
+
+        Raises:
+            ModelsNotReady: still loading after `timeout`, or loading failed
+        """
+        if self._ready.is_set():
+            return
+        self.start()
+        self._done.wait(timeout)
+        if not self._ready.is_set():
+            if self.state == 'failed':
+                raise ModelsNotReady(f"Model loading failed: {self.error}")
+            raise ModelsNotReady("Models are still loading, try again shortly")
+
+    def status(self):
+        return {'state': self.state, 'ready': self.is_ready, 'error': self.error, **self.timings}
+
+
+class RuntimeRetired(RuntimeError):
+    """Raised by `InferenceRuntime.use()` once the runtime has started draining"""
+
+
+class InferenceRuntime:
+    """
+    One loaded model version: its models, engine, micro-batching scheduler
+    and (optionally) worker pool client
+
+    The serving runtime is swapped by replacing a single reference. Requests
+    hold the runtime they started with for the whole analysis
+    (`with use_serving_runtime(get_runtime) as runtime:`), so a swap never
+    mixes versions within a request; the replaced runtime is drained
+    (in-flight requests finish) and then shut down. A drained runtime admits
+    no new requests, so one read just before a swap retries on the new runtime.
+    """
+
+    def __init__(self, version, models_dict, engine, runner, scheduler_options=None,
+                 pool=None, checksums=None, cache_version=None):
+        self.version = version
+        self.models = models_dict
+        self.engine = engine
+        self.pool = pool
+        self.checksums = checksums or {}
+        self.cache_version = cache_version or version
+        self.scheduler = InferenceScheduler(runner, **(scheduler_options or {}))
+        self.run_batch = runner
+        self.loaded_at = time.time()
+        self._in_flight = 0
+        self._retired = False
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        """Count a request in; False once the runtime is draining"""
+        with self._idle:
+            if self._retired:
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._idle:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    @contextmanager
+    def use(self):
+        if not self.acquire():
+            raise RuntimeRetired(f"Model version {self.version} is no longer serving")
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def drain(self, timeout=None):
+        """Stop admitting requests, wait for in-flight ones, then stop the scheduler and pool client"""
+        with self._idle:
+            self._retired = True
+            drained = self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+        self.scheduler.shutdown()
+        if self.pool is not None:
+            self.pool.close()
+        return drained
+
+    def status(self):
+        return {
+            'version': self.version,
+            'members': list(self.models.keys()),
+            'checksums': self.checksums,
+            'in_flight': self._in_flight,
+            'loaded_at': self.loaded_at,
+        }
+
+
+@contextmanager
+def use_serving_runtime(get_runtime):
+    """
+    Pin the runtime returned by `get_runtime()` for the duration of the block
+
+    Reading the reference and counting the request in are not one step, so a
+    hot swap can retire the runtime in between; `acquire()` then refuses it
+    and the (already replaced) reference is read again.
+    """
+    while True:
+        runtime = get_runtime()
+        if runtime is None:
+            raise ModelsNotReady("No model version is serving")
+        if runtime.acquire():
+            break
+    try:
+        yield runtime
+    finally:
+        runtime.release()
@@ -0,0 +1,433 @@
+"""
+Inference Worker Pool Module
+One pool server per host runs the ensemble in dedicated worker processes.
+Web processes send preprocessed batches over a local socket instead of
+running PyTorch inside Flask request threads.
+
+Weights are loaded memory-mapped (model.architectures.load_weights), so the
+worker processes and every web process share the page cache copy of each
+weight file. Each worker's intra-op threads are pinned to its own cores, so
+the pool never uses more threads than the host has cores.
+
+Usage:
+    python -m inference_workers --address /tmp/smart_eye_care_inference.sock --workers 2
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import queue
+import argparse
+import itertools
+import threading
+import subprocess
+import logging
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows: no pool lock, run a single server by hand
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# How long a client waits for a freshly started pool to load its models
+POOL_START_TIMEOUT = 120
+
+
+def parse_address(address):
+    """'host:port' -> TCP tuple, anything else is a Unix socket path"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def pool_address(address, server_args, checksums):
+    """
+    Socket path of the pool serving exactly this configuration
+
+    A pool outlives the web process that started it (until --idle-exit), so a
+    restarted app with other settings or replaced weight files must not reuse
+    it: Unix socket paths get a hash of the server arguments and weight
+    checksums appended. TCP addresses are used as given (one port, one pool).
+    """
+    if not isinstance(parse_address(address), str):
+        return address
+    key = json.dumps({'args': list(server_args), 'checksums': dict(sorted(checksums.items()))})
+    return f"{address}.{hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def plan_threads(num_workers, cores=None):
+    """
+    Split the host's cores (default: this process's CPU affinity) between workers
+
+    Returns:
+        list: one list of core ids per worker (cores are shared round-robin
+              when there are more workers than cores)
+    """
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    num_workers = max(1, int(num_workers))
+    if num_workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(num_workers)]
+    per_worker = len(cores) // num_workers
+    return [cores[i * per_worker:(i + 1) * per_worker] for i in range(num_workers)]
+
+
+def _result_to_numpy(result):
+    """Engine result (tensors) -> picklable numpy payload"""
+    return {
+        'per_model': {n: p.cpu().numpy() for n, p in result['per_model'].items()},
+        'mean': result['mean'].cpu().numpy(),
+        'variance': result['variance'].cpu().numpy() if result['variance'] is not None else None,
+        'uncertainty': result['uncertainty'],
+        'activations': {n: a.cpu().numpy() for n, a in result['activations'].items()},
+        'cams': result['cams'],
+        'models_used': result['models_used'],
+    }
+
+
+def _result_from_numpy(payload):
+    """Inverse of _result_to_numpy"""
+    return {
+        'per_model': {n: torch.from_numpy(p) for n, p in payload['per_model'].items()},
+        'mean': torch.from_numpy(payload['mean']),
+        'variance': torch.from_numpy(payload['variance']) if payload['variance'] is not None else None,
+        'uncertainty': payload['uncertainty'],
+        'activations': {n: torch.from_numpy(a) for n, a in payload['activations'].items()},
+        'cams': payload.get('cams', {}),
+        'models_used': payload['models_used'],
+    }
+
+
+def _worker_main(worker_id, cores, engine_options, task_queue, result_queue):
+    """Worker process: pin threads, load the ensemble once, serve batches until None"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    from model.architectures import load_ensemble_models
+    from inference_service import InferenceEngine
+
+    device = torch.device('cpu')
+    models_dict = load_ensemble_models(device,
+                                       quantize=engine_options['quantize'],
+                                       backend=engine_options['backend'],
+                                       compiled_dir=engine_options['compiled_dir'],
+                                       weight_files=engine_options.get('weight_files'))
+    engine = InferenceEngine(models_dict,
+                             capture=('alexnet',),
+                             cam=('resnet50',),
+                             mode=engine_options['mode'],
+                             cascade_threshold=engine_options['cascade_threshold'],
+                             sensitive_classes=engine_options['sensitive_classes'])
+    result_queue.put(('ready', worker_id, None, None))
+
+    server_pid = os.getppid()
+    while True:
+        try:
+            task = task_queue.get(timeout=1.0)
+        except queue.Empty:
+            if os.getppid() != server_pid:
+                break  # pool server is gone
+            continue
+        if task is None:
+            break
+        conn_id, task_id, batch = task
+        try:
+            results = engine.run_batch(torch.from_numpy(batch))
+            result_queue.put((conn_id, task_id, [_result_to_numpy(r) for r in results], None))
+        except Exception as e:
+            result_queue.put((conn_id, task_id, None, f"{type(e).__name__}: {e}"))
+
+
+class InferencePoolServer:
+    """
+    Accepts connections from web processes, fans batches out to the worker
+    processes over a shared task queue and routes each result back to the
+    connection that sent it
+    """
+
+    def __init__(self, address, authkey, num_workers=2, engine_options=None, idle_exit=0):
+        self.address = address
+        self.idle_exit = idle_exit
+        self.authkey = authkey
+        self.num_workers = max(1, int(num_workers))
+        self.engine_options = engine_options
+        self._ctx = multiprocessing.get_context('spawn')
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._workers = {}
+        self._connections = {}
+        self._conn_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._cores = plan_threads(self.num_workers)
+        self._idle_since = time.time()
+
+    def _start_worker(self, worker_id):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self._cores[worker_id], self.engine_options, self._task_queue, self._result_queue),
+            name=f'inference-worker-{worker_id}', daemon=True)
+        process.start()
+        self._workers[worker_id] = process
+
+    def start_workers(self, timeout=POOL_START_TIMEOUT):
+        """Start every worker and wait until all have loaded their models"""
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+        ready = set()
+        deadline = time.time() + timeout
+        while len(ready) < self.num_workers:
+            try:
+                kind, worker_id, _, _ = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that dies while loading (bad weights, out of memory) never reports ready
+                dead = {w: p.exitcode for w, p in self._workers.items() if w not in ready and not p.is_alive()}
+                if dead:
+                    self._terminate_workers()
+                    raise RuntimeError(f"Inference workers exited while loading models (exit codes {dead})")
+                if time.time() > deadline:
+                    self._terminate_workers()
+                    raise RuntimeError(f"Inference workers did not load their models within {timeout:.0f}s")
+                continue
+            if kind == 'ready':
+                ready.add(worker_id)
+        logger.info(f"Inference pool ready: {self.num_workers} workers, cores {self._cores}")
+
+    def _terminate_workers(self):
+        for process in self._workers.values():
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+
+    def _route_results(self):
+        while True:
+            conn_id, task_id, results, error = self._result_queue.get()
+            if conn_id == 'ready':
+                continue
+            with self._lock:
+                entry = self._connections.get(conn_id)
+            if entry is None:
+                continue
+            conn, send_lock = entry
+            try:
+                with send_lock:
+                    conn.send((task_id, results, error))
+            except (OSError, EOFError):
+                pass
+
+    def _monitor_workers(self):
+        """
+        Restart workers that died; their in-flight batches time out on the client.
+        With `idle_exit`, the server exits once no client has been connected for that
+        many seconds (a pool serving weights that were swapped out); workers follow
+        because they exit when their parent is gone.
+        """
+        while True:
+            time.sleep(1.0)
+            for worker_id, process in list(self._workers.items()):
+                if not process.is_alive():
+                    logger.error(f"Inference worker {worker_id} exited ({process.exitcode}), restarting")
+                    self._start_worker(worker_id)
+            with self._lock:
+                idle = not self._connections and time.time() - self._idle_since
+            if self.idle_exit and idle and idle > self.idle_exit:
+                logger.info(f"No clients for {self.idle_exit:.0f}s, shutting down the inference pool")
+                if isinstance(self.address, str) and os.path.exists(self.address):
+                    os.unlink(self.address)
+                os._exit(0)
+
+    def _serve_connection(self, conn):
+        conn_id = next(self._conn_ids)
+        with self._lock:
+            self._connections[conn_id] = (conn, threading.Lock())
+        try:
+            while True:
+                task_id, batch = conn.recv()
+                self._task_queue.put((conn_id, task_id, batch))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._connections.pop(conn_id, None)
+                if not self._connections:
+                    self._idle_since = time.time()
+            conn.close()
+
+    def serve_forever(self):
+        self.start_workers()
+        threading.Thread(target=self._route_results, name='pool-results', daemon=True).start()
+        threading.Thread(target=self._monitor_workers, name='pool-monitor', daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError):
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+class InferencePoolClient:
+    """
+    Web-process side of the pool. `run_batch` has the same contract as
+    InferenceEngine.run_batch, so it can be the InferenceScheduler's runner.
+
+    With `autostart`, the first call starts `python -m inference_workers`
+    when no pool is listening yet; concurrent web processes race safely
+    because only one server can hold the pool lock file.
+    """
+
+    def __init__(self, address, authkey, timeout=60, autostart=True, server_args=(), log_path=os.devnull):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.autostart = autostart
+        self.server_args = list(server_args)
+        self.log_path = log_path
+        self._conn = None
+        self._pending = {}
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return Client(parse_address(self.address), authkey=self.authkey)
+        except (OSError, EOFError):
+            if not self.autostart:
+                raise
+        env = dict(os.environ, INFERENCE_POOL_AUTHKEY=self.authkey.decode('utf-8'))
+        # Detached from this process's stdio: the pool outlives the web worker that started it
+        with open(self.log_path, 'ab') as log:
+            subprocess.Popen([sys.executable, '-m', 'inference_workers', '--address', self.address] + self.server_args,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=env, start_new_session=True,
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log)
+        deadline = time.time() + POOL_START_TIMEOUT
+        while True:
+            try:
+                return Client(parse_address(self.address), authkey=self.authkey)
+            except (OSError, EOFError):
+                if time.time() > deadline:
+                    raise ConnectionError(f"Inference pool at {self.address} did not start")
+                time.sleep(0.5)
+
+    def _ensure_connection(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+                threading.Thread(target=self._read_results, args=(self._conn,), name='pool-client', daemon=True).start()
+            return self._conn
+
+    def _read_results(self, conn):
+        try:
+            while True:
+                task_id, results, error = conn.recv()
+                with self._lock:
+                    future = self._pending.pop(task_id, None)
+                if future is None:
+                    continue
+                if error is not None:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result([_result_from_numpy(r) for r in results])
+        except (EOFError, OSError):
+            pass
+        # Connection lost: fail everything in flight, reconnect on the next call
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Inference pool connection lost"))
+
+    def run_batch(self, batch):
+        conn = self._ensure_connection()
+        task_id = next(self._task_ids)
+        future = Future()
+        with self._lock:
+            self._pending[task_id] = future
+        with self._send_lock:
+            conn.send((task_id, batch.detach().cpu().numpy().astype(np.float32, copy=False)))
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+
+    def close(self):
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+
+def _acquire_pool_lock(address):
+    """Single pool server per address: returns the held lock file, or None if another server owns it"""
+    if fcntl is None:
+        return True
+    lock_path = (address if isinstance(address, str) else f"/tmp/inference-pool-{address[1]}") + '.lock'
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the shared inference worker pool')
+    parser.add_argument('--address', required=True, help='Unix socket path or host:port')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--backend', default='eager')
+    parser.add_argument('--compiled-dir', default='model/compiled')
+    parser.add_argument('--mode', default='full')
+    parser.add_argument('--cascade-threshold', type=float, default=0.9)
+    parser.add_argument('--sensitive-classes', default='', help='Comma-separated class indices')
+    parser.add_argument('--weights', default='', help='Comma-separated member=path weight files (default: model/)')
+    parser.add_argument('--idle-exit', type=float, default=0, help='Exit after this many seconds without clients (0 = never)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    authkey = os.environ.get('INFERENCE_POOL_AUTHKEY')
+    if not authkey:
+        print("INFERENCE_POOL_AUTHKEY must be set")
+        return 1
+    address = parse_address(args.address)
+    lock_file = _acquire_pool_lock(address)
+    if lock_file is None:
+        print(f"An inference pool is already serving {args.address}")
+        return 0
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)  # stale socket from a previous server; we hold the lock
+
+    weight_files = dict(item.split('=', 1) for item in args.weights.split(',') if '=' in item) or None
+    server = InferencePoolServer(address, authkey.encode('utf-8'), num_workers=args.workers, idle_exit=args.idle_exit, engine_options={
+        'quantize': args.quantize,
+        'backend': args.backend,
+        'compiled_dir': args.compiled_dir,
+        'mode': args.mode,
+        'cascade_threshold': args.cascade_threshold,
+        'sensitive_classes': [int(c) for c in args.sensitive_classes.split(',') if c.strip()],
+        'weight_files': weight_files,
+    })
+    try:
+        server.serve_forever()
+    except RuntimeError as e:
+        print(f"Inference pool failed to start: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
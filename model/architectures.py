@@ -1,8 +1,43 @@
 
+import os
+import hashlib
+import numpy as np
 import torch
 import torch.nn as nn
 import torchvision.models as models
 
+# Trained weight files for the ensemble members
+ALEXNET_WEIGHTS = 'model/retina_alexnet_state.pth'
+RESNET50_WEIGHTS = 'model/resnet50_best.pth'
+ENSEMBLE_WEIGHT_FILES = {'alexnet': ALEXNET_WEIGHTS, 'resnet50': RESNET50_WEIGHTS}
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ensemble_version(models_dict, variant='', weight_files=ENSEMBLE_WEIGHT_FILES, checksums=None):
+    """
+    Short identifier of the loaded ensemble: the SHA-256 of each member's weight
+    file plus a free-form `variant` string for settings that change the outputs
+    (quantization, ensemble mode). Changes whenever any weight file changes.
+    Already-verified `checksums` (member -> sha256) skip re-hashing the files.
+    """
+    digest = hashlib.sha256(variant.encode('utf-8'))
+    for name in sorted(models_dict):
+        if checksums and name in checksums:
+            weights_hash = checksums[name]
+        else:
+            path = weight_files.get(name)
+            weights_hash = file_sha256(path) if path and os.path.exists(path) else 'unknown'
+        digest.update(f"{name}:{weights_hash};".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
 class MCDropout(nn.Module):
     """
     Monte Carlo Dropout Wrapper.
@@ -90,13 +125,38 @@ def enable_dropout(m):
     if type(m) == nn.Dropout:
         m.train()
 
-def predict_with_uncertainty(model, input_tensor, num_samples=10):
+def get_mc_head(model):
     """
-    Perform Monte Carlo Dropout inference.
-    Returns:
-        mean_prediction: Tensor of shape (1, num_classes) - averaged probabilities
-        uncertainty: Float - predictive entropy or variance
+    Locate the stochastic head installed by get_model: nn.Sequential(nn.Dropout, nn.Linear).
+
+    Returns (head, dropout, linear) when that Dropout is the only active
+    dropout in the network (so everything before the head is deterministic
+    and can be run once), otherwise None.
     """
+    head = None
+    if isinstance(getattr(model, 'fc', None), nn.Sequential):
+        head = model.fc
+    elif isinstance(getattr(model, 'classifier', None), nn.Sequential):
+        head = model.classifier
+    elif hasattr(model, 'heads') and isinstance(getattr(model.heads, 'head', None), nn.Sequential):
+        head = model.heads.head
+
+    if head is None or len(head) != 2:
+        return None
+    dropout, linear = head[0], head[1]
+    if type(dropout) != nn.Dropout or not isinstance(linear, nn.Linear):
+        return None
+
+    # Any other live dropout would make the backbone stochastic too
+    head_modules = {id(m) for m in head.modules()}
+    for m in model.modules():
+        if type(m) == nn.Dropout and id(m) not in head_modules and m.p > 0:
+            return None
+    return head, dropout, linear
+
+
+def _predict_full(model, input_tensor, num_samples):
+    """Original MC Dropout: `num_samples` full forward passes with dropout enabled"""
     model.eval() # Start with eval mode (fixes BatchNorm)
     model.apply(enable_dropout) # Manually enable dropout layers
     
@@ -109,7 +169,70 @@ def predict_with_uncertainty(model, input_tensor, num_samples=10):
             outputs.append(prob)
             
     # Stack outputs: (num_samples, 1, num_classes)
-    outputs_stack = torch.stack(outputs)
+    return torch.stack(outputs)
+
+
+def _predict_head_only(model, mc_head, input_tensor, num_samples, generator):
+    """
+    Run the backbone once, cache the pooled features entering the head,
+    then evaluate all dropout masks in a single vectorized head pass.
+    """
+    head, dropout, linear = mc_head
+    captured = []
+    hook = head.register_forward_pre_hook(lambda module, inputs: captured.append(inputs[0].detach()))
+    model.eval()
+    try:
+        with torch.no_grad():
+            model(input_tensor)
+    finally:
+        hook.remove()
+    features = captured[0]  # (batch, num_ftrs)
+
+    keep = 1.0 - dropout.p
+    with torch.no_grad():
+        if keep <= 0:
+            masked = torch.zeros((num_samples,) + tuple(features.shape), device=features.device)
+        else:
+            probs = torch.full((num_samples,) + tuple(features.shape), keep, device=features.device)
+            masks = torch.bernoulli(probs, generator=generator) / keep
+            masked = features.unsqueeze(0) * masks
+        logits = linear(masked)  # (num_samples, batch, num_classes)
+        return torch.nn.functional.softmax(logits, dim=-1)
+
+
+def predict_with_uncertainty(model, input_tensor, num_samples=10, mode='full', seed=None):
+    """
+    Perform Monte Carlo Dropout inference.
+    Args:
+        mode: 'full' (default) re-runs the whole network per sample, 'head'
+              runs the backbone once and samples only the Dropout+Linear head,
+              'auto' uses 'head' whenever the model supports it. Head-only
+              sampling ignores any dropout in the backbone, so callers opt in.
+        seed: optional int; the same seed gives the same result
+    Returns:
+        mean_prediction: Tensor of shape (1, num_classes) - averaged probabilities
+        uncertainty: Float - predictive entropy or variance
+    """
+    mc_head = get_mc_head(model) if mode in ('auto', 'head') else None
+    if mode == 'head' and mc_head is None:
+        raise ValueError("Model has no isolated Dropout+Linear head; use mode='full'")
+
+    if mc_head is not None:
+        device = input_tensor.device
+        generator = torch.Generator(device=device)
+        if seed is not None:
+            generator.manual_seed(seed)
+        else:
+            generator.seed()
+        outputs_stack = _predict_head_only(model, mc_head, input_tensor, num_samples, generator)
+    elif seed is not None:
+        # Seed a forked RNG so repeatable runs do not disturb the global stream
+        devices = [input_tensor.device] if input_tensor.is_cuda else []
+        with torch.random.fork_rng(devices=devices):
+            torch.manual_seed(seed)
+            outputs_stack = _predict_full(model, input_tensor, num_samples)
+    else:
+        outputs_stack = _predict_full(model, input_tensor, num_samples)
     
     # Calculate Mean (Final Prediction)
     mean_prediction = torch.mean(outputs_stack, dim=0) # (1, num_classes)
@@ -120,3 +243,207 @@ def predict_with_uncertainty(model, input_tensor, num_samples=10):
     uncertainty_score = torch.mean(variance).item()
     
     return mean_prediction, uncertainty_score
+
+
+def split_feature_head(model):
+    """
+    Split a classifier into (body, head) so that head(body(x)) == model(x).
+
+    `body` ends at the feature map used for explanations (AlexNet features[12],
+    ResNet layer4, EfficientNet features) and `head` maps that feature map to
+    logits. Both share parameters with `model`; nothing is copied.
+    Returns None for architectures without a spatial feature map (e.g. ViT).
+    """
+    if hasattr(model, 'body') and hasattr(model, 'head'):
+        # Already split (e.g. a QuantizedMember)
+        return model.body, model.head
+    if isinstance(model, models.AlexNet):
+        body = model.features
+        head = nn.Sequential(model.avgpool, nn.Flatten(1), model.classifier)
+    elif isinstance(model, models.ResNet):
+        body = nn.Sequential(model.conv1, model.bn1, model.relu, model.maxpool,
+                             model.layer1, model.layer2, model.layer3, model.layer4)
+        head = nn.Sequential(model.avgpool, nn.Flatten(1), model.fc)
+    elif hasattr(models, 'EfficientNet') and isinstance(model, models.EfficientNet):
+        body = model.features
+        head = nn.Sequential(model.avgpool, nn.Flatten(1), model.classifier)
+    else:
+        return None
+    # New Sequential wrappers start in train mode; mirror the model so tools that
+    # save and restore .training (e.g. ONNX export) do not flip the shared layers
+    body.train(model.training)
+    head.train(model.training)
+    return body, head
+
+
+def gradcam_from_activations(head, activation, target_class_idx):
+    """
+    GradCAM from a feature map captured during the normal forward pass.
+
+    Only the (cheap) head is replayed to get d(score)/d(activation), so the
+    backbone never runs a second time.
+    Returns:
+        gradcam: numpy array (h, w) normalized to [0, 1]
+    """
+    return gradcam_all_classes(head, activation, [target_class_idx])[0]
+
+
+def gradcam_all_classes(head, activation, class_indices=None):
+    """
+    GradCAM maps for several classes from one captured feature map, with a
+    single batched backward pass through the head.
+
+    The (1, C, h, w) activation is repeated once per requested class and the
+    head runs on that batch; since copy k only feeds its own row, the gradient
+    of sum_k output[k, class_k] gives every class's d(score)/d(activation) at once.
+
+    Args:
+        class_indices: classes to explain (default: all head outputs, in order)
+    Returns:
+        numpy array (len(class_indices), h, w), each map normalized to [0, 1]
+    """
+    act = activation.detach()[:1]
+    if class_indices is None:
+        linears = [m for m in head.modules() if isinstance(m, nn.Linear)]
+        if linears:
+            num_classes = linears[-1].out_features
+        else:
+            with torch.no_grad():
+                num_classes = head(act).shape[1]
+        class_indices = range(num_classes)
+    classes = torch.as_tensor(list(class_indices))
+
+    batch = act.repeat(len(classes), 1, 1, 1).requires_grad_(True)
+    with torch.enable_grad():
+        output = head(batch)
+        score = output[torch.arange(len(classes)), classes].sum()
+        grad = torch.autograd.grad(score, batch)[0]
+
+    # Global Average Pooling of gradients -> weighted combination of activation maps
+    weights = torch.mean(grad, dim=(2, 3), keepdim=True)
+    maps = torch.relu(torch.sum(weights * batch.detach(), dim=1)).cpu().numpy()
+    return normalize_maps(maps)
+
+
+def cam_from_activations(head, activation, class_indices=None):
+    """
+    Class activation maps (CAM) without any backward pass.
+
+    For a head that is global average pooling followed by one linear layer
+    (ResNet, EfficientNet), the class score is a linear function of the
+    pooled features, so the map of class k is simply fc.weight[k] applied to
+    every position of the captured feature map.
+
+    Args:
+        class_indices: classes to explain (default: all head outputs, in order)
+    Returns:
+        numpy array (len(class_indices), h, w), each map normalized to [0, 1]
+    """
+    weight = cam_weights(head)
+    if class_indices is not None:
+        weight = weight[torch.as_tensor(list(class_indices))]
+    return cams_from_weights(weight, activation[:1])[0]
+
+
+def cam_weights(head):
+    """(num_classes, C) weight of the single linear layer CAM needs in `head`"""
+    linears = [m for m in head.modules() if isinstance(m, nn.Linear)]
+    if len(linears) != 1:
+        raise ValueError("CAM needs a head with exactly one linear layer after global pooling")
+    return linears[0].weight.detach()
+
+
+def cams_from_weights(weight, activations):
+    """
+    CAMs for a whole batch: (B, C, h, w) feature maps -> (B, K, h, w) numpy
+    array, each map normalized to [0, 1]
+    """
+    with torch.no_grad():
+        maps = torch.relu(torch.einsum('kc,bchw->bkhw', weight, activations.to(weight.dtype))).cpu().numpy()
+    b, k, h, w = maps.shape
+    return normalize_maps(maps.reshape(b * k, h, w)).reshape(b, k, h, w)
+
+
+def normalize_maps(maps):
+    """Min-max scale each (h, w) map of a (K, h, w) array to [0, 1] (constant maps are left as is)"""
+    lo = maps.min(axis=(1, 2), keepdims=True)
+    span = maps.max(axis=(1, 2), keepdims=True) - lo
+    return np.where(span > 1e-8, (maps - lo) / np.where(span > 1e-8, span, 1.0), maps)
+
+
+def load_weights(model, weights_path, device):
+    """
+    Load a state dict memory-mapped (torch.load(mmap=True) + assign=True), so
+    the parameters stay backed by the file's page cache and every process
+    serving the same weight file shares one physical copy. Falls back to a
+    regular load for legacy (non-zip) checkpoints.
+    """
+    try:
+        state_dict = torch.load(weights_path, map_location=device, mmap=True)
+        model.load_state_dict(state_dict, assign=True)
+    except (TypeError, RuntimeError):
+        model.load_state_dict(torch.load(weights_path, map_location=device))
+    return model
+
+
+def load_ensemble_models(device, quantize=False, backend='eager', compiled_dir='model/compiled', weight_files=None):
+    """
+    Loads all available models for ensemble prediction.
+
+    With quantize=True (CPU only) each member is converted to INT8 after
+    loading: static quantization for the conv body, dynamic for the Linear head.
+    backend selects the runtime serving each fp32 member: 'eager', 'torchscript',
+    'onnxruntime' or 'auto' (fastest on this host); see model/backends.py.
+    weight_files maps member name -> weight file (default ENSEMBLE_WEIGHT_FILES;
+    model/registry.py passes the files of a registered version).
+    """
+    weight_files = weight_files or ENSEMBLE_WEIGHT_FILES
+    models_dict = {}
+    
+    # 1. Load Primary Model (AlexNet) - This MUST exist for legacy support
+    print("Loading Primary Model (AlexNet)...")
+    try:
+        alexnet = models.alexnet(pretrained=False)
+        alexnet.classifier[6] = nn.Linear(alexnet.classifier[6].in_features, 6)
+        load_weights(alexnet, weight_files['alexnet'], device)
+        alexnet.eval()
+        alexnet.to(device)
+        models_dict['alexnet'] = alexnet
+    except Exception as e:
+        print(f"CRITICAL ERROR: Could not load AlexNet: {e}")
+        
+    # 2. Check for ResNet50 (The new research model)
+    resnet_weights = weight_files.get('resnet50')
+    if resnet_weights and os.path.exists(resnet_weights):
+        print("Found ResNet50! Loading for Ensemble...")
+        try:
+            resnet = get_model('resnet50', num_classes=6, pretrained=False)
+            load_weights(resnet, resnet_weights, device)
+            resnet.eval()
+            resnet.to(device)
+            models_dict['resnet50'] = resnet
+        except Exception as e:
+            print(f"Warning: Failed to load ResNet50: {e}")
+
+    if quantize and models_dict:
+        if device.type != 'cpu':
+            print("Warning: INT8 quantization is CPU-only, keeping fp32 models")
+        else:
+            if backend != 'eager':
+                print(f"Warning: {backend} backend is ignored for quantized models")
+                backend = 'eager'
+            from model.quantization import quantize_ensemble
+            try:
+                models_dict = quantize_ensemble(models_dict)
+            except Exception as e:
+                print(f"Warning: Quantization failed, keeping fp32 models: {e}")
+
+    if backend != 'eager' and models_dict:
+        from model.backends import compile_member
+        models_dict = {
+            name: compile_member(name, m, weight_files[name], backend, device, compiled_dir)
+            for name, m in models_dict.items()
+        }
+            
+    print(f"Ensemble loaded with {len(models_dict)} models: {list(models_dict.keys())}")
+    return models_dict
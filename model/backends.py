@@ -0,0 +1,275 @@
+"""
+Compiled Inference Backends (TorchScript / ONNX Runtime)
+
+Each ensemble member is exported as two artifacts, the conv body and the
+classifier head, so the inference engine can keep capturing the feature map
+used for explanations. Artifacts are cached on disk under a key derived from
+the SHA-256 of the weight file, and every compiled member is checked against
+the eager model before it is used.
+
+Usage:
+    python -m model.backends --backend all
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.architectures import split_feature_head, file_sha256
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+BACKEND_CHOICES = ('eager', 'torchscript', 'onnxruntime', 'auto')
+
+# Fixed spatial size produced by preprocessing.transform; the batch axis stays dynamic
+INPUT_SHAPE = (3, 227, 227)
+
+# Tolerance for the eager-vs-compiled equivalence check (softmax probabilities)
+EQUIVALENCE_ATOL = 1e-4
+
+
+def _artifact_dir(cache_dir, member_name, backend, weights_hash):
+    # torch version is part of the key: serialized graphs are not portable across releases
+    key = f"{member_name}-{backend}-{weights_hash[:16]}-torch{torch.__version__.split('+')[0]}"
+    return os.path.join(cache_dir, key)
+
+
+class TorchScriptMember(nn.Module):
+    """
+    Traced body + head. Traced modules keep autograd, but contain no nn.Linear,
+    so the eager head is kept for explanations (CAM reads its classifier weight).
+    """
+
+    backend = 'torchscript'
+
+    def __init__(self, body, head, eager_head):
+        super(TorchScriptMember, self).__init__()
+        self.body = body
+        self.head = head
+        self._eager_head = eager_head
+
+    def forward(self, x):
+        return self.head(self.body(x))
+
+    def explain_head(self):
+        return self._eager_head
+
+
+class _OrtModule(nn.Module):
+    """nn.Module facade over an ONNX Runtime session (tensor in, tensor out)"""
+
+    def __init__(self, session):
+        super(_OrtModule, self).__init__()
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def forward(self, x):
+        out = self.session.run(None, {self.input_name: x.detach().cpu().numpy().astype(np.float32, copy=False)})[0]
+        return torch.from_numpy(out).to(x.device)
+
+
+class OnnxRuntimeMember(nn.Module):
+    """
+    ONNX Runtime body + head. ORT graphs are not differentiable, so the eager
+    head is kept for explanations (the eager body is released).
+    """
+
+    backend = 'onnxruntime'
+
+    def __init__(self, body_session, head_session, eager_head):
+        super(OnnxRuntimeMember, self).__init__()
+        self.body = _OrtModule(body_session)
+        self.head = _OrtModule(head_session)
+        self._eager_head = eager_head
+
+    def forward(self, x):
+        return self.head(self.body(x))
+
+    def explain_head(self):
+        return self._eager_head
+
+
+def _example_input(device, batch=2):
+    return torch.randn((batch,) + INPUT_SHAPE, device=device)
+
+
+def compile_torchscript(member_name, model, weights_hash, cache_dir, device):
+    """Trace (or load the cached trace of) body and head"""
+    out_dir = _artifact_dir(cache_dir, member_name, 'torchscript', weights_hash)
+    body_path, head_path = os.path.join(out_dir, 'body.pt'), os.path.join(out_dir, 'head.pt')
+    eager_head = split_feature_head(model)[1]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if os.path.exists(body_path) and os.path.exists(head_path):
+            body = torch.jit.load(body_path, map_location=device)
+            head = torch.jit.load(head_path, map_location=device)
+        else:
+            body, head = split_feature_head(model)
+            x = _example_input(device)
+            with torch.no_grad():
+                traced_body = torch.jit.freeze(torch.jit.trace(body, x).eval())
+                features = body(x)
+            # The head is traced without freezing so it stays differentiable for GradCAM
+            traced_head = torch.jit.trace(head, features).eval()
+            os.makedirs(out_dir, exist_ok=True)
+            torch.jit.save(traced_body, body_path)
+            torch.jit.save(traced_head, head_path)
+            body, head = traced_body, traced_head
+    return TorchScriptMember(body, head, eager_head).eval()
+
+
+def compile_onnxruntime(member_name, model, weights_hash, cache_dir, device):
+    """Export (or load the cached export of) body and head to ONNX and open ORT sessions"""
+    if not ONNXRUNTIME_AVAILABLE:
+        raise RuntimeError("onnxruntime is not installed (pip install onnx onnxruntime)")
+    if device.type != 'cpu':
+        raise RuntimeError("The ONNX Runtime backend is configured for CPU only")
+
+    out_dir = _artifact_dir(cache_dir, member_name, 'onnxruntime', weights_hash)
+    body_path, head_path = os.path.join(out_dir, 'body.onnx'), os.path.join(out_dir, 'head.onnx')
+    body, head = split_feature_head(model)
+
+    if not (os.path.exists(body_path) and os.path.exists(head_path)):
+        os.makedirs(out_dir, exist_ok=True)
+        x = _example_input(device)
+        with torch.no_grad():
+            features = body(x)
+        export_kwargs = {'opset_version': 17, 'do_constant_folding': True}
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs['dynamo'] = False
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            torch.onnx.export(body, (x,), body_path, input_names=['input'], output_names=['features'],
+                              dynamic_axes={'input': {0: 'batch'}, 'features': {0: 'batch'}}, **export_kwargs)
+            torch.onnx.export(head, (features,), head_path, input_names=['features'], output_names=['logits'],
+                              dynamic_axes={'features': {0: 'batch'}, 'logits': {0: 'batch'}}, **export_kwargs)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = torch.get_num_threads()
+    providers = ['CPUExecutionProvider']
+    body_session = ort.InferenceSession(body_path, options, providers=providers)
+    head_session = ort.InferenceSession(head_path, options, providers=providers)
+    return OnnxRuntimeMember(body_session, head_session, head).eval()
+
+
+COMPILERS = {
+    'torchscript': compile_torchscript,
+    'onnxruntime': compile_onnxruntime,
+}
+
+
+def check_equivalence(eager_model, compiled_model, device, atol=EQUIVALENCE_ATOL, batch=2):
+    """
+    Compare softmax outputs of the eager and compiled model on random input.
+
+    Returns:
+        dict: {'max_abs_diff': float, 'top1_agreement': float, 'equivalent': bool}
+    """
+    x = _example_input(device, batch)
+    with torch.no_grad():
+        p_eager = torch.softmax(eager_model(x), dim=1)
+        p_compiled = torch.softmax(compiled_model(x), dim=1)
+    max_diff = (p_eager - p_compiled).abs().max().item()
+    agreement = (p_eager.argmax(dim=1) == p_compiled.argmax(dim=1)).float().mean().item()
+    return {'max_abs_diff': max_diff, 'top1_agreement': agreement, 'equivalent': max_diff <= atol}
+
+
+def time_forward(model, device, batch=4, iterations=5):
+    """Median forward latency (ms per batch) after one warmup run"""
+    x = _example_input(device, batch)
+    timings = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model(x)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def compile_member(member_name, model, weights_path, backend, device, cache_dir):
+    """
+    Serve one ensemble member through the requested backend.
+
+    Falls back to the eager model (with a warning) when the backend is
+    unavailable, the export fails, or the equivalence check does not pass.
+    'auto' compiles every available backend and keeps the fastest one.
+    """
+    if backend == 'eager' or split_feature_head(model) is None:
+        return model
+    if backend not in BACKEND_CHOICES:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    weights_hash = file_sha256(weights_path)
+    candidates = list(COMPILERS) if backend == 'auto' else [backend]
+    timings = {'eager': time_forward(model, device)} if backend == 'auto' else {}
+    compiled = {'eager': model}
+
+    for name in candidates:
+        try:
+            member = COMPILERS[name](member_name, model, weights_hash, cache_dir, device)
+            check = check_equivalence(model, member, device)
+            if not check['equivalent']:
+                print(f"Warning: {name} output for {member_name} differs from eager "
+                      f"(max abs diff {check['max_abs_diff']:.2e}), not using it")
+                continue
+            compiled[name] = member
+            if backend == 'auto':
+                timings[name] = time_forward(member, device)
+        except Exception as e:
+            print(f"Warning: Could not compile {member_name} with {name}: {e}")
+
+    if backend == 'auto':
+        chosen = min(timings, key=timings.get)
+        print(f"Backend timings for {member_name} (ms/batch): "
+              f"{ {k: round(v, 2) for k, v in timings.items()} } -> using {chosen}")
+    else:
+        chosen = backend if backend in compiled else 'eager'
+        print(f"Serving {member_name} with {chosen} backend")
+    return compiled[chosen]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the ensemble to compiled backends and check equivalence')
+    parser.add_argument('--backend', default='all', choices=['all'] + list(COMPILERS))
+    parser.add_argument('--cache-dir', default='model/compiled')
+    args = parser.parse_args()
+
+    from model.architectures import load_ensemble_models, ENSEMBLE_WEIGHT_FILES
+    device = torch.device('cpu')
+    models_dict = load_ensemble_models(device)
+    backends = list(COMPILERS) if args.backend == 'all' else [args.backend]
+
+    report = {}
+    for member_name, model in models_dict.items():
+        weights_hash = file_sha256(ENSEMBLE_WEIGHT_FILES[member_name])
+        report[member_name] = {'eager_ms_per_batch': round(time_forward(model, device), 2)}
+        for name in backends:
+            try:
+                member = COMPILERS[name](member_name, model, weights_hash, args.cache_dir, device)
+                check = check_equivalence(model, member, device)
+                check['ms_per_batch'] = round(time_forward(member, device), 2)
+                report[member_name][name] = check
+            except Exception as e:
+                report[member_name][name] = {'error': str(e)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
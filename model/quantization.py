@@ -0,0 +1,268 @@
+"""
+INT8 Quantized CPU Inference for the AlexNet/ResNet50 Ensemble
+
+Static (calibrated) quantization for the convolutional body, dynamic
+quantization for the Linear head, plus a parity check against fp32 on
+labeled images held out from calibration.
+
+Usage:
+    python -m model.quantization --data DATA --calibration-per-class 8
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import warnings
+
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.architectures import split_feature_head
+from preprocessing import CLASS_NAMES, list_labeled_images, load_labeled_batches
+
+try:
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    QUANTIZATION_AVAILABLE = True
+except ImportError:
+    QUANTIZATION_AVAILABLE = False
+
+
+def _select_engine():
+    """Pick the best quantized kernel backend available on this CPU"""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'onednn', 'qnnpack'):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized CPU engine available in this torch build")
+
+
+class QuantizedMember(nn.Module):
+    """
+    INT8 ensemble member: statically quantized conv body + dynamically
+    quantized Linear head. Exposes `body`/`head` so the inference engine can
+    still capture the feature map for explanations.
+    """
+
+    def __init__(self, body, head):
+        super(QuantizedMember, self).__init__()
+        self.body = body
+        self.head = head
+
+    def forward(self, x):
+        return self.head(self.body(x))
+
+    def explain_head(self):
+        """
+        Temporary fp32 copy of the head for GradCAM (quantized ops have no
+        autograd). Built from the INT8 weights on demand and not cached, so
+        the fp32 classifier weights never stay resident.
+        """
+        return _dequantize_module(self.head)
+
+
+def _dequantize_module(module):
+    """Rebuild a module tree, swapping dynamic quantized Linear layers for fp32 nn.Linear"""
+    if isinstance(module, nn.Sequential):
+        return nn.Sequential(*[_dequantize_module(m) for m in module])
+    weight_fn = getattr(module, 'weight', None)
+    if callable(weight_fn) and hasattr(module, 'in_features'):
+        linear = nn.Linear(module.in_features, module.out_features, bias=module.bias() is not None)
+        with torch.no_grad():
+            linear.weight.copy_(weight_fn().dequantize())
+            if module.bias() is not None:
+                linear.bias.copy_(module.bias())
+        return linear.eval()
+    return module
+
+
+def quantize_member(model, calibration_batches):
+    """
+    Quantize one model to INT8.
+
+    Args:
+        model (nn.Module): fp32 model in eval mode
+        calibration_batches (list): image tensors used to observe activation ranges
+
+    Returns:
+        QuantizedMember
+    """
+    if not QUANTIZATION_AVAILABLE:
+        raise RuntimeError("torch.ao.quantization is not available in this torch build")
+    split = split_feature_head(model)
+    if split is None:
+        raise ValueError(f"Cannot quantize {type(model).__name__}: no conv body/head split")
+
+    engine = _select_engine()
+    body, head = copy.deepcopy(split[0]).eval(), copy.deepcopy(split[1]).eval()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        # Static quantization for the convolutions (needs calibration data)
+        example = calibration_batches[0][:1]
+        prepared = prepare_fx(body, get_default_qconfig_mapping(engine), example_inputs=(example,))
+        with torch.no_grad():
+            for batch in calibration_batches:
+                prepared(batch)
+        q_body = convert_fx(prepared)
+
+        # Dynamic quantization for the Linear layers
+        q_head = quantize_dynamic(head, {nn.Linear}, dtype=torch.qint8)
+
+    return QuantizedMember(q_body, q_head).eval()
+
+
+def load_calibration_batches(data_dir='DATA', per_class=8, batch_size=16):
+    """Calibration images taken from the DATA/ class folders"""
+    samples = list_labeled_images(data_dir, CLASS_NAMES, per_class=per_class)
+    if not samples:
+        raise FileNotFoundError(f"No calibration images found under {data_dir}")
+    return [images for images, _ in load_labeled_batches(samples, batch_size)]
+
+
+def held_out_samples(data_dir='DATA', calibration_per_class=8, per_class=None):
+    """
+    Labeled images for the parity check, excluding the calibration images
+    (load_calibration_batches takes the first `calibration_per_class` of each class)
+
+    Args:
+        per_class (int): Optional cap on held-out images per class
+    """
+    calibration = {path for path, _ in list_labeled_images(data_dir, CLASS_NAMES, per_class=calibration_per_class)}
+    samples, counts = [], {}
+    for path, label in list_labeled_images(data_dir, CLASS_NAMES):
+        if path in calibration or (per_class is not None and counts.get(label, 0) >= per_class):
+            continue
+        counts[label] = counts.get(label, 0) + 1
+        samples.append((path, label))
+    return samples
+
+
+def quantize_ensemble(models_dict, calibration_batches=None, data_dir=None, per_class=None):
+    """Quantize every ensemble member; members that cannot be quantized stay fp32"""
+    from config import Config
+    if calibration_batches is None:
+        calibration_batches = load_calibration_batches(
+            data_dir or Config.QUANTIZATION_DATA_DIR,
+            per_class or Config.QUANTIZATION_CALIBRATION_PER_CLASS)
+
+    quantized = {}
+    for name, model in models_dict.items():
+        try:
+            start = time.perf_counter()
+            quantized[name] = quantize_member(model, calibration_batches)
+            print(f"Quantized {name} to INT8 in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"Warning: Could not quantize {name}, keeping fp32: {e}")
+            quantized[name] = model
+    return quantized
+
+
+def _ensemble_probs(models_dict, images):
+    """Weighted ensemble probabilities exactly as lab_analyze computes them"""
+    from inference_service import InferenceEngine
+    results = InferenceEngine(models_dict, capture=()).run_batch(images)
+    return torch.cat([r['mean'] for r in results])
+
+
+def quantization_parity(fp32_models, int8_models, samples, batch_size=16):
+    """
+    Compare INT8 against fp32 on labeled images.
+
+    Returns:
+        dict: per model and for the weighted ensemble: top-1 accuracy of both,
+              top-1 agreement, confidence drift (mean/max absolute difference
+              of the predicted-class probability) and forward latency
+    """
+    names = list(fp32_models.keys()) + ['ensemble']
+    acc = {n: {'fp32_correct': 0, 'int8_correct': 0, 'agree': 0, 'drifts': [],
+               'fp32_seconds': 0.0, 'int8_seconds': 0.0} for n in names}
+    total = 0
+
+    def probs_for(models_dict, name, images):
+        if name == 'ensemble':
+            return _ensemble_probs(models_dict, images)
+        with torch.no_grad():
+            return torch.softmax(models_dict[name](images), dim=1)
+
+    for images, labels in load_labeled_batches(samples, batch_size):
+        total += labels.shape[0]
+        for name in names:
+            start = time.perf_counter()
+            p32 = probs_for(fp32_models, name, images)
+            mid = time.perf_counter()
+            p8 = probs_for(int8_models, name, images)
+            end = time.perf_counter()
+
+            top32, top8 = p32.argmax(dim=1), p8.argmax(dim=1)
+            a = acc[name]
+            a['fp32_seconds'] += mid - start
+            a['int8_seconds'] += end - mid
+            a['fp32_correct'] += (top32 == labels).sum().item()
+            a['int8_correct'] += (top8 == labels).sum().item()
+            a['agree'] += (top32 == top8).sum().item()
+            conf32 = p32.max(dim=1).values
+            conf8 = p8.gather(1, top32.unsqueeze(1)).squeeze(1)
+            a['drifts'].extend((conf32 - conf8).abs().tolist())
+
+    report = {'images': total}
+    for name in names:
+        a = acc[name]
+        drifts = a['drifts'] or [0.0]
+        report[name] = {
+            'fp32_top1_accuracy': round(a['fp32_correct'] / total, 4) if total else None,
+            'int8_top1_accuracy': round(a['int8_correct'] / total, 4) if total else None,
+            'top1_accuracy_drift': round((a['int8_correct'] - a['fp32_correct']) / total, 4) if total else None,
+            'top1_agreement': round(a['agree'] / total, 4) if total else None,
+            'mean_confidence_drift': round(sum(drifts) / len(drifts), 5),
+            'max_confidence_drift': round(max(drifts), 5),
+            'fp32_ms_per_image': round(a['fp32_seconds'] * 1000 / total, 2) if total else None,
+            'int8_ms_per_image': round(a['int8_seconds'] * 1000 / total, 2) if total else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the ensemble to INT8 and report parity against fp32')
+    parser.add_argument('--data', default='DATA', help='Folder with one sub-folder per class')
+    parser.add_argument('--calibration-per-class', type=int, default=8)
+    parser.add_argument('--eval-per-class', type=int, default=None,
+                        help='Cap held-out images per class for the parity check (calibration images are never used)')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    from model.architectures import load_ensemble_models
+    device = torch.device('cpu')
+    fp32_models = load_ensemble_models(device)
+    if not fp32_models:
+        print("No models could be loaded")
+        return 1
+
+    samples = held_out_samples(args.data, args.calibration_per_class, args.eval_per_class)
+    if not samples:
+        print(f"No held-out images under {args.data}: every image is used for calibration "
+              f"(lower --calibration-per-class)")
+        return 1
+    calibration = load_calibration_batches(args.data, args.calibration_per_class, args.batch_size)
+    int8_models = quantize_ensemble(fp32_models, calibration_batches=calibration)
+    report = quantization_parity(fp32_models, int8_models, samples, args.batch_size)
+    # Accuracy and drift are measured on images the quantization never observed
+    report['calibration_images'] = sum(images.shape[0] for images in calibration)
+    report['held_out_images'] = len(samples)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
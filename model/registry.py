@@ -0,0 +1,227 @@
+"""
+Versioned Model Registry
+
+Each registered version is a directory under model/registry/ holding copies
+of the member weight files and a manifest.json with their SHA-256 checksums:
+
+    model/registry/<version>/manifest.json
+    model/registry/<version>/alexnet.pth
+    model/registry/<version>/resnet50.pth
+
+The built-in 'legacy' version points at the original files in model/
+(ENSEMBLE_WEIGHT_FILES) and is used until another version is activated.
+Those files can be replaced in place, so predictions made from them are
+stamped 'legacy-<checksum prefix>' (see ModelRegistry.version_label).
+
+Usage:
+    python -m model.registry register v2 --alexnet path/a.pth --resnet50 path/r.pth
+    python -m model.registry list
+    python -m model.registry verify v2
+    python -m model.registry activate v2
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import threading
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.architectures import ENSEMBLE_WEIGHT_FILES, file_sha256, ensemble_version
+
+LEGACY_VERSION = 'legacy'
+REGISTRY_DIR = 'model/registry'
+
+_VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+
+
+class RegistryError(ValueError):
+    """Unknown version, bad version name or checksum mismatch"""
+
+
+class ModelRegistry:
+    """Named, versioned weight sets with checksums and a persisted active version"""
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version):
+        if not _VERSION_PATTERN.match(version or ''):
+            raise RegistryError(f"Invalid model version name: {version!r}")
+        return os.path.join(self.root, version)
+
+    def _manifest_path(self, version):
+        return os.path.join(self._version_dir(version), 'manifest.json')
+
+    def list_versions(self):
+        """Registered versions (manifests), legacy first, then oldest to newest"""
+        versions = [self.manifest(LEGACY_VERSION)]
+        if os.path.isdir(self.root):
+            manifests = []
+            for name in os.listdir(self.root):
+                if os.path.exists(os.path.join(self.root, name, 'manifest.json')):
+                    manifests.append(self.manifest(name))
+            versions.extend(sorted(manifests, key=lambda m: m.get('created_at') or ''))
+        return versions
+
+    def manifest(self, version):
+        """Manifest dict of a version (legacy: built from the files in model/)"""
+        if version == LEGACY_VERSION:
+            return {
+                'version': LEGACY_VERSION,
+                'created_at': None,
+                'notes': 'Original weight files in model/',
+                'members': {name: {'file': path, 'sha256': None}
+                            for name, path in ENSEMBLE_WEIGHT_FILES.items() if os.path.exists(path)},
+            }
+        path = self._manifest_path(version)
+        if not os.path.exists(path):
+            raise RegistryError(f"Unknown model version: {version}")
+        with open(path) as f:
+            return json.load(f)
+
+    def weight_files(self, version):
+        """member name -> weight file path for load_ensemble_models"""
+        manifest = self.manifest(version)
+        if version == LEGACY_VERSION:
+            return {name: m['file'] for name, m in manifest['members'].items()}
+        base = self._version_dir(version)
+        return {name: os.path.join(base, m['file']) for name, m in manifest['members'].items()}
+
+    def verify(self, version):
+        """
+        Re-hash every weight file of a version
+
+        Returns:
+            dict: member -> sha256 (legacy files are hashed, not checked)
+
+        Raises:
+            RegistryError: a file is missing or its checksum does not match the manifest
+        """
+        manifest = self.manifest(version)
+        checksums = {}
+        for name, path in self.weight_files(version).items():
+            if not os.path.exists(path):
+                raise RegistryError(f"{version}: weight file for {name} is missing ({path})")
+            digest = file_sha256(path)
+            expected = manifest['members'][name].get('sha256')
+            if expected and digest != expected:
+                raise RegistryError(f"{version}: checksum mismatch for {name}")
+            checksums[name] = digest
+        return checksums
+
+    def version_label(self, version, checksums):
+        """
+        Name recorded as Prediction.model_version for a verified version
+
+        Registered versions are immutable, so their name identifies the weights;
+        the legacy files are identified by their checksums.
+        """
+        if version != LEGACY_VERSION:
+            return version
+        return f"{LEGACY_VERSION}-{ensemble_version(checksums, checksums=checksums)[:12]}"
+
+    def register(self, version, weight_files, notes=''):
+        """
+        Copy weight files into a new version directory and write its manifest
+
+        Args:
+            version (str): New version name (letters, digits, '.', '_', '-')
+            weight_files (dict): member name -> source weight file
+            notes (str): Free text stored in the manifest
+        """
+        if version == LEGACY_VERSION:
+            raise RegistryError("'legacy' is reserved")
+        if 'alexnet' not in weight_files:
+            raise RegistryError("A version must include alexnet weights (primary model)")
+        version_dir = self._version_dir(version)
+        if os.path.exists(version_dir):
+            raise RegistryError(f"Model version already exists: {version}")
+
+        tmp_dir = version_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        members = {}
+        for name, source in weight_files.items():
+            filename = f"{name}.pth"
+            shutil.copyfile(source, os.path.join(tmp_dir, filename))
+            members[name] = {'file': filename, 'sha256': file_sha256(os.path.join(tmp_dir, filename)),
+                             'source': os.path.abspath(source)}
+        manifest = {
+            'version': version,
+            'created_at': datetime.utcnow().isoformat(),
+            'notes': notes,
+            'members': members,
+        }
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        # Rename last so a half-copied version is never visible
+        os.rename(tmp_dir, version_dir)
+        return manifest
+
+    def active_version(self):
+        """Version loaded at startup (persisted in model/registry/ACTIVE)"""
+        path = os.path.join(self.root, 'ACTIVE')
+        if os.path.exists(path):
+            with open(path) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        return LEGACY_VERSION
+
+    def set_active(self, version):
+        self.manifest(version)  # must exist
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = os.path.join(self.root, 'ACTIVE.tmp')
+            with open(tmp_path, 'w') as f:
+                f.write(version)
+            os.replace(tmp_path, os.path.join(self.root, 'ACTIVE'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage versioned ensemble weights')
+    parser.add_argument('--root', default=REGISTRY_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    reg = sub.add_parser('register', help='Copy weight files into a new version')
+    reg.add_argument('version')
+    reg.add_argument('--alexnet', required=True)
+    reg.add_argument('--resnet50')
+    reg.add_argument('--notes', default='')
+    sub.add_parser('list', help='List versions')
+    ver = sub.add_parser('verify', help='Check the checksums of a version')
+    ver.add_argument('version')
+    act = sub.add_parser('activate', help='Load this version on the next start (running apps: POST /admin/models/activate)')
+    act.add_argument('version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    try:
+        if args.command == 'register':
+            files = {'alexnet': args.alexnet}
+            if args.resnet50:
+                files['resnet50'] = args.resnet50
+            print(json.dumps(registry.register(args.version, files, args.notes), indent=2))
+        elif args.command == 'list':
+            active = registry.active_version()
+            for m in registry.list_versions():
+                marker = '*' if m['version'] == active else ' '
+                print(f"{marker} {m['version']:<24} {m.get('created_at') or '-':<28} {', '.join(m['members'])}")
+        elif args.command == 'verify':
+            print(json.dumps(registry.verify(args.version), indent=2))
+        elif args.command == 'activate':
+            registry.verify(args.version)
+            registry.set_active(args.version)
+            print(f"Active model version: {args.version}")
+    except RegistryError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -70,10 +70,14 @@ class Prediction(db.Model):
     
     image_path = db.Column(db.String(200), nullable=False)
     heatmap_path = db.Column(db.String(200))  # Path to GradCAM heatmap visualization
+    cam_path = db.Column(db.String(200))  # All-classes GradCAM maps (float16 .npy) for switching the explained class
     predicted_class = db.Column(db.String(50), nullable=False)
     explanation = db.Column(db.Text)
     recommendation = db.Column(db.Text)
     uncertainty = db.Column(db.Float) # Added for Uncertainty Quantification
+    models_used = db.Column(db.String(100)) # Comma-separated ensemble members that actually ran (cascade audit)
+    model_version = db.Column(db.String(64)) # Registry version of the weights that produced it
+    eye = db.Column(db.String(5)) # 'left' / 'right' for bilateral analyses, None otherwise
     
     is_visible_to_patient = db.Column(db.Boolean, default=False) # Control patient visibility
     annotation_data = db.Column(db.Text) # JSON string for coordinates: {"x": 10, "y": 20, "width": 50, "height": 50}
@@ -89,6 +93,71 @@ class Prediction(db.Model):
     
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+class AnalysisJob(db.Model):
+    # Asynchronous /lab/analyze job; the row is the source of truth so jobs survive a restart
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    lab_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    booking_id = db.Column(db.Integer, db.ForeignKey('lab_booking.id'), nullable=True)
+    image_path = db.Column(db.String(200), nullable=False) # Saved upload, relative to UPLOAD_FOLDER
+    upload_sha256 = db.Column(db.String(64)) # Content hash for the result cache
+    
+    status = db.Column(db.String(20), default='queued') # queued, running, done, failed
+    stage = db.Column(db.String(20), default='upload') # upload, quality, inference, saved
+    prediction_id = db.Column(db.Integer, db.ForeignKey('prediction.id'), nullable=True)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    lease_owner = db.Column(db.String(64)) # Process running the job (AnalysisJobQueue.owner)
+    lease_expires_at = db.Column(db.DateTime) # Another process may reclaim a running job after this
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    prediction = db.relationship('Prediction', foreign_keys='AnalysisJob.prediction_id')
+
+class ShadowPrediction(db.Model):
+    # Candidate model output for a mirrored /lab/analyze input (never shown to users)
+    id = db.Column(db.Integer, primary_key=True)
+    prediction_id = db.Column(db.Integer, db.ForeignKey('prediction.id'), nullable=False, index=True)
+    candidate = db.Column(db.String(50), nullable=False, index=True) # get_model architecture name
+    
+    predicted_class = db.Column(db.String(50), nullable=False)
+    confidence = db.Column(db.Float)
+    latency_ms = db.Column(db.Float) # Candidate forward pass
+    
+    production_class = db.Column(db.String(50), nullable=False)
+    production_confidence = db.Column(db.Float)
+    production_latency_ms = db.Column(db.Float) # Ensemble inference for the same request
+    agrees = db.Column(db.Boolean, default=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RescoredPrediction(db.Model):
+    # Historical Prediction re-scored by a later model version (backfill); the original row is unchanged
+    __table_args__ = (db.UniqueConstraint('prediction_id', 'model_version'),)
+    id = db.Column(db.Integer, primary_key=True)
+    prediction_id = db.Column(db.Integer, db.ForeignKey('prediction.id'), nullable=False, index=True)
+    model_version = db.Column(db.String(64), nullable=False, index=True)
+    predicted_class = db.Column(db.String(50), nullable=False)
+    confidence = db.Column(db.Float)
+    uncertainty = db.Column(db.Float)
+    models_used = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BackfillRun(db.Model):
+    # Checkpoint of a re-scoring backfill: predictions up to last_prediction_id are done
+    id = db.Column(db.Integer, primary_key=True)
+    model_version = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), default='running') # running, paused, done, failed
+    last_prediction_id = db.Column(db.Integer, default=0)
+    max_prediction_id = db.Column(db.Integer, default=0) # Newer predictions already use this version
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
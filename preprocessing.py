@@ -0,0 +1,170 @@
+"""
+Image Preprocessing Module
+Shared transforms, class names and labeled-dataset helpers used by the web
+app and the offline model tools (quantization calibration, evaluation)
+"""
+import os
+import glob
+import threading
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+# Class names (index order matches the trained model heads)
+CLASS_NAMES = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal', 'redness', 'wrinkles']
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Model input resolution and normalization (ImageNet statistics)
+INPUT_SIZE = 227
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+# Images are rejected from their header before decoding beyond this many pixels
+MAX_DECODE_PIXELS = 50_000_000
+
+# Image transforms
+transform = transforms.Compose([
+    transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=NORMALIZE_MEAN,
+                         std=NORMALIZE_STD),
+])
+
+# Transform for visualization (without normalization)
+transform_vis = transforms.Compose([
+    transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    transforms.ToTensor(),
+])
+
+
+_MEAN = torch.tensor(NORMALIZE_MEAN).view(3, 1, 1)
+_STD = torch.tensor(NORMALIZE_STD).view(3, 1, 1)
+
+# Per-thread decode buffers, reused by load_image_tensor
+_buffers = threading.local()
+
+# Modes Image.reduce() handles directly, so large images shrink before any conversion copy
+_REDUCIBLE_MODES = ('RGB', 'RGBA', 'L', 'LA')
+
+
+def decode_image(source, size=INPUT_SIZE, out=None):
+    """
+    Decode an image straight to (size, size, 3) uint8 RGB pixels
+
+    JPEGs use draft mode, so libjpeg's DCT scaling decodes at the smallest
+    power-of-two reduction that is still at least `size` on both sides.
+    Other formats (PNG) are checked against MAX_DECODE_PIXELS from the header,
+    then box-reduced by an integer factor before the colour conversion and
+    the final resize. Images already close to `size` give exactly the same
+    pixels as `transform`'s Resize.
+
+    Args:
+        source (str or file): Path or binary file object
+        size (int): Output height and width
+        out (ndarray): Optional (size, size, 3) uint8 buffer to decode into
+
+    Returns:
+        ndarray: `out` (or a new array) holding the pixels
+    """
+    with Image.open(source) as img:
+        width, height = img.size
+        if width * height > MAX_DECODE_PIXELS:
+            raise ValueError(f"Image is too large to decode ({width}x{height} pixels)")
+        if img.format == 'JPEG':
+            img.draft('RGB', (size, size))
+        else:
+            factor = min(width // size, height // size)
+            if factor >= 2:
+                if img.mode not in _REDUCIBLE_MODES:
+                    img = img.convert('RGB')
+                img = img.reduce(factor)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        resized = img.resize((size, size), Image.BILINEAR)
+
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+    np.copyto(out, np.asarray(resized))
+    return out
+
+
+def decode_display_image(source, max_size):
+    """
+    Decode an image for display: aspect ratio kept, longer side scaled to
+    `max_size` (the same draft / box-reduce shortcuts as decode_image)
+
+    Returns:
+        ndarray: (H, W, 3) uint8 RGB pixels
+    """
+    with Image.open(source) as img:
+        width, height = img.size
+        if width * height > MAX_DECODE_PIXELS:
+            raise ValueError(f"Image is too large to decode ({width}x{height} pixels)")
+        scale = max_size / max(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if img.format == 'JPEG':
+            img.draft('RGB', target)
+        else:
+            factor = min(width // target[0], height // target[1])
+            if factor >= 2:
+                if img.mode not in _REDUCIBLE_MODES:
+                    img = img.convert('RGB')
+                img = img.reduce(factor)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return np.asarray(img.resize(target, Image.BILINEAR)).copy()
+
+
+def pixels_to_tensor(pixels):
+    """(H, W, 3) uint8 pixels -> normalized (3, H, W) float tensor (same values as `transform`)"""
+    tensor = torch.from_numpy(pixels).permute(2, 0, 1).float().div_(255)
+    return tensor.sub_(_MEAN).div_(_STD)
+
+
+def _decode_buffer(size=INPUT_SIZE):
+    buffer = getattr(_buffers, 'pixels', None)
+    if buffer is None or buffer.shape[0] != size:
+        buffer = _buffers.pixels = np.empty((size, size, 3), dtype=np.uint8)
+    return buffer
+
+
+def load_image_tensor(image_path):
+    """Decode an image file into this thread's reusable buffer -> (3, 227, 227) tensor"""
+    return pixels_to_tensor(decode_image(image_path, out=_decode_buffer()))
+
+
+def list_labeled_images(data_dir='DATA', class_names=CLASS_NAMES, per_class=None):
+    """
+    List (image_path, class_index) pairs from class folders such as DATA/glaucoma
+
+    Args:
+        data_dir (str): Root folder containing one sub-folder per class
+        class_names (list): Folder names, in model output order
+        per_class (int): Optional cap on images taken from each folder
+
+    Returns:
+        list: [(path, label_idx), ...] sorted for reproducibility
+    """
+    samples = []
+    for label_idx, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        paths = sorted(
+            p for p in glob.glob(os.path.join(class_dir, '*'))
+            if p.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if per_class is not None:
+            paths = paths[:per_class]
+        samples.extend((p, label_idx) for p in paths)
+    return samples
+
+
+def load_labeled_batches(samples, batch_size=16):
+    """Yield (images, labels) tensor batches for a list of (path, label_idx) pairs"""
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        images = torch.stack([load_image_tensor(p) for p, _ in chunk])
+        labels = torch.tensor([label for _, label in chunk])
+        yield images, labels
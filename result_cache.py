@@ -0,0 +1,92 @@
+"""
+Result Cache Module for Repeated Scan Uploads
+Maps the SHA-256 of the uploaded bytes (plus the model version) to the
+stored ensemble result; the duplicate report shares the GradCAM files of
+the original upload, so re-uploads skip inference and a second GradCAM render
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """SHA-256 hex digest of an upload's raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe, size-bounded LRU cache of analysis results
+
+    Entries are keyed by (content hash, model version). Changing the model
+    version with `set_model_version` drops every entry, so results from old
+    weights are never served. `max_entries=0` disables the cache.
+    """
+
+    def __init__(self, max_entries=512, model_version=None):
+        self.max_entries = max(0, int(max_entries))
+        self.model_version = model_version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _key(self, digest):
+        return (digest, self.model_version)
+
+    def get(self, digest):
+        """Cached entry for an upload hash, or None (marks the entry as recently used)"""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            key = self._key(digest)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, digest, entry, model_version=None):
+        """
+        Store an entry, evicting the least recently used ones beyond max_entries
+
+        If `model_version` is given and is no longer the current version (the
+        result was computed by a runtime that has since been swapped out), the
+        entry is dropped.
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            key = self._key(digest)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def set_model_version(self, model_version):
+        """Switch to a new model version; clears the cache if it changed"""
+        with self._lock:
+            if model_version != self.model_version:
+                if self.model_version is not None:
+                    self._stats['invalidations'] += 1
+                self.model_version = model_version
+                self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            s = dict(self._stats)
+            s['entries'] = len(self._entries)
+        lookups = s['hits'] + s['misses']
+        s['hit_rate'] = round(s['hits'] / lookups, 4) if lookups else 0.0
+        s['max_entries'] = self.max_entries
+        s['model_version'] = self.model_version
+        return s
@@ -0,0 +1,212 @@
+"""
+Offline Directory Scorer
+Scores every image under a directory (e.g. DATA/glaucoma or a partner dump)
+with the ensemble, without going through the web app, and writes one row per
+image to CSV or Parquet.
+
+Images are decoded in a process pool a few batches ahead of the ensemble.
+Finished rows are appended to <output>.partial.csv after every batch, so an
+interrupted run picks up where it stopped when started again with the same
+output path; the final file is written once every image is scored.
+
+Usage:
+    python score_directory.py DATA/glaucoma --output glaucoma.csv
+    python score_directory.py /data/partner --output partner.parquet --batch-size 64 --decode-workers 8
+"""
+import os
+import sys
+import csv
+import time
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from config import Config
+from preprocessing import CLASS_NAMES, IMAGE_EXTENSIONS, decode_image, pixels_to_tensor
+
+FIELDS = ['path', 'predicted_class', 'confidence', 'uncertainty', 'models_used', 'model_version'] + \
+         [f'prob_{c}' for c in CLASS_NAMES] + ['error']
+NUMERIC_FIELDS = ['confidence', 'uncertainty'] + [f'prob_{c}' for c in CLASS_NAMES]
+
+
+def list_images(root):
+    """Image paths under `root` (recursive), relative to it and sorted"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return paths
+
+
+def load_checkpoint(partial_path):
+    """Paths already scored in a previous run (drops a half-written last line)"""
+    if not os.path.exists(partial_path):
+        return set()
+    with open(partial_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    with open(partial_path, newline='') as f:
+        return {row['path'] for row in csv.DictReader(f)}
+
+
+def _decode_batch(root, paths):
+    """Process pool task: [(path, pixels or None, error or None), ...]"""
+    decoded = []
+    for path in paths:
+        try:
+            decoded.append((path, decode_image(os.path.join(root, path)), None))
+        except Exception as e:
+            decoded.append((path, None, f"{type(e).__name__}: {e}"))
+    return decoded
+
+
+def score_batches(engine, root, paths, batch_size, decode_workers, prefetch=None):
+    """
+    Yield (decoded, results, decode_wait_s, inference_s) per batch
+
+    Batches are decoded in `decode_workers` processes, at most `prefetch`
+    batches ahead of the ensemble (default: one per worker).
+    """
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    prefetch = prefetch or max(1, decode_workers)
+    with ProcessPoolExecutor(max_workers=decode_workers) as executor:
+        futures = [executor.submit(_decode_batch, root, b) for b in batches[:prefetch]]
+        for i in range(len(batches)):
+            wait_start = time.perf_counter()
+            decoded = futures[i].result()
+            decode_wait = time.perf_counter() - wait_start
+            futures[i] = None
+            if i + prefetch < len(batches):
+                futures.append(executor.submit(_decode_batch, root, batches[i + prefetch]))
+
+            tensors = [pixels_to_tensor(pixels) for _, pixels, _ in decoded if pixels is not None]
+            infer_start = time.perf_counter()
+            results = engine.run_batch(torch.stack(tensors)) if tensors else []
+            yield decoded, results, decode_wait, time.perf_counter() - infer_start
+
+
+def result_rows(decoded, results, model_version):
+    """CSV rows for one batch; undecodable images get a row with only `error` set"""
+    rows = []
+    results = iter(results)
+    for path, pixels, error in decoded:
+        if pixels is None:
+            rows.append({'path': path, 'error': error})
+            continue
+        result = next(results)
+        probs = result['mean'][0]
+        confidence, idx = torch.max(probs, 0)
+        row = {
+            'path': path,
+            'predicted_class': CLASS_NAMES[idx.item()],
+            'confidence': round(confidence.item(), 6),
+            # None when a single model ran (cascade rows that were not escalated, AlexNet-only loads)
+            'uncertainty': round(float(result['uncertainty']), 6) if result['uncertainty'] is not None else '',
+            'models_used': ','.join(result['models_used']),
+            'model_version': model_version,
+            'error': '',
+        }
+        row.update({f'prob_{c}': round(p, 6) for c, p in zip(CLASS_NAMES, probs.tolist())})
+        rows.append(row)
+    return rows
+
+
+def read_checkpoint_frame(partial_path):
+    """
+    Checkpoint CSV as a DataFrame with numeric columns typed as numbers
+
+    Empty cells (undecodable images, single-model uncertainty) become NaN, so
+    the columns stay numeric; text columns keep '' rather than NaN.
+    """
+    import pandas as pd
+    frame = pd.read_csv(partial_path, keep_default_na=False)
+    for field in NUMERIC_FIELDS:
+        frame[field] = pd.to_numeric(frame[field], errors='coerce')
+    return frame
+
+
+def write_output(partial_path, output):
+    """Turn the checkpoint CSV into the final CSV or Parquet file"""
+    if output.lower().endswith('.parquet'):
+        read_checkpoint_frame(partial_path).to_parquet(output, index=False)
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score every image in a directory with the ensemble')
+    parser.add_argument('directory')
+    parser.add_argument('--output', required=True, help='.csv or .parquet')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--decode-workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--model-version', help='Registry version (default: the active one)')
+    parser.add_argument('--mode', default=Config.ENSEMBLE_MODE, choices=['full', 'cascade'])
+    parser.add_argument('--cascade-threshold', type=float, default=Config.CASCADE_CONFIDENCE_THRESHOLD)
+    parser.add_argument('--sensitive-classes', default=','.join(Config.CASCADE_SENSITIVE_CLASSES),
+                        help='Comma-separated class names escalated in cascade mode')
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--backend', default='eager')
+    parser.add_argument('--limit', type=int, help='Score at most this many images (smoke runs)')
+    args = parser.parse_args()
+
+    if args.output.lower().endswith('.parquet') and not any(
+            importlib.util.find_spec(m) for m in ('pyarrow', 'fastparquet')):
+        print("Parquet output needs pyarrow or fastparquet (pip install pyarrow); use a .csv output otherwise")
+        return 1
+
+    from model.architectures import load_ensemble_models
+    from model.registry import ModelRegistry
+    from inference_service import InferenceEngine
+
+    paths = list_images(args.directory)
+    if args.limit:
+        paths = paths[:args.limit]
+    partial_path = args.output + '.partial.csv'
+    done = load_checkpoint(partial_path)
+    todo = [p for p in paths if p not in done]
+    print(f"{len(paths)} images in {args.directory}, {len(done)} already scored, {len(todo)} to go")
+
+    registry = ModelRegistry()
+    version = args.model_version or registry.active_version()
+    models_dict = load_ensemble_models(torch.device('cpu'), quantize=args.quantize, backend=args.backend,
+                                       weight_files=registry.weight_files(version))
+    if not models_dict:
+        print("No models could be loaded")
+        return 1
+    sensitive = [CLASS_NAMES.index(c) for c in args.sensitive_classes.split(',') if c in CLASS_NAMES]
+    engine = InferenceEngine(models_dict, capture=(), mode=args.mode,
+                             cascade_threshold=args.cascade_threshold, sensitive_classes=sensitive)
+
+    started = time.perf_counter()
+    scored = decode_wait = inference = 0.0
+    write_header = not os.path.exists(partial_path) or os.path.getsize(partial_path) == 0
+    with open(partial_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if write_header:
+            writer.writeheader()
+        for decoded, results, wait_s, infer_s in score_batches(engine, args.directory, todo,
+                                                               args.batch_size, args.decode_workers):
+            writer.writerows(result_rows(decoded, results, version))
+            f.flush()  # checkpoint: everything written so far is skipped on restart
+            scored += len(decoded)
+            decode_wait += wait_s
+            inference += infer_s
+            elapsed = time.perf_counter() - started
+            print(f"[{len(done) + int(scored)}/{len(paths)}] {scored / elapsed:.1f} images/sec")
+
+    elapsed = time.perf_counter() - started
+    write_output(partial_path, args.output)
+    print(f"Scored {int(scored)} images in {elapsed:.1f}s: {scored / elapsed if elapsed else 0:.1f} images/sec "
+          f"(inference {inference:.1f}s, waiting on decode {decode_wait:.1f}s)")
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Shadow Evaluation Module
+Mirrors a sample of /lab/analyze inputs to a candidate architecture from
+`get_model` (efficientnet_b0, vit_b_16, ...) on a low-priority background
+thread and stores its outputs in the ShadowPrediction side table, so the
+candidate can be compared with production on real traffic before promotion.
+
+The request path only does a random draw and, after its commit, a
+non-blocking queue put; the candidate never runs while production requests
+are in flight.
+"""
+import os
+import time
+import queue
+import random
+import logging
+import threading
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, ShadowPrediction
+from preprocessing import pixels_to_tensor
+
+logger = logging.getLogger(__name__)
+
+# Input resolution per candidate; others take the 227x227 production input as is
+CANDIDATE_INPUT_SIZE = {'vit_b_16': 224}
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(values, dtype=np.float64), [50, 95, 99])
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3),
+            'mean': round(float(np.mean(values)), 3)}
+
+
+def shadow_report(rows):
+    """
+    Compare candidate and production over ShadowPrediction rows
+
+    Returns:
+        dict: sample count, overall and per-class agreement, confidence deltas
+        (candidate - production), latency distributions and the most common
+        disagreements ("production -> candidate": count)
+    """
+    rows = list(rows)
+    if not rows:
+        return {'samples': 0}
+
+    per_class = {}
+    disagreements = {}
+    for r in rows:
+        c = per_class.setdefault(r.production_class, {'samples': 0, 'agree': 0})
+        c['samples'] += 1
+        if r.agrees:
+            c['agree'] += 1
+        else:
+            pair = f"{r.production_class} -> {r.predicted_class}"
+            disagreements[pair] = disagreements.get(pair, 0) + 1
+    for c in per_class.values():
+        c['agreement'] = round(c['agree'] / c['samples'], 4)
+
+    deltas = [r.confidence - r.production_confidence for r in rows
+              if r.confidence is not None and r.production_confidence is not None]
+    return {
+        'samples': len(rows),
+        'agreement': round(sum(1 for r in rows if r.agrees) / len(rows), 4),
+        'per_class': dict(sorted(per_class.items())),
+        'confidence_delta': dict(_percentiles(deltas) or {},
+                                 mean_abs=round(float(np.mean(np.abs(deltas))), 4) if deltas else None),
+        'latency_ms': {
+            'candidate': _percentiles([r.latency_ms for r in rows if r.latency_ms is not None]),
+            'production': _percentiles([r.production_latency_ms for r in rows if r.production_latency_ms is not None]),
+        },
+        'top_disagreements': dict(sorted(disagreements.items(), key=lambda kv: -kv[1])[:10]),
+    }
+
+
+class ShadowEvaluator:
+    """
+    Background candidate-model runner
+
+    `mirror()` is called on the request path after the Prediction is added to
+    the session. Sampled inputs are queued only once that session commits (a
+    rolled back analysis is never mirrored); the queue is bounded and drops
+    samples instead of blocking when the candidate falls behind.
+
+    The worker thread lowers its own scheduling priority (Linux) and waits
+    while `is_busy()` reports production requests in flight.
+    """
+
+    def __init__(self, app, candidate, weights_path, class_names, sample_rate=0.1, max_pending=32,
+                 nice=19, is_busy=None, device=None):
+        self.app = app
+        self.candidate = candidate
+        self.weights_path = weights_path
+        self.class_names = list(class_names)
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.nice = nice
+        self.is_busy = is_busy or (lambda: False)
+        self.device = device or torch.device('cpu')
+        self.input_size = CANDIDATE_INPUT_SIZE.get(candidate)
+        self._queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._model = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {'sampled': 0, 'evaluated': 0, 'dropped': 0, 'errors': 0}
+        self._pending_key = f'shadow_pending_{id(self)}'  # per evaluator in session.info
+
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_soft_rollback', self._after_rollback)
+
+    def mirror(self, session, prediction, pixels, production_ms):
+        """
+        Sample this analysis for the candidate (no-op when not drawn)
+
+        Args:
+            session: Session the Prediction was added to
+            prediction: The production Prediction (uncommitted)
+            pixels: The decoded (227, 227, 3) uint8 input
+            production_ms: Production inference latency for the request
+        """
+        if self._error is not None or random.random() >= self.sample_rate:
+            return False
+        session.info.setdefault(self._pending_key, []).append(
+            (prediction, pixels, prediction.predicted_class, prediction.confidence, production_ms))
+        return True
+
+    def _after_commit(self, session):
+        pending = session.info.pop(self._pending_key, None)
+        for prediction, pixels, production_class, production_confidence, production_ms in pending or ():
+            identity = sa_inspect(prediction).identity  # primary key without a refresh query
+            if not identity:
+                continue
+            item = (identity[0], pixels, production_class, production_confidence, production_ms)
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self._stats['dropped'] += 1
+                continue
+            with self._lock:
+                self._stats['sampled'] += 1
+            self._ensure_worker()
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop(self._pending_key, None)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='shadow-eval', daemon=True)
+                self._worker.start()
+
+    def _load_model(self):
+        from model.architectures import get_model, load_weights
+        model = get_model(self.candidate, len(self.class_names), pretrained=False)
+        load_weights(model, self.weights_path, self.device)
+        model.eval()
+        return model.to(self.device)
+
+    def _run(self):
+        try:
+            # Only this thread is deprioritized (a Linux thread is its own task)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+
+        if self._model is None:
+            try:
+                self._model = self._load_model()
+                logger.info(f"Shadow candidate {self.candidate} loaded from {self.weights_path}")
+            except Exception as e:
+                self._error = f"Could not load shadow candidate {self.candidate}: {e}"
+                logger.error(self._error)
+                return
+
+        while True:
+            prediction_id, pixels, production_class, production_confidence, production_ms = self._queue.get()
+            while self.is_busy():
+                time.sleep(0.02)
+            try:
+                predicted_class, confidence, latency_ms = self._predict(pixels)
+                with self.app.app_context():
+                    db.session.add(ShadowPrediction(
+                        prediction_id=prediction_id,
+                        candidate=self.candidate,
+                        predicted_class=predicted_class,
+                        confidence=confidence,
+                        latency_ms=latency_ms,
+                        production_class=production_class,
+                        production_confidence=production_confidence,
+                        production_latency_ms=production_ms,
+                        agrees=predicted_class == production_class
+                    ))
+                    db.session.commit()
+                with self._lock:
+                    self._stats['evaluated'] += 1
+            except Exception as e:
+                logger.error(f"Shadow evaluation of prediction {prediction_id} failed: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+
+    def _predict(self, pixels):
+        tensor = pixels_to_tensor(pixels).unsqueeze(0).to(self.device)
+        if self.input_size and tensor.shape[-1] != self.input_size:
+            tensor = F.interpolate(tensor, size=(self.input_size, self.input_size), mode='bilinear', align_corners=False)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            probs = F.softmax(self._model(tensor), dim=1)[0]
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        confidence, idx = torch.max(probs, 0)
+        return self.class_names[idx.item()], confidence.item(), latency_ms
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s.update(candidate=self.candidate, sample_rate=self.sample_rate,
+                 pending=self._queue.qsize(), error=self._error)
+        return s
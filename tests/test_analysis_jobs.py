@@ -0,0 +1,118 @@
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Prediction, AnalysisJob
+from analysis_jobs import AnalysisJobQueue, new_job_id
+
+
+def _app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'jobs.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(id=1, email='lab@x', name='Lab', user_type='lab'),
+                            User(id=2, email='pat@x', name='Pat', user_type='patient')])
+        db.session.commit()
+    return app
+
+
+def _handler(job, set_stage):
+    set_stage('inference')
+    if job.image_path == 'bad.png':
+        raise ValueError("Could not decode image")
+    set_stage('heatmap')
+    prediction = Prediction(patient_id=job.patient_id, lab_id=job.lab_id, image_path=job.image_path,
+                            predicted_class='normal', confidence=0.9)
+    db.session.add(prediction)
+    return prediction
+
+
+def _add_job(app, image_path, status='queued', attempts=0, lease_owner=None, lease_expires_at=None):
+    with app.app_context():
+        job = AnalysisJob(id=new_job_id(), lab_id=1, patient_id=2, image_path=image_path,
+                          status=status, attempts=attempts, lease_owner=lease_owner, lease_expires_at=lease_expires_at)
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+
+def _wait(app, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with app.app_context():
+            job = db.session.get(AnalysisJob, job_id)
+            if job.status in ('done', 'failed'):
+                return job.status, job.stage, job.prediction_id, job.error
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_job_runs_through_stages_and_records_prediction(tmp_path):
+    app = _app(tmp_path)
+    completed = []
+    queue = AnalysisJobQueue(app, _handler, on_complete=lambda job, p: completed.append(p.id), max_workers=1)
+    ok_id, bad_id = _add_job(app, 'ok.png'), _add_job(app, 'bad.png')
+    queue.submit(ok_id)
+    queue.submit(bad_id)
+
+    status, stage, prediction_id, _ = _wait(app, ok_id)
+    assert (status, stage) == ('done', 'saved')
+    assert prediction_id is not None and completed == [prediction_id]
+    status, stage, prediction_id, error = _wait(app, bad_id)
+    assert status == 'failed' and prediction_id is None and 'decode' in error
+    queue.shutdown()
+    print(f"Job queue stats: {queue.stats()}")
+    assert queue.stats()['pending'] == 0
+
+
+def test_resume_requeues_interrupted_jobs(tmp_path):
+    app = _app(tmp_path)
+    # Left behind by a "previous process": one mid-run, one that keeps crashing
+    interrupted = _add_job(app, 'ok.png', status='running', attempts=1)
+    crash_loop = _add_job(app, 'ok.png', status='running', attempts=3)
+    queue = AnalysisJobQueue(app, _handler, max_workers=1, max_attempts=3)
+    with app.app_context():
+        assert queue.resume() == 1
+
+    assert _wait(app, interrupted)[0] == 'done'
+    assert _wait(app, crash_loop)[0] == 'failed'
+    queue.shutdown()
+
+
+def test_jobs_held_by_a_live_process_are_not_resumed(tmp_path):
+    app = _app(tmp_path)
+    now = datetime.utcnow()
+    live = _add_job(app, 'ok.png', status='running', attempts=1, lease_owner='other:1', lease_expires_at=now + timedelta(minutes=5))
+    expired = _add_job(app, 'ok.png', status='running', attempts=1, lease_owner='other:2', lease_expires_at=now - timedelta(minutes=5))
+    queue = AnalysisJobQueue(app, _handler, max_workers=1)
+    with app.app_context():
+        assert queue.resume() == 1
+
+    assert _wait(app, expired)[0] == 'done'
+    queue.shutdown()
+    with app.app_context():
+        job = db.session.get(AnalysisJob, live)
+        assert (job.status, job.lease_owner, job.attempts) == ('running', 'other:1', 1)
+        assert db.session.get(AnalysisJob, expired).lease_owner == queue.owner
+
+
+def test_a_job_queued_by_several_processes_runs_once(tmp_path):
+    app = _app(tmp_path)
+    job_id = _add_job(app, 'ok.png')
+    # e.g. gunicorn workers that all found the job queued at startup
+    queues = [AnalysisJobQueue(app, _handler, max_workers=1) for _ in range(3)]
+    for queue in queues:
+        queue.submit(job_id)
+    for queue in queues:
+        queue.shutdown()
+    assert _wait(app, job_id)[0] == 'done'
+    print(f"Stats: {[q.stats() for q in queues]}")
+    assert sum(q.stats()['completed'] for q in queues) == 1
+    assert sum(q.stats()['claimed_elsewhere'] for q in queues) == 2
+    with app.app_context():
+        assert Prediction.query.count() == 1 and db.session.get(AnalysisJob, job_id).attempts == 1
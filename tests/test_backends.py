@@ -0,0 +1,63 @@
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from inference_service import InferenceEngine
+from model.architectures import gradcam_from_activations
+from model.backends import ONNXRUNTIME_AVAILABLE, check_equivalence, compile_member
+
+
+def _alexnet_with_weights(tmp_dir):
+    torch.manual_seed(0)
+    m = models.alexnet(weights=None)
+    m.classifier[6] = nn.Linear(m.classifier[6].in_features, 6)
+    m.eval()
+    weights_path = os.path.join(tmp_dir, 'alexnet.pth')
+    torch.save(m.state_dict(), weights_path)
+    return m, weights_path
+
+
+def test_compiled_backends_are_equivalent_and_cached():
+    device = torch.device('cpu')
+    backends = ['torchscript'] + (['onnxruntime'] if ONNXRUNTIME_AVAILABLE else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        eager, weights_path = _alexnet_with_weights(tmp_dir)
+        cache_dir = os.path.join(tmp_dir, 'compiled')
+        for backend in backends:
+            member = compile_member('alexnet', eager, weights_path, backend, device, cache_dir)
+            assert getattr(member, 'backend', None) == backend
+            assert check_equivalence(eager, member, device)['equivalent']
+
+            # Explanations still work through the compiled member
+            engine = InferenceEngine({'alexnet': member})
+            result = engine.run_batch(torch.randn(1, 3, 227, 227))[0]
+            cam = gradcam_from_activations(engine.explain_head('alexnet'), result['activations']['alexnet'], 1)
+            assert cam.shape == (6, 6)
+
+        # One artifact directory per backend, keyed by the weight hash
+        assert len(os.listdir(cache_dir)) == len(backends)
+        assert not eager.training
+
+
+def test_engine_builds_with_cams_on_every_backend():
+    device = torch.device('cpu')
+    backends = ['eager', 'torchscript', 'auto'] + (['onnxruntime'] if ONNXRUNTIME_AVAILABLE else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        eager = models.resnet18(num_classes=6).eval()  # stands in for ResNet50 (same head)
+        weights_path = os.path.join(tmp_dir, 'resnet.pth')
+        torch.save(eager.state_dict(), weights_path)
+        cache_dir = os.path.join(tmp_dir, 'compiled')
+        expected = None
+        for backend in backends:
+            member = compile_member('resnet50', eager, weights_path, backend, device, cache_dir)
+            engine = InferenceEngine({'resnet50': member}, capture=(), cam=('resnet50',))
+            cams = engine.run_batch(torch.ones(1, 3, 227, 227))[0]['cams']['resnet50']
+            print(f"{backend}: cams {cams.shape}")
+            assert cams.shape == (6, 8, 8)
+            expected = cams if expected is None else expected
+            assert abs(cams.astype('float32') - expected.astype('float32')).max() < 1e-2
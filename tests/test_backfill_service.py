@@ -0,0 +1,107 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+from PIL import Image
+from flask import Flask
+from models import db, User, Prediction, RescoredPrediction, BackfillRun
+from inference_service import InferenceRuntime
+from backfill_service import RescoreBackfill
+
+CLASSES = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal', 'redness', 'wrinkles']
+
+
+def _app(tmp_path, images=5):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'backfill.db'}"
+    db.init_app(app)
+    rng = np.random.default_rng(0)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, email='pat@x', name='Pat', user_type='patient'))
+        for i in range(images):
+            name = f"eye_{i}.png"
+            Image.fromarray(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(tmp_path / name)
+            db.session.add(Prediction(patient_id=1, image_path=name, predicted_class='normal', confidence=0.5))
+        db.session.add(Prediction(patient_id=1, image_path='missing.png', predicted_class='normal', confidence=0.5))
+        db.session.commit()
+    return app
+
+
+def _runtime(on_batch=None):
+    def runner(batch):
+        if on_batch:
+            on_batch(batch)
+        mean = torch.zeros(1, len(CLASSES))
+        mean[0, 2] = 1.0
+        return [{'mean': mean, 'uncertainty': 0.01, 'models_used': ['alexnet']} for _ in range(batch.shape[0])]
+    return InferenceRuntime('v2', {}, engine=None, runner=runner)
+
+
+def test_backfill_rescores_everything_once(tmp_path):
+    app = _app(tmp_path)
+    runtime = _runtime()
+    backfill = RescoreBackfill(app, lambda: runtime, str(tmp_path), CLASSES, batch_size=4, decode_workers=2)
+    with app.app_context():
+        backfill.start()
+    backfill.wait(30)
+
+    with app.app_context():
+        status = backfill.status()
+        print(f"Backfill status: {status}")
+        assert status['run']['status'] == 'done'
+        assert status['run']['processed'] == 5 and status['run']['failed'] == 1
+        rows = RescoredPrediction.query.all()
+        assert len(rows) == 5 and {r.predicted_class for r in rows} == {'glaucoma'}
+        assert {r.model_version for r in rows} == {'v2'}
+
+
+def test_paused_backfill_resumes_from_checkpoint(tmp_path):
+    app = _app(tmp_path)
+    backfill = None
+    batches = []
+
+    def pause_after_first(batch):
+        batches.append(batch.shape[0])
+        backfill.pause()
+
+    runtime = _runtime(pause_after_first)
+    backfill = RescoreBackfill(app, lambda: runtime, str(tmp_path), CLASSES, batch_size=2, decode_workers=1)
+    with app.app_context():
+        backfill.start()
+    backfill.wait(30)
+    with app.app_context():
+        run = BackfillRun.query.one()
+        assert run.status == 'paused' and run.processed == 2 and run.last_prediction_id == 2
+
+    runtime.run_batch = _runtime().run_batch
+    with app.app_context():
+        assert backfill.start().id == run.id
+    backfill.wait(30)
+    with app.app_context():
+        run = BackfillRun.query.one()
+        assert run.status == 'done' and run.processed == 5
+        assert RescoredPrediction.query.count() == 5
+
+
+def test_new_run_skips_rescored_and_current_version_predictions(tmp_path):
+    app = _app(tmp_path, images=3)
+    with app.app_context():
+        db.session.add(Prediction(patient_id=1, image_path='eye_0.png', predicted_class='glaucoma',
+                                  confidence=0.9, model_version='v2'))
+        db.session.commit()
+    runtime = _runtime()
+    backfill = RescoreBackfill(app, lambda: runtime, str(tmp_path), CLASSES, batch_size=8)
+    for _ in range(2):
+        with app.app_context():
+            backfill.start()
+        backfill.wait(30)
+
+    with app.app_context():
+        runs = BackfillRun.query.order_by(BackfillRun.id).all()
+        assert [r.status for r in runs] == ['done', 'done']
+        assert (runs[0].total, runs[0].processed) == (4, 3)  # missing.png counts as failed
+        assert runs[1].total == 1 and runs[1].processed == 0  # only the undecodable upload is left
+        assert RescoredPrediction.query.count() == 3
@@ -0,0 +1,171 @@
+import sys
+import os
+import io
+import json
+import zipfile
+from datetime import date
+from unittest.mock import patch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from PIL import Image
+from flask import request
+
+import app as app_module
+from app import app, db, User, Prediction, LabBooking, quality_gate, _collect_batch_uploads
+
+
+def _png(seed=0):
+    pixels = np.random.default_rng(seed).integers(40, 220, (64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _user(email, user_type):
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            user = User(email=email, name=email.split('@')[0], user_type=user_type)
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+        return user.id
+
+
+def _collect(data, **config):
+    saved = {k: app.config[k] for k in config}
+    app.config.update(config)
+    try:
+        with app.test_request_context('/lab/analyze_batch', method='POST', data=data,
+                                      content_type='multipart/form-data'):
+            request.max_content_length = app.config['BATCH_MAX_CONTENT_LENGTH']
+            return _collect_batch_uploads()
+    finally:
+        app.config.update(saved)
+
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_multipart_uploads_map_patients_and_bookings():
+    uploads = _collect({
+        'images': [(io.BytesIO(b'a'), 'a.png'), (io.BytesIO(b'b'), 'b.png')],
+        'patient_ids': ['5', ''],
+        'booking_ids': ['9'],
+        'patient_id': '7',
+    })
+    print(f"Uploads: {[(u['name'], u['patient_id'], u['booking_id']) for u in uploads]}")
+    assert [(u['name'], u['data'], u['patient_id'], u['booking_id']) for u in uploads] == [
+        ('a.png', b'a', '5', '9'), ('b.png', b'b', '7', None)]
+
+
+def test_zip_uploads_use_form_or_archived_manifest():
+    archive = _zip({'eyes/a.png': b'a', 'b.jpg': b'b', 'notes.txt': b'x',
+                    'manifest.json': json.dumps({'eyes/a.png': {'patient_id': 3, 'booking_id': 4}, 'b.jpg': 6})})
+    uploads = _collect({'archive': (archive, 'scans.zip')})
+    assert [(u['name'], u['patient_id'], u['booking_id']) for u in uploads] == [('a.png', 3, 4), ('b.jpg', 6, None)]
+
+    # A manifest form field takes precedence over manifest.json
+    archive = _zip({'a.png': b'a', 'manifest.json': json.dumps({'a.png': 3})})
+    uploads = _collect({'archive': (archive, 'scans.zip'), 'manifest': json.dumps({'a.png': 8})})
+    assert uploads[0]['patient_id'] == 8
+
+
+def test_batch_limits_are_enforced():
+    too_many = {'images': [(io.BytesIO(b'x'), f'{i}.png') for i in range(3)], 'patient_id': '1'}
+    with pytest.raises(ValueError, match='Too many images'):
+        _collect(too_many, BATCH_MAX_IMAGES=2)
+    with pytest.raises(ValueError, match='size limit'):
+        _collect({'archive': (_zip({'big.png': b'x' * 64}), 'scans.zip')}, MAX_CONTENT_LENGTH=32)
+
+
+def test_batch_endpoint_streams_results_and_rejects_only_bad_items():
+    lab_id = _user('test_batch_lab@example.com', 'lab')
+    patient_id = _user('test_batch_patient@example.com', 'patient')
+    with app.app_context():
+        booking = LabBooking(patient_id=patient_id, lab_id=lab_id, date=date.today(), status='confirmed')
+        db.session.add(booking)
+        db.session.commit()
+        booking_id = booking.id
+
+    client = app.test_client()
+    client.post('/login', json={'email': 'test_batch_lab@example.com', 'password': 'password'})
+    saved_batch_size = app.config['INFERENCE_MAX_BATCH_SIZE']
+    app.config['INFERENCE_MAX_BATCH_SIZE'] = 2  # three valid images -> two committed chunks
+    try:
+        response = client.post('/lab/analyze_batch', data={
+            'images': [(io.BytesIO(_png(i)), f'eye_{i}.png') for i in range(5)] + [(io.BytesIO(b'x'), 'notes.txt')],
+            'patient_ids': [str(patient_id), str(patient_id), '999999999', str(patient_id), str(patient_id), ''],
+            'booking_ids': [str(booking_id), '', '', 'not-a-number', '', ''],
+            'patient_id': str(patient_id),
+        }, content_type='multipart/form-data')
+    finally:
+        app.config['INFERENCE_MAX_BATCH_SIZE'] = saved_batch_size
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    print(f"Lines: {lines}")
+
+    by_name = {line['filename']: line for line in lines[:-1]}
+    assert by_name['eye_2.png']['error'] == 'Unknown patient'
+    assert by_name['eye_3.png']['error'].startswith('Unknown booking')
+    assert by_name['notes.txt']['error'] == 'Invalid file type'
+    ok = [by_name[f'eye_{i}.png'] for i in (0, 1, 4)]
+    assert all(line['status'] == 'ok' for line in ok)
+    assert lines[-1] == {'status': 'done', 'total': 6, 'succeeded': 3, 'failed': 3}
+
+    with app.app_context():
+        assert db.session.get(LabBooking, booking_id).status == 'completed'
+        created = [db.session.get(Prediction, line['prediction']['id']) for line in ok]
+        assert all(p is not None and p.patient_id == patient_id and p.lab_id == lab_id for p in created)
+        for p in created:
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], p.image_path))
+            db.session.delete(p)
+        db.session.delete(db.session.get(LabBooking, booking_id))
+        db.session.commit()
+
+
+def _predictions_dir():
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'predictions')
+    os.makedirs(path, exist_ok=True)
+    return set(os.listdir(path))
+
+
+def test_failed_batch_items_leave_no_uploads():
+    _user('test_batch_lab@example.com', 'lab')
+    patient_id = _user('test_batch_patient@example.com', 'patient')
+    client = app.test_client()
+    client.post('/login', json={'email': 'test_batch_lab@example.com', 'password': 'password'})
+    before = _predictions_dir()
+
+    dark = io.BytesIO()
+    Image.fromarray(np.full((64, 64, 3), 2, dtype=np.uint8)).save(dark, 'PNG')
+    quality_gate.reject_poor = True
+    try:
+        response = client.post('/lab/analyze_batch', data={
+            'images': [(io.BytesIO(b'not an image'), 'broken.png'), (io.BytesIO(dark.getvalue()), 'dark.png')],
+            'patient_id': str(patient_id),
+        }, content_type='multipart/form-data')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    finally:
+        quality_gate.reject_poor = False
+    print(f"Lines: {lines}")
+    assert lines[-1] == {'status': 'done', 'total': 2, 'succeeded': 0, 'failed': 2}
+    assert _predictions_dir() == before
+
+    app_module.model_warmup.wait(app.config['MODEL_READY_TIMEOUT'])
+    with patch.object(app_module.inference_runtime, 'run_batch', side_effect=RuntimeError("simulated inference failure")):
+        response = client.post('/lab/analyze_batch', data={
+            'images': [(io.BytesIO(_png(i)), f'eye_{i}.png') for i in range(2)],
+            'patient_id': str(patient_id),
+        }, content_type='multipart/form-data')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]['failed'] == 2 and 'simulated' in lines[0]['error']
+    assert _predictions_dir() == before
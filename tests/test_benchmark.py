@@ -0,0 +1,37 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import summarize, compare, StageTimer, RSSSampler, STAGES
+
+
+def _report(forward_p50, throughput):
+    stages = {stage: None for stage in STAGES}
+    stages['forward'] = {'p50': forward_p50, 'p95': forward_p50, 'p99': forward_p50, 'mean': forward_p50, 'count': 4}
+    return {'runs': [{'backend': 'eager', 'threads': 1, 'batch_size': 8, 'stages': stages,
+                      'throughput_images_per_sec': throughput}]}
+
+
+def test_summarize_percentiles():
+    stats = summarize(list(range(1, 101)))
+    print(f"Stats: {stats}")
+    assert stats['p50'] == 50.5 and stats['count'] == 100
+    assert stats['p95'] <= stats['p99'] <= 100
+    assert summarize([]) is None
+
+
+def test_compare_flags_regressions_beyond_budget():
+    baseline = _report(100.0, 20.0)
+    changes, regressions = compare(_report(105.0, 19.5), baseline, max_regression_pct=10)
+    assert len(changes) == 2 and regressions == []
+
+    changes, regressions = compare(_report(130.0, 15.0), baseline, max_regression_pct=10)
+    print(f"Regressions: {regressions}")
+    assert {r['metric'] for r in regressions} == {'forward.p50', 'throughput'}
+
+
+def test_stage_timer_records_latency_and_rss():
+    with RSSSampler() as sampler:
+        timer = StageTimer(sampler)
+        assert timer.run('decode', lambda: bytearray(8 * 2 ** 20)) is not None
+    assert len(timer.timings['decode']) == 1 and sampler.peaks['decode'] > 0
@@ -0,0 +1,152 @@
+import sys
+import os
+import io
+from datetime import date
+from unittest.mock import patch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+import app as app_module
+from app import app, db, User, Prediction, LabBooking, summarize_bilateral, quality_gate
+
+
+def _eye(cls, confidence, uncertainty=0.01):
+    return {'class': cls, 'confidence': confidence, 'uncertainty': uncertainty}
+
+
+def test_more_severe_eye_decides_and_refers():
+    summary = summarize_bilateral({'left': _eye('cataract', 0.95), 'right': _eye('glaucoma', 0.6, 0.04)})
+    print(f"Summary: {summary}")
+    assert summary['overall_class'] == 'glaucoma' and summary['worst_eye'] == 'right'
+    assert summary['overall_confidence'] == 0.6
+    assert summary['referral_recommended'] and not summary['concordant'] and not summary['bilateral_finding']
+    assert summary['max_uncertainty'] == 0.04
+
+
+def test_severity_tie_goes_to_the_more_confident_eye():
+    summary = summarize_bilateral({'left': _eye('glaucoma', 0.7), 'right': _eye('diabetic_retinopathy', 0.8)})
+    assert summary['overall_class'] == 'diabetic_retinopathy' and summary['worst_eye'] == 'right'
+
+
+def test_concordance_and_low_severity_findings():
+    both_red = summarize_bilateral({'left': _eye('redness', 0.8, None), 'right': _eye('redness', 0.9, None)})
+    assert both_red['concordant'] and both_red['bilateral_finding']
+    assert not both_red['referral_recommended'] and both_red['max_uncertainty'] is None
+    both_normal = summarize_bilateral({'left': _eye('normal', 0.9), 'right': _eye('normal', 0.9)})
+    assert both_normal['concordant'] and not both_normal['bilateral_finding']
+
+
+def _png(value=None, seed=0):
+    if value is None:
+        pixels = np.random.default_rng(seed).integers(40, 220, (64, 64, 3), dtype=np.uint8)
+    else:
+        pixels = np.full((64, 64, 3), value, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def _client():
+    with app.app_context():
+        ids = {}
+        for email, user_type in (('test_bilateral_lab@example.com', 'lab'),
+                                 ('test_bilateral_patient@example.com', 'patient')):
+            user = User.query.filter_by(email=email).first()
+            if not user:
+                user = User(email=email, name=email.split('@')[0], user_type=user_type)
+                user.set_password('password')
+                db.session.add(user)
+                db.session.commit()
+            ids[user_type] = user.id
+    client = app.test_client()
+    client.post('/login', json={'email': 'test_bilateral_lab@example.com', 'password': 'password'})
+    return client, ids
+
+
+def _predictions_dir():
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'predictions')
+    os.makedirs(path, exist_ok=True)
+    return set(os.listdir(path))
+
+
+def test_bilateral_endpoint_commits_both_eyes_together():
+    client, ids = _client()
+    with app.app_context():
+        booking = LabBooking(patient_id=ids['patient'], lab_id=ids['lab'], date=date.today(), status='confirmed')
+        db.session.add(booking)
+        db.session.commit()
+        booking_id = booking.id
+
+    response = client.post('/lab/analyze_bilateral', data={
+        'patient_id': str(ids['patient']), 'booking_id': str(booking_id),
+        'left_image': (_png(seed=1), 'left.png'), 'right_image': (_png(seed=2), 'right.png'),
+    }, content_type='multipart/form-data')
+    body = response.get_json()
+    print(f"Response: {body}")
+    assert response.status_code == 200
+    assert body['summary']['patient_id'] == ids['patient'] and body['summary']['worst_eye'] in ('left', 'right')
+
+    with app.app_context():
+        rows = {eye: db.session.get(Prediction, p['id']) for eye, p in body['predictions'].items()}
+        assert {eye: p.eye for eye, p in rows.items()} == {'left': 'left', 'right': 'right'}
+        assert db.session.get(LabBooking, booking_id).status == 'completed'
+        for p in rows.values():
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], p.image_path))
+            db.session.delete(p)
+        db.session.delete(db.session.get(LabBooking, booking_id))
+        db.session.commit()
+
+
+def test_failure_on_one_eye_stores_neither():
+    client, ids = _client()
+    before_files = _predictions_dir()
+    with app.app_context():
+        before_rows = Prediction.query.filter_by(patient_id=ids['patient']).count()
+
+    real_build = app_module.build_prediction
+
+    def build_left_only(*args, **kwargs):
+        if kwargs.get('eye') == 'right':
+            raise RuntimeError("simulated failure on the right eye")
+        return real_build(*args, **kwargs)
+
+    with patch('app.build_prediction', side_effect=build_left_only):
+        response = client.post('/lab/analyze_bilateral', data={
+            'patient_id': str(ids['patient']),
+            'left_image': (_png(seed=1), 'left.png'), 'right_image': (_png(seed=2), 'right.png'),
+        }, content_type='multipart/form-data')
+    assert response.status_code == 500
+    with app.app_context():
+        assert Prediction.query.filter_by(patient_id=ids['patient']).count() == before_rows
+    assert _predictions_dir() == before_files
+
+
+def test_missing_eye_and_rejected_uploads_leave_no_files():
+    client, ids = _client()
+    before = _predictions_dir()
+
+    missing = client.post('/lab/analyze_bilateral', data={
+        'patient_id': str(ids['patient']), 'left_image': (_png(), 'left.png'),
+    }, content_type='multipart/form-data')
+    assert missing.status_code == 400 and 'right_image' in missing.get_json()['error']
+
+    undecodable = client.post('/lab/analyze_bilateral', data={
+        'patient_id': str(ids['patient']),
+        'left_image': (_png(), 'left.png'), 'right_image': (io.BytesIO(b'not an image'), 'right.png'),
+    }, content_type='multipart/form-data')
+    print(f"Undecodable: {undecodable.get_json()}")
+    assert undecodable.status_code == 400 and 'right' in undecodable.get_json()['error']
+
+    quality_gate.reject_poor = True
+    try:
+        dark = client.post('/lab/analyze_bilateral', data={
+            'patient_id': str(ids['patient']),
+            'left_image': (_png(), 'left.png'), 'right_image': (_png(value=2), 'right.png'),
+        }, content_type='multipart/form-data')
+    finally:
+        quality_gate.reject_poor = False
+    assert dark.status_code == 422 and dark.get_json()['eye'] == 'right'
+    assert _predictions_dir() == before
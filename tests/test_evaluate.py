@@ -0,0 +1,34 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from evaluate import expected_calibration_error, classification_metrics, check_budget
+
+
+def test_ece_is_zero_when_confidence_matches_accuracy():
+    assert expected_calibration_error([1.0, 1.0], [True, True]) == 0.0
+    # 80% confident, right half the time -> 0.3 gap
+    assert abs(expected_calibration_error([0.8] * 4, [1, 1, 0, 0]) - 0.3) < 1e-9
+
+
+def test_confusion_matrix_and_recall():
+    probs = np.eye(6)[[0, 0, 2, 3]]
+    metrics = classification_metrics([0, 1, 2, 3], probs, [5.0, 5.0, 5.0, 5.0])
+    print(f"Metrics: {metrics}")
+    assert metrics['accuracy'] == 0.75
+    assert metrics['confusion_matrix'][1][0] == 1
+    assert metrics['per_class_recall']['cataract'] == 1.0 and metrics['per_class_recall']['diabetic_retinopathy'] == 0.0
+    assert metrics['per_class_recall']['wrinkles'] is None
+    assert metrics['latency_ms']['p50'] == 5.0
+
+
+def test_budget_gate():
+    def report(acc, glaucoma):
+        return {'models': {'ensemble': {'accuracy': acc, 'per_class_recall': {'glaucoma': glaucoma}}}}
+
+    baseline = report(0.90, 0.95)
+    assert check_budget(report(0.895, 0.95), baseline, accuracy_budget=1.0) == []
+    assert len(check_budget(report(0.87, 0.95), baseline, accuracy_budget=1.0)) == 1
+    violations = check_budget(report(0.90, 0.80), baseline, accuracy_budget=1.0, recall_budget=5)
+    assert violations and 'glaucoma' in violations[0]
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from heatmap_render import (JET_LUT, COLORMAPS, apply_colormap, upsample_bilinear, gradcam_panels,
+                            save_gradcam_figure, render_gradcam_figure, render_overlay, PANEL_SIZE, TITLE_HEIGHT,
+                            MARGIN)
+
+
+def test_jet_lut_endpoints():
+    # Dark blue -> cyan -> yellow -> dark red, like matplotlib's jet
+    assert JET_LUT.shape == (256, 3)
+    assert tuple(JET_LUT[0]) == (0, 0, 128) and tuple(JET_LUT[-1]) == (128, 0, 0)
+    assert tuple(apply_colormap(np.array([[0.5]]))[0, 0]) == tuple(JET_LUT[128])
+
+
+def test_upsample_bilinear_keeps_corners_and_interpolates():
+    grid = np.array([[0.0, 1.0], [1.0, 2.0]], dtype=np.float32)
+    up = upsample_bilinear(grid, 5, 5)
+    print(f"Upsampled:\n{up}")
+    assert up.shape == (5, 5)
+    assert up[0, 0] == 0.0 and up[-1, -1] == 2.0 and up[0, -1] == 1.0
+    assert np.isclose(up[2, 2], 1.0)
+
+
+def test_panels_and_figure_on_disk(tmp_path):
+    pixels = np.full((227, 227, 3), 100, dtype=np.uint8)
+    cam = np.zeros((13, 13), dtype=np.float32)
+    cam[6, 6] = 1.0
+    original, heatmap, overlay = gradcam_panels(pixels, cam)
+    assert original.shape == heatmap.shape == overlay.shape == (227, 227, 3)
+    assert tuple(heatmap[113, 113]) == tuple(JET_LUT[-1]) and tuple(heatmap[0, 0]) == tuple(JET_LUT[0])
+    assert tuple(overlay[0, 0]) == (40, 40, 40 + int(0.6 * 128))
+
+    for fmt in ('png', 'webp'):
+        path = save_gradcam_figure(pixels, cam, str(tmp_path / f'heatmap.{fmt}'))
+        with Image.open(path) as img:
+            print(f"{fmt}: {img.format} {img.size}")
+            assert img.format == fmt.upper() and img.size[1] > PANEL_SIZE + TITLE_HEIGHT - 1
+
+
+def test_overlay_opacity_and_colormap():
+    pixels = np.full((40, 40, 3), 100, dtype=np.uint8)
+    cam = np.ones((6, 6), dtype=np.float32)
+    assert np.array_equal(np.asarray(render_overlay(pixels, cam, opacity=0.0)), pixels)
+    hot = np.asarray(render_overlay(pixels, cam, opacity=1.0, colormap='hot'))
+    print(f"Hot at 1.0: {hot[0, 0]}")
+    assert hot.shape == (40, 40, 3) and tuple(hot[0, 0]) == tuple(COLORMAPS['hot'][-1])
+    # Default opacity matches the overlay panel of the 3-panel figure
+    assert np.array_equal(np.asarray(render_overlay(pixels, cam)), gradcam_panels(pixels, cam)[2])
+
+
+def test_non_square_images_are_letterboxed_not_stretched():
+    pixels = np.full((300, 600, 3), 100, dtype=np.uint8)  # landscape fundus photo
+    figure = np.asarray(render_gradcam_figure(pixels, np.zeros((6, 6), dtype=np.float32)))
+    first_panel = figure[TITLE_HEIGHT:TITLE_HEIGHT + PANEL_SIZE, MARGIN:MARGIN + PANEL_SIZE]
+    rows = np.where((first_panel != 255).any(axis=(1, 2)))[0]
+    print(f"Image rows in panel: {rows.min()}..{rows.max()}")
+    # 470 x 235 image centered in the 470 x 470 panel, white above and below
+    assert rows.max() - rows.min() + 1 == PANEL_SIZE // 2
+    assert tuple(first_panel[0, 0]) == (255, 255, 255) and tuple(first_panel[PANEL_SIZE // 2, 0]) == (100, 100, 100)
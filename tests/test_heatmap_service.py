@@ -0,0 +1,187 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import threading
+
+import numpy as np
+import torch
+import torchvision.models as models
+from PIL import Image
+
+from inference_service import InferenceEngine, InferenceRuntime
+import pytest
+
+from preprocessing import decode_image, pixels_to_tensor
+from heatmap_service import LazyHeatmaps, RenderCache, heatmap_relpath, cam_relpath, member_cams_relpath, combine_maps
+
+CLASSES = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal', 'redness', 'wrinkles']
+
+
+def _heatmaps(tmp_path, **kwargs):
+    torch.manual_seed(0)
+    alexnet = models.alexnet(num_classes=len(CLASSES)).eval()
+    resnet = models.resnet18(num_classes=len(CLASSES)).eval()  # stands in for ResNet50 (same head)
+    engine = InferenceEngine({'alexnet': alexnet, 'resnet50': resnet}, capture=('alexnet',), cam=('resnet50',))
+    runtime = InferenceRuntime('v1', engine.models, engine, engine.run_batch)
+    os.makedirs(tmp_path / 'predictions')
+    pixels = np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(tmp_path / 'predictions' / 'scan_1.png')
+    return LazyHeatmaps(lambda: runtime, str(tmp_path), CLASSES, **kwargs)
+
+
+def _analyze(heatmaps, image_path):
+    """The analysis pass: the engine returns ResNet's CAMs, which are stored right away"""
+    pixels = decode_image(os.path.join(heatmaps.upload_folder, image_path))
+    result = heatmaps.get_runtime().run_batch(pixels_to_tensor(pixels).unsqueeze(0))[0]
+    return heatmaps.save_member_cams(image_path, result['cams'])
+
+
+def test_concurrent_views_share_one_render(tmp_path):
+    heatmaps = _heatmaps(tmp_path, save_figure=True)
+    image_path = os.path.join('predictions', 'scan_1.png')
+    barrier = threading.Barrier(4)
+    paths = []
+
+    def view():
+        barrier.wait()
+        paths.append(heatmaps.ensure(7, image_path, 'glaucoma'))
+
+    threads = [threading.Thread(target=view) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(60)
+
+    stats = heatmaps.stats()
+    print(f"Paths: {paths}, stats: {stats}")
+    expected = {'heatmap_path': heatmap_relpath(image_path), 'cam_path': cam_relpath(image_path)}
+    assert paths == [expected] * 4
+    assert all(os.path.exists(tmp_path / p) for p in expected.values())
+    assert stats['rendered'] == 1 and stats['coalesced'] + stats['reused'] == 3
+    # Stored paths are returned as is
+    assert heatmaps.ensure(7, image_path, 'glaucoma', **expected) == expected
+    assert heatmaps.stats()['rendered'] == 1
+
+
+def test_all_class_maps_are_stored_as_float16(tmp_path):
+    heatmaps = _heatmaps(tmp_path)
+    image_path = os.path.join('predictions', 'scan_1.png')
+    assert _analyze(heatmaps, image_path) == member_cams_relpath(image_path)
+    assert set(heatmaps.load_member_cams(image_path)) == {'resnet50'}
+    paths = heatmaps.ensure(3, image_path, 'normal')
+    stored = np.load(tmp_path / paths['cam_path'])
+    print(f"Stored maps: {stored.dtype} {stored.shape}, {os.path.getsize(tmp_path / paths['cam_path'])} bytes")
+    # AlexNet's 6x6 GradCAM is upsampled onto ResNet's 8x8 CAM grid
+    assert stored.dtype == np.float16 and stored.shape == (len(CLASSES), 8, 8)
+    assert set(heatmaps.class_maps(paths['cam_path'])) == set(CLASSES)
+
+    # Only the maps are stored by default; images are rendered on request
+    assert paths['heatmap_path'] is None and not os.path.exists(tmp_path / 'heatmaps')
+    figure = heatmaps.class_figure(image_path, paths['cam_path'], 'glaucoma')
+    with Image.open(io.BytesIO(figure)) as img:
+        assert img.format == 'PNG' and img.size[0] > img.size[1]
+    assert heatmaps.stats()['rendered'] == 1  # switching classes runs no model
+
+
+def test_overlay_variants_are_rendered_once_and_cached(tmp_path):
+    heatmaps = _heatmaps(tmp_path)
+    image_path = os.path.join('predictions', 'scan_1.png')
+    cam_path = heatmaps.ensure(3, image_path, 'normal')['cam_path']
+
+    small = heatmaps.overlay(image_path, cam_path, 'normal', size=96, opacity=0.5, colormap='viridis')
+    again = heatmaps.overlay(image_path, cam_path, 'normal', size=96, opacity=0.5, colormap='viridis')
+    large = heatmaps.overlay(image_path, cam_path, 'normal', size=512, image_format='webp')
+    with Image.open(io.BytesIO(small)) as img:
+        assert img.format == 'PNG' and img.size == (96, 96)
+    with Image.open(io.BytesIO(large)) as img:
+        assert img.format == 'WEBP' and img.size == (512, 512)
+    assert again is small
+    cache = heatmaps.stats()['render_cache']
+    print(f"Render cache: {cache}")
+    assert cache['hits'] == 1 and cache['misses'] == 2 and cache['entries'] == 2
+
+    for bad in ({'size': 4096}, {'opacity': 1.5}, {'colormap': 'rainbow'}):
+        with pytest.raises(ValueError):
+            heatmaps.overlay(image_path, cam_path, 'normal', **bad)
+
+
+def test_render_cache_evicts_least_recently_used_by_count_and_bytes():
+    cache = RenderCache(max_entries=2, max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'
+    cache.put('c', b'1234')  # over the entry limit: 'b' is the least recently used
+    assert cache.get('b') is None and cache.get('a') is not None
+    cache.put('d', b'12345678')  # over the byte limit: only 'd' fits
+    assert cache.get('a') is None and cache.get('c') is None
+    cache.put('huge', b'x' * 11)  # larger than the whole cache: not stored
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert stats['entries'] == 1 and stats['bytes'] == 8 and stats['evictions'] == 3
+
+
+def test_missing_image_or_models_give_no_heatmap(tmp_path):
+    heatmaps = _heatmaps(tmp_path)
+    assert heatmaps.ensure(8, os.path.join('predictions', 'gone.png'), 'normal') is None
+    assert heatmaps.stats()['failed'] == 1
+
+    loading = LazyHeatmaps(lambda: None, str(tmp_path), CLASSES)
+    assert loading.ensure(9, os.path.join('predictions', 'scan_1.png'), 'normal') is None
+    assert loading.stats()['failed'] == 0
+
+
+def test_combined_maps_follow_ensemble_weights():
+    alexnet = np.zeros((2, 2, 2), dtype=np.float32)
+    alexnet[:, 0, 0] = 1.0
+    resnet = np.zeros((2, 4, 4), dtype=np.float32)
+    resnet[:, 3, 3] = 1.0
+    combined = combine_maps({'alexnet': alexnet, 'resnet50': resnet})
+    print(f"Combined corners: {combined[0, 0, 0]:.3f} / {combined[0, 3, 3]:.3f}")
+    assert combined.shape == (2, 4, 4)
+    # 0.7 vs 0.3 before renormalization: the AlexNet hot spot dominates
+    assert combined[0, 0, 0] == 1.0 and abs(combined[0, 3, 3] - 0.3 / 0.7) < 1e-6
+    assert np.array_equal(combine_maps({'alexnet': resnet}), resnet)
+
+
+def test_without_analysis_cams_only_alexnet_is_explained(tmp_path):
+    # e.g. a cascade run where ResNet50 was never called: no second forward on first view
+    heatmaps = _heatmaps(tmp_path)
+    image_path = os.path.join('predictions', 'scan_1.png')
+    paths = heatmaps.ensure(4, image_path, 'normal')
+    assert np.load(tmp_path / paths['cam_path']).shape == (len(CLASSES), 6, 6)
+
+
+def test_maps_of_a_replaced_model_version_are_not_mixed_with_the_serving_weights(tmp_path):
+    heatmaps = _heatmaps(tmp_path)
+    image_path = os.path.join('predictions', 'scan_1.png')
+    # No stored analysis maps: the serving AlexNet must not explain an older model's prediction
+    assert heatmaps.ensure(5, image_path, 'normal', model_version='v0') is None
+
+    _analyze(heatmaps, image_path)
+    paths = heatmaps.ensure(5, image_path, 'normal', model_version='v0')
+    print(f"Paths: {paths}, stats: {heatmaps.stats()}")
+    assert paths['cam_path'] == cam_relpath(image_path, model_version='v0') and '.v0' in paths['cam_path']
+    # Only the ResNet CAMs stored at analysis time, no AlexNet GradCAM from the serving weights
+    stored = combine_maps(heatmaps.load_member_cams(image_path)).astype(np.float16)
+    assert np.array_equal(np.load(tmp_path / paths['cam_path']), stored)
+    assert heatmaps.stats()['version_mismatch'] == 2
+
+    current = heatmaps.ensure(5, image_path, 'normal', model_version='v1')
+    assert current['cam_path'] != paths['cam_path']
+
+
+def test_duplicate_upload_shares_the_rendered_maps(tmp_path):
+    heatmaps = _heatmaps(tmp_path)
+    first = os.path.join('predictions', 'scan_1.png')
+    duplicate = os.path.join('predictions', 'scan_2.png')
+    (tmp_path / duplicate).write_bytes((tmp_path / first).read_bytes())
+    # A result cache hit records the first upload's files on the duplicate's prediction
+    shared = heatmaps.shared_paths(first, 'v1')
+
+    paths = heatmaps.ensure(11, duplicate, 'normal', cam_path=shared['cam_path'], model_version='v1')
+    assert paths['cam_path'] == shared['cam_path'] == cam_relpath(first, 'v1')
+    assert heatmaps.ensure(10, first, 'normal', model_version='v1') == paths
+    print(f"Stats: {heatmaps.stats()}")
+    assert heatmaps.stats()['rendered'] == 1
@@ -0,0 +1,60 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from image_quality import assess_quality, detect_fundus_circle, luminance, QualityGate, ImageQualityRejected
+
+
+def _fundus(brightness=1.0, blur=0):
+    """Synthetic fundus: textured disc on a black surround"""
+    rng = np.random.default_rng(0)
+    size = 227
+    yy, xx = np.mgrid[:size, :size]
+    disc = (yy - 113) ** 2 + (xx - 113) ** 2 <= 100 ** 2
+    texture = rng.integers(60, 200, size=(size, size, 3))
+    pixels = np.where(disc[..., None], texture, 0).astype(np.float32) * brightness
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(blur))
+    return np.asarray(image)
+
+
+def test_sharp_fundus_is_good_and_circle_detected():
+    report = assess_quality(_fundus())
+    print(f"Report: {report}")
+    assert report['grade'] == 'Good' and report['reasons'] == []
+    fundus = report['metrics']['fundus']
+    assert fundus['detected'] and abs(fundus['radius'] - 100) < 3
+    assert report['ms'] >= 0
+
+
+def test_blurred_and_dark_captures_are_poor():
+    blurred = assess_quality(_fundus(blur=6))
+    dark = assess_quality(_fundus(brightness=0.15))
+    print(f"Blurred: {blurred['reasons']}, dark: {dark['reasons']}")
+    assert blurred['grade'] == 'Poor' and 'blurred' in blurred['reasons']
+    assert dark['grade'] == 'Poor' and 'underexposed' in dark['reasons']
+
+
+def test_external_eye_photo_has_no_fundus_field():
+    pixels = np.random.default_rng(1).integers(40, 220, size=(227, 227, 3)).astype(np.uint8)
+    assert not detect_fundus_circle(luminance(pixels))['detected']
+    assert assess_quality(pixels)['grade'] == 'Good'
+
+
+def test_gate_counts_grades_and_rejects_only_when_enabled():
+    poor = _fundus(blur=6)
+    assert not QualityGate().should_reject(QualityGate().assess(poor))
+
+    gate = QualityGate(reject_poor=True)
+    good_report, poor_report = gate.assess(_fundus()), gate.assess(poor)
+    assert not gate.should_reject(good_report)
+    assert gate.should_reject(poor_report)
+    stats = gate.stats()
+    print(f"Stats: {stats}")
+    assert stats['assessed'] == 2 and stats['rejected'] == 1
+    assert stats['grades'] == {'Good': 1, 'Adequate': 0, 'Poor': 1}
+    assert 'blurred' in str(ImageQualityRejected(poor_report))
@@ -0,0 +1,165 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from inference_service import InferenceEngine
+from model.architectures import gradcam_from_activations, gradcam_all_classes, cam_from_activations, split_feature_head
+
+
+def _alexnet(seed=0):
+    torch.manual_seed(seed)
+    m = models.alexnet(weights=None)
+    m.classifier[6] = nn.Linear(m.classifier[6].in_features, 6)
+    return m.eval()
+
+
+class CountingNet(nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(1)
+        self.fc = nn.Linear(3 * 227 * 227, 6)
+        self.calls = 0
+
+    def forward(self, x):
+        self.calls += 1
+        return self.fc(x.flatten(1))
+
+
+def test_single_pass_matches_legacy_ensemble_and_uncertainty():
+    alexnet, other = _alexnet(), CountingNet().eval()
+    engine = InferenceEngine({'alexnet': alexnet, 'resnet50': other})
+    x = torch.randn(2, 3, 227, 227)
+
+    results = engine.run_batch(x)
+    assert other.calls == 1
+
+    with torch.no_grad():
+        p_a = torch.softmax(alexnet(x), dim=1)
+        p_o = torch.softmax(other(x), dim=1)
+    for i, res in enumerate(results):
+        expected_mean = (p_a[i:i + 1] * 0.7 + p_o[i:i + 1] * 0.3) / 1.0
+        assert torch.allclose(res['mean'], expected_mean, atol=1e-6)
+        expected_unc = torch.mean(torch.var(torch.stack([p_a[i:i + 1], p_o[i:i + 1]]), dim=0)).item()
+        assert abs(res['uncertainty'] - expected_unc) < 1e-7
+        assert res['activations']['alexnet'].shape == (1, 256, 6, 6)
+
+
+def test_gradcam_from_captured_activations_matches_hooked_backward():
+    alexnet = _alexnet()
+    x = torch.randn(1, 3, 227, 227)
+    result = InferenceEngine({'alexnet': alexnet}).run_batch(x)[0]
+    assert result['uncertainty'] is None
+
+    # Legacy path: hooks on features[12] and a full backward pass
+    acts, grads = [], []
+    layer = alexnet.features[12]
+    h1 = layer.register_forward_hook(lambda m, i, o: acts.append(o.detach()))
+    h2 = layer.register_full_backward_hook(lambda m, gi, go: grads.append(go[0]))
+    xg = x.clone().requires_grad_(True)
+    alexnet(xg)[0, 2].backward()
+    h1.remove()
+    h2.remove()
+    weights = torch.mean(grads[0], dim=(2, 3), keepdim=True)
+    legacy = torch.relu(torch.sum(weights * acts[0], dim=1)).squeeze().numpy()
+    if legacy.max() - legacy.min() > 1e-8:
+        legacy = (legacy - legacy.min()) / (legacy.max() - legacy.min())
+
+    head = InferenceEngine({'alexnet': alexnet}).head('alexnet')
+    cam = gradcam_from_activations(head, result['activations']['alexnet'], 2)
+    assert cam.shape == legacy.shape
+    assert abs(cam - legacy).max() < 1e-5
+
+
+def test_all_classes_gradcam_matches_per_class_backward():
+    alexnet = _alexnet()
+    engine = InferenceEngine({'alexnet': alexnet})
+    result = engine.run_batch(torch.randn(1, 3, 227, 227))[0]
+    head = engine.head('alexnet')
+    maps = gradcam_all_classes(head, result['activations']['alexnet'])
+    print(f"All-classes maps: {maps.shape}")
+    assert maps.shape == (6, 6, 6)
+    for k in range(6):
+        assert abs(maps[k] - gradcam_from_activations(head, result['activations']['alexnet'], k)).max() < 1e-5
+    assert gradcam_all_classes(head, result['activations']['alexnet'], [4, 1]).shape == (2, 6, 6)
+
+
+class FixedNet(nn.Module):
+    """Returns fixed logits per row, counting how many images it saw"""
+
+    def __init__(self, logits):
+        super().__init__()
+        self.logits = logits
+        self.images_seen = 0
+
+    def forward(self, x):
+        self.images_seen += x.shape[0]
+        return self.logits[:x.shape[0]]
+
+
+def test_cascade_skips_expensive_model_when_cheap_model_is_confident():
+    # Row 0: confident 'normal' (idx 3), row 1: unsure, row 2: confident 'glaucoma' (sensitive, idx 2)
+    cheap_logits = torch.full((3, 6), -10.0)
+    cheap_logits[0, 3] = 10.0
+    cheap_logits[1] = 0.0
+    cheap_logits[2, 2] = 10.0
+    cheap = FixedNet(cheap_logits)
+    expensive = FixedNet(torch.zeros(3, 6))
+    engine = InferenceEngine({'alexnet': cheap, 'resnet50': expensive}, capture=(),
+                             mode='cascade', cascade_threshold=0.9, sensitive_classes=[2])
+
+    results = engine.run_batch(torch.randn(3, 3, 8, 8))
+    assert expensive.images_seen == 2
+    assert results[0]['models_used'] == ['alexnet']
+    assert results[0]['uncertainty'] is None
+    assert results[0]['mean'].argmax().item() == 3
+    assert results[1]['models_used'] == ['alexnet', 'resnet50']
+    assert results[2]['models_used'] == ['alexnet', 'resnet50']
+    assert results[2]['uncertainty'] is not None
+
+
+def test_cascade_matches_full_ensemble_when_everything_escalates():
+    alexnet, other = _alexnet(), CountingNet().eval()
+    x = torch.randn(2, 3, 227, 227)
+    full = InferenceEngine({'alexnet': alexnet, 'resnet50': other}).run_batch(x)
+    cascade = InferenceEngine({'alexnet': alexnet, 'resnet50': other}, mode='cascade',
+                              cascade_threshold=1.01).run_batch(x)
+    for f, c in zip(full, cascade):
+        assert c['models_used'] == ['alexnet', 'resnet50']
+        assert torch.allclose(f['mean'], c['mean'], atol=1e-6)
+
+
+def test_forward_only_cam_matches_gradcam_for_pooled_linear_head():
+    torch.manual_seed(0)
+    resnet = models.resnet18(num_classes=6).eval()
+    body, head = split_feature_head(resnet)
+    with torch.no_grad():
+        activation = body(torch.randn(1, 3, 227, 227))
+    cam = cam_from_activations(head, activation)
+    print(f"CAM maps: {cam.shape}")
+    # With global pooling + one linear layer, GradCAM's channel weights are fc.weight / (h * w)
+    assert cam.shape == (6, 8, 8)
+    assert abs(cam - gradcam_all_classes(head, activation)).max() < 1e-5
+    assert abs(cam_from_activations(head, activation, [3])[0] - cam[3]).max() < 1e-6
+
+    alexnet_head = split_feature_head(_alexnet())[1]
+    with pytest.raises(ValueError):  # AlexNet's classifier has hidden layers
+        cam_from_activations(alexnet_head, torch.randn(1, 256, 6, 6))
+
+
+def test_engine_computes_cams_in_the_analysis_pass():
+    torch.manual_seed(0)
+    resnet = models.resnet18(num_classes=6).eval()
+    engine = InferenceEngine({'alexnet': _alexnet(), 'resnet50': resnet}, capture=('alexnet',), cam=('resnet50',))
+    x = torch.randn(2, 3, 227, 227)
+    results = engine.run_batch(x)
+    print(f"CAMs: {[{n: c.shape for n, c in r['cams'].items()} for r in results]}")
+    # Only the small maps are kept for ResNet, not its layer4 activation
+    assert all(set(r['activations']) == {'alexnet'} and set(r['cams']) == {'resnet50'} for r in results)
+    body, head = split_feature_head(resnet)
+    with torch.no_grad():
+        expected = cam_from_activations(head, body(x[1:2]))
+    assert abs(results[1]['cams']['resnet50'] - expected).max() < 1e-6
@@ -0,0 +1,58 @@
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+from inference_service import InferenceEngine, InferenceScheduler, run_ensemble
+
+
+class TinyNet(nn.Module):
+    def __init__(self, seed):
+        super().__init__()
+        torch.manual_seed(seed)
+        self.fc = nn.Linear(3 * 8 * 8, 6)
+
+    def forward(self, x):
+        return self.fc(x.flatten(1))
+
+
+def _models():
+    return {'alexnet': TinyNet(0).eval(), 'resnet50': TinyNet(1).eval()}
+
+
+def test_batched_results_match_single_image_inference():
+    models_dict = _models()
+    scheduler = InferenceScheduler(InferenceEngine(models_dict).run_batch, max_batch_size=4, max_wait_ms=200)
+    images = [torch.randn(1, 3, 8, 8) for _ in range(6)]
+    results = [None] * len(images)
+
+    def worker(i):
+        results[i] = scheduler.predict(images[i], timeout=10)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(images))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for img, res in zip(images, results):
+        expected = run_ensemble(models_dict, img)
+        for name in models_dict:
+            assert res['per_model'][name].shape == (1, 6)
+            assert torch.allclose(res['per_model'][name], expected[name], atol=1e-6)
+
+    stats = scheduler.stats()
+    scheduler.shutdown()
+    print(f"Scheduler stats: {stats}")
+    assert stats['requests'] == 6
+    assert stats['max_batch_size_seen'] <= 4
+    assert stats['batches'] < 6  # at least some requests were coalesced
+
+
+def test_scheduler_limits_are_bounded():
+    scheduler = InferenceScheduler(InferenceEngine(_models()).run_batch, max_batch_size=10000, max_wait_ms=10 ** 6)
+    config = scheduler.stats()['config']
+    assert config['max_batch_size'] == 64
+    assert config['max_wait_ms'] == 1000.0
@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pickle
+import pytest
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from inference_service import InferenceEngine
+from inference_workers import (InferencePoolServer, InferencePoolClient, plan_threads, parse_address, pool_address,
+                               _result_to_numpy, _result_from_numpy)
+
+
+class TinyNet(nn.Module):
+    def __init__(self, seed):
+        super().__init__()
+        torch.manual_seed(seed)
+        self.body = nn.Sequential(nn.Conv2d(3, 4, 3), nn.ReLU())
+        self.head = nn.Sequential(nn.Flatten(), nn.Linear(4 * 6 * 6, 6))
+
+    def forward(self, x):
+        return self.head(self.body(x))
+
+
+def test_threads_are_split_without_oversubscribing_cores():
+    plan = plan_threads(3, cores=list(range(8)))
+    assert plan == [[0, 1], [2, 3], [4, 5]]
+    # More workers than cores: one core each, shared round-robin
+    assert plan_threads(4, cores=[0, 1]) == [[0], [1], [0], [1]]
+
+
+def test_address_parsing():
+    assert parse_address('127.0.0.1:6000') == ('127.0.0.1', 6000)
+    assert parse_address('/tmp/pool.sock') == '/tmp/pool.sock'
+
+
+def test_pool_socket_is_keyed_on_settings_and_weights():
+    args = ['--workers', '2', '--mode', 'full']
+    base = pool_address('/tmp/pool.sock', args, {'alexnet': 'a' * 64})
+    print(f"Pool address: {base}")
+    assert base.startswith('/tmp/pool.sock.') and base == pool_address('/tmp/pool.sock', args, {'alexnet': 'a' * 64})
+    # A restart with another ensemble mode or replaced weights must start its own pool
+    assert pool_address('/tmp/pool.sock', ['--workers', '2', '--mode', 'cascade'], {'alexnet': 'a' * 64}) != base
+    assert pool_address('/tmp/pool.sock', args, {'alexnet': 'b' * 64}) != base
+    assert pool_address('127.0.0.1:6000', args, {'alexnet': 'a' * 64}) == '127.0.0.1:6000'
+
+
+def test_results_survive_ipc_round_trip():
+    engine = InferenceEngine({'alexnet': TinyNet(0).eval(), 'resnet50': TinyNet(1).eval()})
+    results = engine.run_batch(torch.randn(2, 3, 8, 8))
+    restored = [_result_from_numpy(r) for r in pickle.loads(pickle.dumps([_result_to_numpy(r) for r in results]))]
+
+    for original, copy in zip(results, restored):
+        assert torch.equal(original['mean'], copy['mean'])
+        assert torch.equal(original['activations']['alexnet'], copy['activations']['alexnet'])
+        assert original['uncertainty'] == copy['uncertainty']
+        assert copy['models_used'] == ['alexnet', 'resnet50']
+
+
+def test_worker_dying_while_loading_fails_start():
+    # Missing engine options: the worker raises before it reports ready
+    server = InferencePoolServer('/tmp/unused.sock', b'test', num_workers=1, engine_options={})
+    with pytest.raises(RuntimeError, match='exited while loading'):
+        server.start_workers(timeout=60)
+    assert not any(p.is_alive() for p in server._workers.values())
+
+
+def test_pool_round_trip(tmp_path):
+    torch.manual_seed(0)
+    alexnet = models.alexnet(num_classes=6).eval()
+    weights = tmp_path / 'alexnet.pth'
+    torch.save(alexnet.state_dict(), weights)
+
+    # The client starts `python -m inference_workers` itself; it exits once the client is gone
+    client = InferencePoolClient(str(tmp_path / 'pool.sock'), b'test', timeout=120, log_path=str(tmp_path / 'pool.log'),
+                                 server_args=['--workers', '1', '--weights', f'alexnet={weights}', '--idle-exit', '2'])
+    batch = torch.randn(2, 3, 227, 227)
+    try:
+        results = client.run_batch(batch)
+    finally:
+        client.close()
+        print((tmp_path / 'pool.log').read_text()[-2000:])
+    expected = InferenceEngine({'alexnet': alexnet}, capture=('alexnet',)).run_batch(batch)
+
+    assert len(results) == 2
+    for original, pooled in zip(expected, results):
+        assert pooled['models_used'] == ['alexnet']
+        assert torch.allclose(original['mean'], pooled['mean'], atol=1e-5)
+        assert pooled['activations']['alexnet'].shape == original['activations']['alexnet'].shape
@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from model.architectures import get_mc_head, predict_with_uncertainty
+
+
+def _resnet(p=0.5):
+    torch.manual_seed(0)
+    m = models.resnet18(weights=None)
+    m.fc = nn.Sequential(nn.Dropout(p), nn.Linear(m.fc.in_features, 6))
+    return m
+
+
+def test_head_mode_is_reproducible_with_seed():
+    m = _resnet()
+    x = torch.randn(1, 3, 64, 64)
+    mean_a, unc_a = predict_with_uncertainty(m, x, num_samples=100, mode='head', seed=7)
+    mean_b, unc_b = predict_with_uncertainty(m, x, num_samples=100, mode='head', seed=7)
+    assert mean_a.shape == (1, 6)
+    assert torch.equal(mean_a, mean_b)
+    assert unc_a == unc_b
+    assert unc_a > 0
+
+
+def test_head_mode_matches_full_mode_statistics():
+    m = _resnet()
+    x = torch.randn(1, 3, 64, 64)
+    mean_head, unc_head = predict_with_uncertainty(m, x, num_samples=4000, mode='head', seed=1)
+    mean_full, unc_full = predict_with_uncertainty(m, x, num_samples=400, mode='full', seed=1)
+    assert torch.allclose(mean_head, mean_full, atol=0.02)
+    assert abs(unc_head - unc_full) < 0.5 * max(unc_head, unc_full)
+
+
+def test_head_mode_without_dropout_equals_eval_prediction():
+    m = _resnet(p=0.0).eval()
+    x = torch.randn(2, 3, 64, 64)
+    mean, unc = predict_with_uncertainty(m, x, num_samples=5, mode='head')
+    with torch.no_grad():
+        expected = torch.softmax(m(x), dim=1)
+    assert torch.allclose(mean, expected, atol=1e-6)
+    assert unc < 1e-10
+
+
+def test_auto_mode_falls_back_for_alexnet():
+    m = models.alexnet(weights=None)
+    assert get_mc_head(m) is None
+
+
+def test_default_mode_keeps_full_network_sampling():
+    m = _resnet()
+    x = torch.randn(1, 3, 64, 64)
+    mean_default, unc_default = predict_with_uncertainty(m, x, num_samples=5, seed=3)
+    mean_full, unc_full = predict_with_uncertainty(m, x, num_samples=5, mode='full', seed=3)
+    assert torch.equal(mean_default, mean_full) and unc_default == unc_full
@@ -0,0 +1,99 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from model.registry import ModelRegistry, RegistryError, LEGACY_VERSION
+from inference_service import InferenceRuntime, RuntimeRetired, use_serving_runtime
+from result_cache import ResultCache
+
+
+def _weights(tmp_path, name, payload):
+    path = tmp_path / f"{name}.pth"
+    path.write_bytes(payload)
+    return str(path)
+
+
+def test_register_verify_and_activate(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    assert registry.active_version() == LEGACY_VERSION
+
+    manifest = registry.register('v2', {'alexnet': _weights(tmp_path, 'a', b'alexnet-v2')}, notes='retrained')
+    checksums = registry.verify('v2')
+    print(f"Registered: {manifest['members']}")
+    assert checksums['alexnet'] == manifest['members']['alexnet']['sha256']
+    assert os.path.exists(registry.weight_files('v2')['alexnet'])
+    assert [m['version'] for m in registry.list_versions()] == [LEGACY_VERSION, 'v2']
+
+    registry.set_active('v2')
+    assert registry.active_version() == 'v2'
+    with pytest.raises(RegistryError):
+        registry.register('v2', {'alexnet': _weights(tmp_path, 'b', b'again')})
+
+
+def test_legacy_label_follows_the_weight_files(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    old = registry.version_label(LEGACY_VERSION, {'alexnet': 'a' * 64})
+    new = registry.version_label(LEGACY_VERSION, {'alexnet': 'b' * 64})
+    print(f"Legacy labels: {old} -> {new}")
+    # Replacing model/*.pth in place must not keep stamping predictions with the same version
+    assert old.startswith(LEGACY_VERSION + '-') and old != new and len(old) <= 64
+    assert registry.version_label('v2', {'alexnet': 'a' * 64}) == 'v2'
+
+
+def test_checksum_mismatch_and_bad_names_are_rejected(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    registry.register('v3', {'alexnet': _weights(tmp_path, 'a', b'original')})
+    with open(registry.weight_files('v3')['alexnet'], 'wb') as f:
+        f.write(b'tampered')
+
+    with pytest.raises(RegistryError):
+        registry.verify('v3')
+    with pytest.raises(RegistryError):
+        registry.set_active('missing')
+    with pytest.raises(RegistryError):
+        registry.manifest('../etc')
+
+
+def test_runtime_drains_in_flight_requests_before_shutdown():
+    runtime = InferenceRuntime('v1', {}, engine=None, runner=lambda batch: [])
+    finished = []
+
+    def request():
+        with runtime.use():
+            time.sleep(0.2)
+            finished.append('done')
+
+    t = threading.Thread(target=request)
+    t.start()
+    time.sleep(0.05)
+    assert runtime.in_flight == 1
+    assert runtime.drain(timeout=5) is True
+    assert finished == ['done'] and runtime.in_flight == 0
+    t.join()
+
+
+def test_a_request_racing_a_swap_is_pinned_to_the_new_runtime():
+    old = InferenceRuntime('v1', {}, engine=None, runner=lambda batch: [])
+    new = InferenceRuntime('v2', {}, engine=None, runner=lambda batch: [])
+    # The request read the old reference just before the swap, and the drain started first
+    reads = iter([old, new])
+    assert old.drain(timeout=1) is True
+    with pytest.raises(RuntimeRetired):
+        with old.use():
+            pass
+
+    with use_serving_runtime(lambda: next(reads)) as runtime:
+        assert runtime is new and new.in_flight == 1 and old.in_flight == 0
+    assert new.in_flight == 0
+
+
+def test_results_from_a_replaced_version_are_not_cached():
+    cache = ResultCache(max_entries=4, model_version='v1')
+    cache.set_model_version('v2')
+    cache.put('abc', {'result': 1}, model_version='v1')
+    assert cache.get('abc') is None
+    cache.put('abc', {'result': 2}, model_version='v2')
+    assert cache.get('abc') == {'result': 2}
@@ -0,0 +1,34 @@
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from inference_service import ModelWarmup, ModelsNotReady
+
+
+def test_requests_fail_fast_until_warmup_finishes():
+    release = threading.Event()
+    calls = []
+    warmup = ModelWarmup(lambda: release.wait(5), lambda: calls.append('warm')).start()
+
+    with pytest.raises(ModelsNotReady):
+        warmup.wait(0)
+    assert warmup.status()['ready'] is False
+
+    release.set()
+    warmup.wait(5)
+    status = warmup.status()
+    print(f"Warmup status: {status}")
+    assert status['state'] == 'ready' and calls == ['warm']
+    assert 'load_seconds' in status and 'warmup_seconds' in status
+
+
+def test_failed_loading_is_reported():
+    def broken():
+        raise RuntimeError("weights missing")
+
+    warmup = ModelWarmup(broken)
+    with pytest.raises(ModelsNotReady, match='weights missing'):
+        warmup.wait(5)  # lazy: wait() starts loading
+    assert warmup.status()['state'] == 'failed'
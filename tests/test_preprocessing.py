@@ -0,0 +1,66 @@
+import sys
+import os
+import io
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+import preprocessing
+from preprocessing import transform, decode_image, decode_display_image, pixels_to_tensor, load_image_tensor
+
+
+def _image_bytes(size, fmt):
+    rng = np.random.default_rng(0)
+    # Smooth gradient plus noise so JPEG draft scaling has real content to work with
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    base = np.stack([x * 255 // size[0], y * 255 // size[1], (x + y) * 127 // sum(size)], axis=-1)
+    pixels = np.clip(base + rng.integers(-10, 10, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=fmt)
+    buf.seek(0)
+    return buf
+
+
+def test_small_png_matches_transform_exactly():
+    data = _image_bytes((300, 250), 'PNG')
+    expected = transform(Image.open(data).convert('RGB'))
+    data.seek(0)
+    assert torch.equal(pixels_to_tensor(decode_image(data)), expected)
+
+
+def test_large_jpeg_draft_decode_is_close_to_full_decode():
+    data = _image_bytes((1816, 1816), 'JPEG')
+    expected = transform(Image.open(data).convert('RGB'))
+    data.seek(0)
+    out = np.zeros((227, 227, 3), dtype=np.uint8)
+    pixels = decode_image(data, out=out)
+    assert pixels is out
+    diff = (pixels_to_tensor(pixels) - expected).abs()
+    print(f"Draft decode diff: mean {diff.mean().item():.4f}, max {diff.max().item():.4f}")
+    assert diff.mean().item() < 0.05
+
+
+def test_reused_buffer_does_not_alias_returned_tensors(tmp_path):
+    first, second = tmp_path / 'a.png', tmp_path / 'b.png'
+    Image.new('RGB', (64, 64), (255, 0, 0)).save(first)
+    Image.new('RGB', (64, 64), (0, 0, 255)).save(second)
+    a = load_image_tensor(str(first))
+    b = load_image_tensor(str(second))
+    assert a[0].mean() > b[0].mean()
+
+
+def test_oversized_image_is_rejected_before_decoding(monkeypatch):
+    monkeypatch.setattr(preprocessing, 'MAX_DECODE_PIXELS', 100 * 100)
+    with pytest.raises(ValueError):
+        decode_image(_image_bytes((200, 200), 'PNG'))
+
+
+def test_display_decode_keeps_the_aspect_ratio():
+    for fmt in ('PNG', 'JPEG'):
+        pixels = decode_display_image(_image_bytes((1600, 1200), fmt), 470)
+        print(f"{fmt}: {pixels.shape}")
+        assert pixels.shape == (352, 470, 3) and pixels.dtype == np.uint8
+    # Small images are scaled up to the panel, like imshow filling its axes
+    assert decode_display_image(_image_bytes((100, 200), 'PNG'), 470).shape == (470, 235, 3)
@@ -0,0 +1,48 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.nn as nn
+import torchvision.models as models
+from inference_service import InferenceEngine
+from model.architectures import gradcam_from_activations
+from model.quantization import QUANTIZATION_AVAILABLE, quantize_member, held_out_samples
+
+
+def test_quantized_alexnet_tracks_fp32_and_supports_gradcam():
+    if not QUANTIZATION_AVAILABLE:
+        print("Skipping quantization test - torch.ao.quantization not available")
+        return
+    torch.manual_seed(0)
+    fp32 = models.alexnet(weights=None)
+    fp32.classifier[6] = nn.Linear(fp32.classifier[6].in_features, 6)
+    fp32.eval()
+
+    calibration = [torch.randn(4, 3, 227, 227) for _ in range(2)]
+    int8 = quantize_member(fp32, calibration)
+
+    x = torch.randn(2, 3, 227, 227)
+    with torch.no_grad():
+        p32 = torch.softmax(fp32(x), dim=1)
+        p8 = torch.softmax(int8(x), dim=1)
+    assert (p32 - p8).abs().max() < 0.05
+
+    engine = InferenceEngine({'alexnet': int8})
+    result = engine.run_batch(x[:1])[0]
+    cam = gradcam_from_activations(engine.explain_head('alexnet'), result['activations']['alexnet'], 0)
+    assert cam.shape == (6, 6)
+
+
+def test_parity_samples_exclude_calibration_images(tmp_path):
+    for class_name in ('glaucoma', 'normal'):
+        os.makedirs(tmp_path / class_name)
+        for i in range(5):
+            (tmp_path / class_name / f'{i}.png').write_bytes(b'')
+
+    held_out = held_out_samples(str(tmp_path), calibration_per_class=2)
+    print(f"Held out: {[os.path.basename(p) for p, _ in held_out]}")
+    assert len(held_out) == 6
+    assert not any(os.path.basename(p) in ('0.png', '1.png') for p, _ in held_out)
+    assert len(held_out_samples(str(tmp_path), calibration_per_class=2, per_class=1)) == 2
+    assert held_out_samples(str(tmp_path), calibration_per_class=5) == []
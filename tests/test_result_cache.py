@@ -0,0 +1,39 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import ResultCache, content_hash
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = ResultCache(max_entries=2, model_version='v1')
+    a, b, c = content_hash(b'a'), content_hash(b'b'), content_hash(b'c')
+    cache.put(a, {'heatmap_path': 'a.png'})
+    cache.put(b, {'heatmap_path': 'b.png'})
+    assert cache.get(a)['heatmap_path'] == 'a.png'  # a is now most recent
+    cache.put(c, {'heatmap_path': 'c.png'})
+
+    assert cache.get(b) is None
+    assert cache.get(a) is not None and cache.get(c) is not None
+    stats = cache.stats()
+    print(f"Cache stats: {stats}")
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+
+
+def test_model_version_change_invalidates_entries():
+    cache = ResultCache(max_entries=8, model_version='v1')
+    digest = content_hash(b'scan')
+    cache.put(digest, {'heatmap_path': None})
+    cache.set_model_version('v1')
+    assert cache.get(digest) is not None
+
+    cache.set_model_version('v2')
+    assert cache.get(digest) is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_zero_size_disables_cache():
+    cache = ResultCache(max_entries=0)
+    cache.put('x', {'heatmap_path': None})
+    assert cache.get('x') is None
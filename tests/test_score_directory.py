@@ -0,0 +1,61 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+from PIL import Image
+from score_directory import list_images, load_checkpoint, result_rows, read_checkpoint_frame, FIELDS, NUMERIC_FIELDS
+
+
+def test_list_images_is_recursive_and_sorted(tmp_path):
+    (tmp_path / 'b').mkdir()
+    for name in ('b/2.jpg', 'a.png', 'notes.txt', 'b/1.JPEG'):
+        (tmp_path / name).write_bytes(b'x')
+    assert list_images(str(tmp_path)) == ['a.png', os.path.join('b', '1.JPEG'), os.path.join('b', '2.jpg')]
+
+
+def test_checkpoint_drops_half_written_row(tmp_path):
+    partial = tmp_path / 'out.csv.partial.csv'
+    partial.write_text(','.join(FIELDS) + '\na.png,normal\nb.png,glau')
+    assert load_checkpoint(str(partial)) == {'a.png'}
+    assert partial.read_text().endswith('a.png,normal\n')
+    assert load_checkpoint(str(tmp_path / 'missing.csv')) == set()
+
+
+def test_result_rows_keep_undecodable_images():
+    mean = torch.tensor([[0.1, 0.1, 0.5, 0.1, 0.1, 0.1]])
+    decoded = [('a.png', np.zeros((227, 227, 3), np.uint8), None), ('b.png', None, 'OSError: truncated')]
+    rows = result_rows(decoded, [{'mean': mean, 'uncertainty': 0.02, 'models_used': ['alexnet']}], 'v2')
+    print(f"Rows: {rows}")
+    assert rows[0]['predicted_class'] == 'glaucoma' and rows[0]['prob_glaucoma'] == 0.5
+    assert rows[0]['model_version'] == 'v2'
+    assert rows[1] == {'path': 'b.png', 'error': 'OSError: truncated'}
+
+
+def test_single_model_rows_have_empty_uncertainty():
+    # Cascade rows that were not escalated (and AlexNet-only loads) have no across-model variance
+    mean = torch.tensor([[0.05, 0.05, 0.05, 0.75, 0.05, 0.05]])
+    decoded = [('a.png', np.zeros((227, 227, 3), np.uint8), None)]
+    rows = result_rows(decoded, [{'mean': mean, 'uncertainty': None, 'models_used': ['alexnet']}], 'v2')
+    print(f"Rows: {rows}")
+    assert rows[0]['predicted_class'] == 'normal' and rows[0]['uncertainty'] == ''
+    assert rows[0]['models_used'] == 'alexnet' and rows[0]['error'] == ''
+
+
+def test_checkpoint_frame_keeps_numeric_columns_numeric(tmp_path):
+    import csv
+    mean = torch.tensor([[0.05, 0.05, 0.05, 0.75, 0.05, 0.05]])
+    decoded = [('a.png', np.zeros((227, 227, 3), np.uint8), None), ('b.png', None, 'OSError: truncated')]
+    rows = result_rows(decoded, [{'mean': mean, 'uncertainty': None, 'models_used': ['alexnet']}], 'v2')
+    partial = tmp_path / 'out.parquet.partial.csv'
+    with open(partial, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    frame = read_checkpoint_frame(str(partial))
+    # A failed row must not turn confidence and the probabilities into strings
+    assert all(frame[field].dtype.kind == 'f' for field in NUMERIC_FIELDS)
+    assert frame['prob_normal'][0] == 0.75 and np.isnan(frame['confidence'][1])
+    assert frame['error'][1] == 'OSError: truncated' and frame['error'][0] == ''
@@ -0,0 +1,72 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+from flask import Flask
+from models import db, User, Prediction, ShadowPrediction
+from model.architectures import get_model
+from shadow_service import ShadowEvaluator, shadow_report
+
+CLASSES = ['cataract', 'diabetic_retinopathy', 'glaucoma', 'normal', 'redness', 'wrinkles']
+
+
+def _app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'shadow.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, email='pat@x', name='Pat', user_type='patient'))
+        db.session.commit()
+    return app
+
+
+def _analyze(evaluator, pixels, commit=True):
+    prediction = Prediction(patient_id=1, image_path='eye.png', predicted_class='normal', confidence=0.8)
+    db.session.add(prediction)
+    evaluator.mirror(db.session, prediction, pixels, 12.5)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+
+def test_sampled_inputs_are_scored_after_commit_only(tmp_path):
+    app = _app(tmp_path)
+    weights = tmp_path / 'candidate.pth'
+    torch.save(get_model('alexnet', len(CLASSES), pretrained=False).state_dict(), weights)
+    evaluator = ShadowEvaluator(app, 'alexnet', str(weights), CLASSES, sample_rate=1.0)
+    pixels = np.random.default_rng(0).integers(0, 255, (227, 227, 3), dtype=np.uint8)
+
+    with app.app_context():
+        _analyze(evaluator, pixels, commit=False)
+        _analyze(evaluator, pixels)
+
+    deadline = time.time() + 60
+    while evaluator.stats()['evaluated'] + evaluator.stats()['errors'] < 1 and time.time() < deadline:
+        time.sleep(0.05)
+    print(f"Shadow stats: {evaluator.stats()}")
+    with app.app_context():
+        rows = ShadowPrediction.query.all()
+        assert len(rows) == 1 and evaluator.stats()['sampled'] == 1
+        assert rows[0].production_class == 'normal' and rows[0].production_latency_ms == 12.5
+        assert rows[0].predicted_class in CLASSES and rows[0].latency_ms > 0
+
+
+def test_report_agreement_and_deltas():
+    rows = [SimpleNamespace(production_class='normal', predicted_class='normal', agrees=True,
+                            confidence=0.9, production_confidence=0.8, latency_ms=20.0, production_latency_ms=10.0),
+            SimpleNamespace(production_class='glaucoma', predicted_class='normal', agrees=False,
+                            confidence=0.5, production_confidence=0.7, latency_ms=30.0, production_latency_ms=12.0)]
+    report = shadow_report(rows)
+    print(f"Shadow report: {report}")
+    assert report['samples'] == 2 and report['agreement'] == 0.5
+    assert report['per_class']['glaucoma']['agreement'] == 0.0
+    assert report['top_disagreements'] == {'glaucoma -> normal': 1}
+    assert abs(report['confidence_delta']['mean'] - (-0.05)) < 1e-9
+    assert report['latency_ms']['candidate']['p50'] == 25.0
+    assert shadow_report([]) == {'samples': 0}